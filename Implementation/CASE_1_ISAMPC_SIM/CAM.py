@@ -1,5 +1,6 @@
 import numpy as np
 from numpy.linalg import matrix_power
+from IMM_Store import Dense, Legacy
 
 class CAM( ): # Constant acceleration model for modeling SV3 in Case 1 and 2
     def __init__(self, Params):
@@ -68,57 +69,44 @@ class CAM( ): # Constant acceleration model for modeling SV3 in Case 1 and 2
             
         return X_KF
     
-    def Final_Return(self, k, X_Hat, Y, car_index): # Return computation results
+    def Final_Return(self, k, X_Hat, Y, car_index): # Return computation results, dense over the modes and handed back in the legacy per-mode list format
         H = self.H
         N = self.N
         N_M = self.N_M
+        DSV = self.DSV
         Models = self.Models
         L_Center = self.L_Center
         
-        x_hat_k = list( )
-        x_hat_k_1 = X_Hat[k - 1][car_index] 
+        x_hat_k_1, _ = Dense(X_Hat[k - 1][car_index], N_M, (DSV, )) 
         
         mu_k = np.array([0, 0, 0, 0, 0, 0, 1])
         REF_Speed = [None, None, None, None, None, None, 0]
         m_k = 6
         
-        for i in range(N_M):
-            if mu_k[i] == 0: 
-                x_hat_k.append(None)
-            else:
-                Temp = self.Constant_Acc(x_hat_k_1[i], 1)
-                x_hat_k.append(Temp[:, 1])
+        active = mu_k != 0
+        x_hat_k = np.zeros((N_M, DSV))
+        for i in np.flatnonzero(active):
+            Temp = self.Constant_Acc(x_hat_k_1[i], 1)
+            x_hat_k[i] = Temp[:, 1]
         
         p_k = None
         x_state_k = x_hat_k[m_k]
         x_pre_k = self.Constant_Acc(x_state_k, N)
         y_k_plus_1 = H@x_pre_k[:, 1] 
         
-        x_po_all_k = list( )
-        x_var_k = list( ) 
-        y_var_k = list( )
+        x_po_all_k = np.zeros((N_M, DSV, N + 1))
+        x_var_k = np.zeros((N_M, N + 1)) 
+        y_var_k = np.zeros((N_M, N + 1)) 
         
-        for i in range(N_M):
-            if np.sum(x_hat_k[i]) == None:
-                temp_tra = None
-                temp_x_var = None
-                temp_y_var = None
+        for i in np.flatnonzero(active):
+            if i == m_k:
+                x_po_all_k[i] = x_pre_k
             else:
-                if i == m_k:
-                    temp_tra = x_pre_k
-                else:
-                    K_Lon = Models[i][0]
-                    K_Lat = Models[i][1]
-                    temp_tra = self.VelocityTracking(x_hat_k[i], x_hat_k[i][1], i, N, K_Lon, K_Lat)
-                
-                temp_x_var = np.array([0]*(N+1))
-                temp_y_var = np.array([0]*(N+1))
-                    
-            x_po_all_k.append(temp_tra)
-            x_var_k.append(temp_x_var)
-            y_var_k.append(temp_y_var)
+                K_Lon = Models[i][0]
+                K_Lat = Models[i][1]
+                x_po_all_k[i] = self.VelocityTracking(x_hat_k[i], x_hat_k[i][1], i, N, K_Lon, K_Lat)
                 
-        return REF_Speed[m_k], L_Center[2], REF_Speed, mu_k, m_k, x_hat_k, p_k, x_state_k, x_pre_k, y_k_plus_1, x_po_all_k, x_var_k, y_var_k
+        return REF_Speed[m_k], L_Center[2], REF_Speed, mu_k, m_k, Legacy(x_hat_k, active), p_k, x_state_k, x_pre_k, y_k_plus_1, Legacy(x_po_all_k, active), Legacy(x_var_k, active), Legacy(y_var_k, active)
                     
 
     
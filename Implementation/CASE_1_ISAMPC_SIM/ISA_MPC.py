@@ -1,9 +1,13 @@
 import numpy as np
 import time
 import casadi
-from numpy.linalg import matrix_power
-from scipy.stats import multivariate_normal
-from skimage import measure
+from Model_Table import Model_Table
+from IMM_Store import IMM_Store
+from MPC_Solver import MPC_Solver
+from GMM_Occupancy import GMM_Occupancy
+from Occupancy_Cache import Occupancy_Cache
+from Occupancy_Reuse import Occupancy_Reuse
+from Occupancy_Pool import Occupancy_Pool
 
 class ISA_MPC( ): # The ISA-MPC for EV planning
     def __init__(self, Params):
@@ -43,75 +47,49 @@ class ISA_MPC( ): # The ISA-MPC for EV planning
         self.Q5 = Params['Q5']
         self.Q6 = Params['Q6']
         self.Q7 = Params['Q7']
-        self.LongVelProj = self.construct_QP( )
-        self.EVplanning  = self.contruct_MT_MPC( )
+        self.occ_method  = Params.get('occ_method', 'contour') # 'contour': grid + contour tracing, 'mask': thresholded grid, 'adaptive': coarse-to-fine grid, 'analytic': grid-free level-set bound
+        self.occ_batch   = Params.get('occ_batch', False) # evaluate all SVs and horizon steps in one batch of the occ_method engine, after occupancy reuse and cache
+        self.Occupancy   = GMM_Occupancy(Params)
+        self.Cache       = Occupancy_Cache(Params)
+        self.Reuse       = Occupancy_Reuse(Params, self.occ_method)
+        self.Pool        = Occupancy_Pool(Params, self.Occupancy)
+        self.Store       = IMM_Store(Params) # dense IMM results of the SVs ahead of the EV, refilled every cycle
+        self.Table       = Model_Table(Params, [[self.K_Lon_EV, self.K_Lat_EV]]) # EV tracking model as a single sub-model, lane reference passed per call
+        self.qp_method   = Params.get('qp_method', 'analytic') # 'analytic': closed-form projection of the primary speed, 'ipopt': the QP solved by IPOPT
+        self.LongVelProj = dict( ) # IPOPT problems keyed on the row count: the selected rows compacted into the smallest power of two holding them, the padding switched off by a zero row weight, built on first use
+        self.EVplanning  = self.contruct_MT_MPC(Params)
     
     def VelocityTracking(self, x_ini, vx_ref, m, n_step): # velocity tracking model
-        Ts = self.Ts
         L_Center = self.L_Center
-        DSV = self.DSV
-        K_Lon = self.K_Lon_EV
-        K_Lat = self.K_Lat_EV
-        k_lo_1 = K_Lon[0]
-        k_lo_2 = K_Lon[1]
-        k_la_1 = K_Lat[0]
-        k_la_2 = K_Lat[1]
-        k_la_3 = K_Lat[2] 
         y_ref = L_Center[m]
-        F = np.array([[1, Ts, Ts**2/2, 0, 0, 0],
-                      [0, 1-k_lo_1*Ts**2/2, Ts-k_lo_2*(Ts**2)/2, 0, 0, 0],
-                      [0, -k_lo_1*Ts, 1-k_lo_2*Ts, 0, 0, 0],
-                      [0, 0, 0, 1-k_la_1*(Ts**3)/6, Ts-k_la_2*(Ts**3)/6, Ts**2/2-k_la_3*(Ts**3)/6],
-                      [0, 0, 0, -k_la_1*(Ts**2)/2, 1-k_la_2*(Ts**2)/2, Ts-k_la_3*(Ts**2)/2],
-                      [0, 0, 0, -k_la_1*Ts, -k_la_2*Ts, 1-k_la_3*Ts]]) 
-        E = np.array([0, k_lo_1*(Ts**2)/2*vx_ref, k_lo_1*Ts*vx_ref, (Ts**3)/6*k_la_1*y_ref, (Ts**2)/2*k_la_1*y_ref, Ts*k_la_1*y_ref]) 
-        X_KF = np.zeros((DSV, n_step+1))
-        X_KF[:, 0] = x_ini
             
-        for i in range(1, n_step+1):
-            X_KF[:, i] = (F@X_KF[:, i-1]) + E
-            
-        return F, X_KF
+        return self.Table.Rollout(0, x_ini, vx_ref, y_ref, n_step)
         
     def LaneTracking(self, initial_y, m): # lane tracking model
         L_Center = self.L_Center
-        Ts = self.Ts
-        N = self.N
-        K_Lat = self.K_Lat_EV
-        k_la_1 = K_Lat[0]
-        k_la_2 = K_Lat[1]
-        k_la_3 = K_Lat[2]
         y_ref = L_Center[m]
-        A = np.array([[1-k_la_1*(Ts**3)/6, Ts-k_la_2*(Ts**3)/6, (Ts**2)/2-k_la_3*(Ts**3)/6],
-                      [-k_la_1*(Ts**2)/2, 1-k_la_2*(Ts**2)/2, Ts-k_la_3*(Ts**2)/2],
-                      [-k_la_1*Ts, -k_la_2*Ts, 1-k_la_3*Ts]])
-        B = np.array([(Ts**3)/6*k_la_1, (Ts**2)/2*k_la_1, Ts*k_la_1])*y_ref
-        Y = np.zeros((3, N + 1))
-        Y[:, 0] = initial_y
-        
-        for i in range(1, N+1):
-            Y[:, i] =  (A@Y[:, i-1]) + B    
         
-        return Y[0, :] 
+        return self.Table.Lateral(0, initial_y, y_ref)
     
-    def LookLane(self, y_k): # check lane index according to the current lateral position
+    def LookLane(self, y_k): # check lane index according to the current lateral position, y_k may be a scalar or an array
         L_Bound = self.L_Bound
-        if (y_k <= L_Bound[1]): 
-            LanePos = 1
-        elif (L_Bound[1] < y_k) and (y_k <= L_Bound[2]):
-            LanePos = 2
-        elif (L_Bound[2] < y_k):
-            LanePos = 3
+        N_Lane = self.N_Lane
+        LanePos = np.digitize(y_k, L_Bound[1:N_Lane], right=True) + 1
         
         return LanePos
     
     def SafetyAwareOccupancy(self, Obst_k, MU_k, X_Po_All_k, X_Var_k, Y_Var_k, x_EV_k): # Formulate the obstacle occupancy based on the GMM models
+        if self.occ_batch or self.Pool.enable:
+            return self.SafetyAwareOccupancy_Batch(Obst_k, MU_k, X_Po_All_k, X_Var_k, Y_Var_k, x_EV_k)
         N_Lane = self.N_Lane
         N_Car = self.N_Car
         N_M = self.N_M
         N = self.N
         infinity = self.infinity
         varsigma = 0.0001 
+        Car = [i for i in range(N_Car) if (np.sum(Obst_k[i]) != None) and (Obst_k[i][0, 0] >= x_EV_k)]
+        self.Store.Load(MU_k, X_Po_All_k, X_Var_k, Y_Var_k, Car)
+        Store = self.Store
         OCC_Horizon_SV = list( )
         x_position = np.zeros((N_Car, N + 1))
         y_mark_low = np.zeros((N_Car, N + 1))
@@ -119,47 +97,29 @@ class ISA_MPC( ): # The ISA-MPC for EV planning
         y_mark_up = np.zeros((N_Car, N + 1))
 
         for i in range(N_Car): 
-            if (np.sum(Obst_k[i]) != None) and (Obst_k[i][0, 0] >= x_EV_k): 
-                x_nominal = list( ) 
-                y_nominal = list( )
-                x_variance = list( ) 
-                y_variance = list( )
-                model_pro = list( ) 
-                for j in range(N_M): 
-                    if MU_k[i][j] != 0: 
-                        x_nominal.append(X_Po_All_k[i][j][0, :]) 
-                        y_nominal.append(X_Po_All_k[i][j][3, :]) 
-                        x_variance.append(X_Var_k[i][j])
-                        y_variance.append(Y_Var_k[i][j]) 
-                        model_pro.append(MU_k[i][j]) 
+            if Store.Car[i]: 
+                Active = Store.Active[i]
+                x_nominal = Store.X_Po_All[i, Active, 0, :] 
+                y_nominal = Store.X_Po_All[i, Active, 3, :]
+                x_variance = Store.X_Var[i, Active] 
+                y_variance = Store.Y_Var[i, Active]
+                model_pro = Store.MU[i, Active] 
                 OCC_Step_SV = np.ones((4, N+1)) 
-                max_y_mark = np.array([None]*(N + 1)) 
-                mid_y_mark = np.array([None]*(N + 1)) 
-                min_y_mark = np.array([None]*(N + 1)) 
                 leng_vec = len(model_pro) 
-                x_nom_vec = np.array([None]*leng_vec) 
-                y_nom_vec = np.array([None]*leng_vec) 
-                x_var_vec = np.array([None]*leng_vec, dtype=float) 
-                y_var_vec = np.array([None]*leng_vec, dtype=float) 
-                model_pro = np.array(model_pro) 
-                for h in range(N + 1): 
-                    for k in range(leng_vec):
-                        x_nom_vec[k] = x_nominal[k][h]
-                        y_nom_vec[k] = y_nominal[k][h]
-                        x_var_vec[k] = x_variance[k][h] + varsigma
-                        y_var_vec[k] = y_variance[k][h] + varsigma
-                    occ_k = self.GMM_Model(x_nom_vec, y_nom_vec, x_var_vec, y_var_vec, model_pro, leng_vec)
-                    OCC_Step_SV[:, h] = occ_k
-                    max_y = occ_k[1] + occ_k[3] 
-                    min_y = occ_k[1] - occ_k[3] 
-                    max_y_mark[h] = self.LookLane(max_y)
-                    mid_y_mark[h] = self.LookLane(occ_k[1])
-                    min_y_mark[h] = self.LookLane(min_y)
+                if self.Reuse.enable:
+                    Pro_i, Anchor, Desc_Ref = self.Reuse.Describe(Store.MU[i], x_nominal, y_nominal, x_variance, y_variance)
+                    OCC_Step_SV, Reused, Desc_Ref = self.Reuse.Lookup(i, Pro_i, Anchor, Desc_Ref)
+                else:
+                    Reused = np.zeros(N + 1, dtype=bool)
+                Steps = np.flatnonzero(~Reused)
+                OCC_Step_SV[:, Steps] = self.GMM_Horizon(x_nominal[:, Steps], y_nominal[:, Steps], x_variance[:, Steps] + varsigma, y_variance[:, Steps] + varsigma, model_pro, leng_vec)
+                if self.Reuse.enable:
+                    self.Reuse.Store(i, Pro_i, Anchor, Desc_Ref, OCC_Step_SV)
                 OCC_Horizon_SV.insert(i, OCC_Step_SV)
                 x_position[i, :] = OCC_Step_SV[0, :] - OCC_Step_SV[2, :]
-                y_mark_up[i, :] = max_y_mark
-                y_mark_middle[i, :] = mid_y_mark
-                y_mark_low[i, :] = min_y_mark
+                y_mark_up[i, :] = self.LookLane(OCC_Step_SV[1, :] + OCC_Step_SV[3, :])
+                y_mark_middle[i, :] = self.LookLane(OCC_Step_SV[1, :])
+                y_mark_low[i, :] = self.LookLane(OCC_Step_SV[1, :] - OCC_Step_SV[3, :])
             else:
                 OCC_Horizon_SV.append(None)
                 x_position[i, :] = np.array([infinity]*(N + 1))
@@ -167,81 +127,131 @@ class ISA_MPC( ): # The ISA-MPC for EV planning
                 y_mark_middle[i, :] = np.array([0]*(N + 1))
                 y_mark_low[i, :] = np.array([0]*(N + 1))
         
-        Temp_up = np.array([infinity]*(N + 1))
-        Temp_middle = np.array([infinity]*(N + 1))
-        Temp_low = np.array([infinity]*(N + 1))
-        X_DV_Lane = [Temp_up, Temp_middle, Temp_low]
-        for i in range(N_Lane):
-            for k in range(N + 1):
-                index_up =     np.where(y_mark_up[:, k] == i+1)
-                index_middle = np.where(y_mark_middle[:, k] == i+1)
-                index_low =    np.where(y_mark_low[:, k] == i+1)
-                if len(index_up[0]) == 0:
-                    temp_lane_up = infinity
-                else:
-                    temp_lane_up = np.min(x_position[:, k][index_up[0]])
-                if len(index_middle[0]) == 0:
-                    temp_lane_middle = infinity
-                else:
-                    temp_lane_middle = np.min(x_position[:, k][index_middle[0]])
-                if len(index_low[0]) == 0:
-                    temp_lane_low = infinity
-                else:
-                    temp_lane_low = np.min(x_position[:, k][index_low[0]])
-                X_DV_Lane[i][k] = np.min([temp_lane_up, temp_lane_middle, temp_lane_low])
+        X_DV_Lane = self.LaneLeader(x_position, y_mark_up, y_mark_middle, y_mark_low)
     
         return OCC_Horizon_SV, X_DV_Lane
                 
+    def SafetyAwareOccupancy_Batch(self, Obst_k, MU_k, X_Po_All_k, X_Var_k, Y_Var_k, x_EV_k): # Formulate the obstacle occupancy of all SVs over the horizon in one batch
+        N_Car = self.N_Car
+        N_M = self.N_M
+        N = self.N
+        epsilon = self.epsilon
+        infinity = self.infinity
+        Car = [i for i in range(N_Car) if (np.sum(Obst_k[i]) != None) and (Obst_k[i][0, 0] >= x_EV_k)]
+        self.Store.Load(MU_k, X_Po_All_k, X_Var_k, Y_Var_k, Car)
+        OCC = self.Horizon_Occupancy(Car, Car, epsilon)
+        OCC_Horizon_SV = [None]*N_Car
+        for c, i in enumerate(Car):
+            OCC_Horizon_SV[i] = OCC[c]
+        x_position = np.full((N_Car, N + 1), infinity, dtype=float)
+        y_mark_low = np.zeros((N_Car, N + 1))
+        y_mark_middle = np.zeros((N_Car, N + 1))
+        y_mark_up = np.zeros((N_Car, N + 1))
+        x_position[Car, :] = OCC[:, 0, :] - OCC[:, 2, :]
+        y_mark_up[Car, :] = self.LookLane(OCC[:, 1, :] + OCC[:, 3, :])
+        y_mark_middle[Car, :] = self.LookLane(OCC[:, 1, :])
+        y_mark_low[Car, :] = self.LookLane(OCC[:, 1, :] - OCC[:, 3, :])
+        X_DV_Lane = self.LaneLeader(x_position, y_mark_up, y_mark_middle, y_mark_low)
+
+        return OCC_Horizon_SV, X_DV_Lane
+
+    def Horizon_Occupancy(self, Car, Key, epsilon): # occupancies (len(Car), 4, N+1) of the loaded SVs Car: reused steps, then cached pairs, then the rest in one batch of the occ_method engine
+        N = self.N
+        varsigma = 0.0001
+        Store = self.Store
+        X_Nom = Store.X_Po_All[Car, :, 0, :]
+        Y_Nom = Store.X_Po_All[Car, :, 3, :]
+        X_Var = np.where(Store.Active[Car, :, None], Store.X_Var[Car] + varsigma, 1)
+        Y_Var = np.where(Store.Active[Car, :, None], Store.Y_Var[Car] + varsigma, 1)
+        Pro = Store.MU[Car]
+        OCC = np.ones((len(Car), 4, N + 1))
+        Need = np.ones((len(Car), N + 1), dtype=bool)
+        Ref = [None]*len(Car)
+        Miss = dict( )
+        if self.Reuse.enable:
+            for c, i in enumerate(Car):
+                Active = Store.Active[i]
+                Pro_i, Anchor, Desc_Ref = self.Reuse.Describe(Store.MU[i], Store.X_Po_All[i, Active, 0, :], Store.X_Po_All[i, Active, 3, :], Store.X_Var[i, Active], Store.Y_Var[i, Active])
+                OCC[c], Reused, Desc_Ref = self.Reuse.Lookup(Key[c], Pro_i, Anchor, Desc_Ref)
+                Need[c] = ~Reused
+                Ref[c] = (Pro_i, Anchor, Desc_Ref)
+        if self.Cache.enable:
+            for c, h in zip(*np.nonzero(Need)):
+                Active = Store.Active[Car[c]]
+                key, origin = self.Cache.Key(X_Nom[c, Active, h], Y_Nom[c, Active, h], X_Var[c, Active, h], Y_Var[c, Active, h], Pro[c, Active], epsilon)
+                occ_k = self.Cache.Lookup(key, origin)
+                if occ_k is None:
+                    Miss[(c, h)] = (key, origin)
+                else:
+                    OCC[c, :, h] = occ_k
+                    Need[c, h] = False
+        if np.any(Need):
+            Engine = self.Pool if self.Pool.enable else self.Occupancy
+            OCC = np.where(Need[:, None, :], Engine.Horizon_Bound(X_Nom, Y_Nom, X_Var, Y_Var, Pro, epsilon, self.occ_method, Need), OCC)
+        for (c, h), (key, origin) in Miss.items( ):
+            self.Cache.Store(key, origin, OCC[c, :, h])
+        if self.Reuse.enable:
+            for c in range(len(Car)):
+                self.Reuse.Store(Key[c], *Ref[c], OCC[c])
+
+        return OCC
+
+    def LaneLeader(self, x_position, y_mark_up, y_mark_middle, y_mark_low): # the closest occupancy rear end in each lane over the horizon
+        N_Lane = self.N_Lane
+        infinity = self.infinity
+        Lane = np.arange(1, N_Lane + 1)[:, None, None]
+        In_Lane = (y_mark_up[None, :, :] == Lane) | (y_mark_middle[None, :, :] == Lane) | (y_mark_low[None, :, :] == Lane) # (N_Lane, N_Car, N+1)
+        X_DV_Lane = np.min(np.where(In_Lane, x_position[None, :, :], infinity), axis=1, initial=infinity)
+        X_DV_Lane = X_DV_Lane.astype(np.asarray(infinity).dtype) # same dtype as the per-lane buffers filled with infinity before
+
+        return list(X_DV_Lane)
+
+    def GMM_Horizon(self, x_nom_mat, y_nom_mat, x_var_mat, y_var_mat, model_pro, leng_vec): # GMM occupancies (4, H) of one SV at H horizon steps, modes (M, H); the analytic engine takes the uncached steps in one batch
+        epsilon = self.epsilon
+        H = x_nom_mat.shape[1]
+        OCC = np.ones((4, H))
+        if self.occ_method != 'analytic':
+            for h in range(H):
+                OCC[:, h] = self.GMM_Model(x_nom_mat[:, h], y_nom_mat[:, h], x_var_mat[:, h], y_var_mat[:, h], model_pro, leng_vec)
+            return OCC
+        Step = list( )
+        Miss = dict( )
+        for h in range(H):
+            if self.Cache.enable:
+                key, origin = self.Cache.Key(x_nom_mat[:, h], y_nom_mat[:, h], x_var_mat[:, h], y_var_mat[:, h], model_pro, epsilon)
+                occ_k = self.Cache.Lookup(key, origin)
+                if occ_k is not None:
+                    OCC[:, h] = occ_k
+                    continue
+                Miss[h] = (key, origin)
+            Step.append(h)
+        if len(Step) > 0:
+            Pro = np.tile(model_pro, (len(Step), 1))
+            OCC[:, Step] = self.Occupancy.Analytic_Bound(x_nom_mat[:, Step].T, y_nom_mat[:, Step].T, x_var_mat[:, Step].T, y_var_mat[:, Step].T, Pro, epsilon).T
+        for h, (key, origin) in Miss.items( ):
+            self.Cache.Store(key, origin, OCC[:, h])
+
+        return OCC
+
     def GMM_Model(self, x_nom_vec, y_nom_vec, x_var_vec, y_var_vec, model_pro, leng_vec): # GMM model for constructing the ostacle occupancy
         epsilon = self.epsilon
-        w_veh = self.w_veh
-        l_veh = self.l_veh
-        zeta_w = self.zeta_w
-        zeta_l = self.zeta_l
-        x_sig_vec = np.sqrt(x_var_vec) 
-        y_sig_vec = np.sqrt(y_var_vec) 
-        hx = 0.55 
-        hy = 0.15 
-        min_x = np.min(x_nom_vec) - 3*np.max(x_sig_vec) - hx
-        min_y = np.min(y_nom_vec) - 3*np.max(y_sig_vec) - hy
-        max_x = np.max(x_nom_vec) + 3*np.max(x_sig_vec) + hx
-        max_y = np.max(y_nom_vec) + 3*np.max(y_sig_vec) + hy
-        dx = np.arange(min_x, max_x, hx)
-        dy = np.arange(min_y, max_y, hy)
-        XY = np.vstack((np.tile(dx, len(dy)), dy.repeat(len(dx))))
-        Pro_den = np.zeros((len(dx), len(dy)))
-        
-        for h in range(leng_vec):
-            mu = np.array([x_nom_vec[h], y_nom_vec[h]])
-            cov = np.array([[x_var_vec[h], 0], [0, y_var_vec[h]]])
-            Pd = multivariate_normal.pdf(XY.T, mu, cov)
-            Pd = (Pd.reshape(len(dy), len(dx))).T
-            Pro_den = Pro_den + model_pro[h]*(Pd/np.max(Pd))
-            
-        con = measure.find_contours(Pro_den, epsilon*np.max(Pro_den))
-        num_con = len(con)
-        Min_x = list( )
-        Max_x = list( )
-        Min_y = list( )
-        Max_y = list( )
-        for i in range(num_con):
-            x = con[i][:, 0]*(np.max(dx) - np.min(dx))/len(dx) + np.min(dx)
-            y = con[i][:, 1]*(np.max(dy) - np.min(dy))/len(dy) + np.min(dy)
-            Min_x.insert(i, np.min(x))
-            Max_x.insert(i, np.max(x))
-            Min_y.insert(i, np.min(y))
-            Max_y.insert(i, np.max(y))
+        if self.Cache.enable:
+            key, origin = self.Cache.Key(x_nom_vec, y_nom_vec, x_var_vec, y_var_vec, model_pro, epsilon)
+            occ_k = self.Cache.Lookup(key, origin)
+            if occ_k is not None:
+                return occ_k
+        if self.occ_method == 'analytic':
+            occ_k = self.Occupancy.GMM_Analytic(x_nom_vec, y_nom_vec, x_var_vec, y_var_vec, model_pro, epsilon)
+        elif self.occ_method == 'contour':
+            occ_k = self.Occupancy.GMM_Contour(x_nom_vec, y_nom_vec, x_var_vec, y_var_vec, model_pro, leng_vec, epsilon)
+        elif self.occ_method == 'adaptive':
+            occ_k = self.Occupancy.GMM_Adaptive(x_nom_vec, y_nom_vec, x_var_vec, y_var_vec, model_pro, leng_vec, epsilon)
+        else:
+            occ_k = self.Occupancy.GMM_Mask(x_nom_vec, y_nom_vec, x_var_vec, y_var_vec, model_pro, leng_vec, epsilon)
+        if self.Cache.enable:
+            self.Cache.Store(key, origin, occ_k)
 
-        Min_x = np.min(Min_x)
-        Max_x = np.max(Max_x)
-        Min_y = np.min(Min_y)
-        Max_y = np.max(Max_y)
-        x_bar = (Min_x + Max_x)/2
-        y_bar = (Min_y + Max_y)/2
-        Dx = (Max_x - Min_x)/2 + zeta_l*l_veh 
-        Dy = (Max_y - Min_y)/2 + zeta_w*w_veh 
-        
-        return np.array([x_bar, y_bar, Dx, Dy])
+        return occ_k
         
     def Define_DV(self, Initial, X_DV_Lane, m): # Find the most direct obstacle
         N = self.N
@@ -298,10 +308,6 @@ class ISA_MPC( ): # The ISA-MPC for EV planning
         N = self.N
         Ts = self.Ts
         H = self.H
-        K_Lon = self.K_Lon_EV
-        
-        a = np.array([[1, Ts, (Ts**2)/2], [0, 1-K_Lon[0]*(Ts**2)/2, Ts-K_Lon[1]*(Ts**2)/2], [0, -K_Lon[0]*Ts, 1-K_Lon[1]*Ts]])
-        b = np.array([0, K_Lon[0]*(Ts**2)/2, K_Lon[0]*Ts])
     
         OCC_Horizon_SV, X_DV_Lane = self.SafetyAwareOccupancy(Obst_k, MU_k, X_Po_All_k, X_Var_k, Y_Var_k, y_k[0]) 
         ProjVal = list( ) 
@@ -312,14 +318,7 @@ class ISA_MPC( ): # The ISA-MPC for EV planning
             else: 
                 initial_x = x_hat_k[i][0:3] 
                 initial_y = x_hat_k[i][3::] 
-                A = list( )
-                B = list( )
-                sel_x = np.array([[1, 0, 0]]) 
-                A.append(sel_x@b)
-                B.append(sel_x@matrix_power(a, 1)@initial_x)
-                for j in range(1, N):
-                    A.append(sel_x@matrix_power(a, j)@b + A[j - 1])
-                    B.append(sel_x@matrix_power(a, j+1)@initial_x)
+                A, B = self.Table.Longitudinal(0, initial_x)
                 SEL = list( )
                 X_SV = list( )
                 for j in range(N_Car):
@@ -333,15 +332,14 @@ class ISA_MPC( ): # The ISA-MPC for EV planning
                             SEL = SEL + self.Sel_Matrix(initial_y, o_SV, W_SV, i)
                             temp_x = OCC_Horizon_SV[j][0, 1::] - OCC_Horizon_SV[j][2, 1::]
                             X_SV = X_SV + temp_x.tolist()     
-                SEL = np.diag(SEL)
+                SEL = np.array(SEL, dtype = bool)
                 X_SV = np.array(X_SV)
                 A = np.array(A).reshape(N, 1)
                 B = np.array(B).reshape(N, 1)
                 A = np.tile(A, (N_Car - 1, 1))
                 B = np.tile(B, (N_Car - 1, 1))
                 X_SV = X_SV.reshape(N*(N_Car - 1), 1)
-                vx_up = self.LongVelProj(A, B, X_SV, RefPrim[i], SEL)
-                vx_up = vx_up.__float__()
+                vx_up = self.Solve_QP(A, B, X_SV, RefPrim[i], SEL)
                 if vx_up < 0:
                     vx_up = 0
                 ProjVal.append(vx_up)
@@ -351,6 +349,7 @@ class ISA_MPC( ): # The ISA-MPC for EV planning
         return ProjVal, X_DV_Lane, OCC_Horizon_SV
         
     def Final_Return(self, k, state_k_loc, state_k_glo, Obst_k, y_k, X_Po_All_k, MU_k, X_Var_k, Y_Var_k): # Return com. results
+        self.Reuse.Cycle(k)
         Ts = self.Ts
         N = self.N
         N_M_EV = self.N_M_EV
@@ -404,9 +403,12 @@ class ISA_MPC( ): # The ISA-MPC for EV planning
         Initial = casadi.vertcat(Initial)
         Terminal = casadi.vertcat(Terminal)
         X_DV_Casadi = casadi.vertcat(X_DV)
-        Traj_k, U_k = self.EVplanning(Initial, Terminal, X_DV_Casadi)
+        self.EVplanning.Cycle(k)
+        Guess = self.EVplanning.Shift(None, Initial)
+        Traj_k, U_k = self.EVplanning(Initial, Terminal, X_DV_Casadi, Guess = Guess)
         Traj_k = Traj_k.full( )
         U_k = U_k.full( )
+        self.EVplanning.Store(None, [Traj_k, U_k])
         x_pre_k = self.V2G(Traj_k)
         state_k_plus_1_loc = Traj_k[:, 1]
         state_k_plus_1_glo = x_pre_k[:, 1]
@@ -450,33 +452,63 @@ class ISA_MPC( ): # The ISA-MPC for EV planning
             
         return SEL # Transfer the steps into a matrix
     
-    def construct_QP(self): # QP problem for computing the reference speed of each nominal maneuver of EV
-        N = self.N
+    def Solve_QP(self, A, B, X_SV, v_pri, SEL): # the safe reference speed closest to v_pri, in closed form unless qp_method is 'ipopt' or the selected rows cannot be satisfied
+        if self.qp_method != 'ipopt':
+            v_up = self.AnalyticProj(A, B, X_SV, v_pri, SEL)
+            if v_up is not None:
+                return v_up
+        Row = np.flatnonzero(SEL)
+        n_row = 0 if len(Row) == 0 else 1 << (len(Row) - 1).bit_length( ) # padded row count, so at most log2(N*(N_Car - 1)) + 2 problems
+        if n_row not in self.LongVelProj:
+            self.LongVelProj[n_row] = self.construct_QP(n_row)
+        Data = np.zeros((4, n_row, 1)) # A, B, X_SV and the row weight S of the selected rows, zero padded
+        Data[0:3, 0:len(Row), 0] = [np.ravel(A)[Row], np.ravel(B)[Row], np.ravel(X_SV)[Row]]
+        Data[3, 0:len(Row), 0] = 1
+
+        return self.LongVelProj[n_row](Data[0], Data[1], Data[2], v_pri, Data[3]).__float__()
+
+    def AnalyticProj(self, A, B, X_SV, v_pri, SEL): # each selected row Th_QP*v_up + l_veh/2 <= X_SV - A*v_up - B is linear in v_up, so the rows reduce to the upper bound v_up <= min((X_SV-B-l_veh/2)/(A+Th_QP)) that v_pri is clipped to
+        Th_QP = self.Th_QP
+        l_veh = self.l_veh
+        a = np.ravel(A)[SEL] + Th_QP
+        d = np.ravel(X_SV)[SEL] - np.ravel(B)[SEL] - l_veh/2
+        Up = a > 0
+        Down = a < 0
+        if np.any(~Up & ~Down & (d < 0)): # rows that do not depend on v_up and are violated
+            return None
+        v_max = np.min(d[Up]/a[Up], initial = np.inf)
+        v_min = np.max(d[Down]/a[Down], initial = -np.inf)
+        if v_min > v_max:
+            return None
+
+        return min(max(float(v_pri), v_min), v_max)
+
+    def construct_QP(self, n_row): # QP problem for computing the reference speed of each nominal maneuver of EV over n_row rows: the selected steps weighted by S = 1, the zero padding switched off by S = 0
         Th_QP = self.Th_QP
-        N_Car = self.N_Car
         l_veh = self.l_veh
         opti = casadi.Opti( )
-        H = opti.parameter(N*(N_Car - 1), N*(N_Car - 1))
-        X_SV = opti.parameter(N*(N_Car - 1), 1)
-        A = opti.parameter(N*(N_Car - 1), 1)
-        B = opti.parameter(N*(N_Car - 1), 1)
+        X_SV = opti.parameter(n_row, 1)
+        A = opti.parameter(n_row, 1)
+        B = opti.parameter(n_row, 1)
         v_pri = opti.parameter( )
+        S = opti.parameter(n_row, 1)
         v_up = opti.variable( )
         X_EV = A*v_up + B
         D_Error = X_SV - X_EV
-        Safe_D = Th_QP*v_up*np.ones((N*(N_Car-1), 1)) + l_veh/2
+        Safe_D = Th_QP*v_up*np.ones((n_row, 1)) + l_veh/2
         J = (v_pri - v_up)**2
         opti.minimize(J)
-        opti.subject_to(H@Safe_D <= H@D_Error)
+        if n_row > 0:
+            opti.subject_to(S*Safe_D <= S*D_Error)
         opts = {"ipopt.warm_start_init_point": "yes",
                 "ipopt.print_level": 0,
                 "ipopt.linear_solver": "ma57", # You can comment this line if you do not have ma57 solver
                 "print_time": False}
         opti.solver('ipopt', opts)
         
-        return opti.to_function('f', [A, B, X_SV, v_pri, H], [v_up])
+        return opti.to_function('f', [A, B, X_SV, v_pri, S], [v_up])
     
-    def contruct_MT_MPC(self): # Moving Target MPC for EV planning
+    def contruct_MT_MPC(self, Params): # Moving Target MPC for EV planning, warm-started from the previous plan when mpc_warm is set
         N = self.N
         Nx = self.DEV
         Ts = self.Ts
@@ -532,9 +564,10 @@ class ISA_MPC( ): # The ISA-MPC for EV planning
                 "ipopt.print_level": 0,
                 "ipopt.linear_solver": "ma57", # You can comment this line if you do not have ma57 solver
                 "print_time": False}
-        opti.solver('ipopt', opts)
+        opts_warm = {"ipopt.mu_init": 1e-6,
+                     "ipopt.warm_start_bound_push": 1e-9}
 
-        return opti.to_function('g', [Initial, Terminal, X_DV], [X, Opt_variable])
+        return MPC_Solver(Params, opti, [Initial, Terminal, X_DV], [X, Opt_variable], opts, opts_warm, 'g')
         
     def vehicle_model(self, w, snap, alpha): # EV model, linear time varying kinematic model
         l_f = self.l_f
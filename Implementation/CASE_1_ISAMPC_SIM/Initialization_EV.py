@@ -1,6 +1,7 @@
 import numpy as np
 import casadi
 from numpy.linalg import matrix_power
+from MPC_Solver import MPC_Solver
 
 class Initialization_EV( ): # Initialized the EV
     def __init__(self, Params, state_0_glo, state_0_loc):
@@ -23,7 +24,7 @@ class Initialization_EV( ): # Initialized the EV
         self.l_veh      = Params['l_veh']
         self.H          = Params['H']
         self.Q_Initial  = Params['Q_Initial']
-        self.EVplanning = self.contruct_MT_MPC( )
+        self.EVplanning = self.contruct_MT_MPC(Params)
     
     def LookLane(self, y_k): # check lane index according to the current lateral position
         L_Bound = self.L_Bound
@@ -123,7 +124,7 @@ class Initialization_EV( ): # Initialized the EV
         
         return global_state
             
-    def contruct_MT_MPC(self): # Moving Target MPC for EV planning
+    def contruct_MT_MPC(self, Params): # Moving Target MPC for EV planning, solved once from a cold start
         N = self.N
         Nx = self.DEV
         Ts = self.Ts
@@ -179,9 +180,8 @@ class Initialization_EV( ): # Initialized the EV
                 "ipopt.print_level": 0,
                 "ipopt.linear_solver": "ma57", # You can comment this line of you do not have ma57
                 "print_time": False}
-        opti.solver('ipopt', opts)
 
-        return opti.to_function('f',[Initial, Terminal, X_DV],[X, Opt_variable])
+        return MPC_Solver(dict(Params, mpc_warm = False, mpc_solver = 'ipopt'), opti, [Initial, Terminal, X_DV], [X, Opt_variable], opts, dict( ), 'f')
         
     def vehicle_model(self, w, snap, alpha): # EV model, linear time varying kinematic model
         l_f = self.l_f
@@ -0,0 +1,276 @@
+import numpy as np
+import time
+import os
+import shutil
+import tempfile
+import hashlib
+import subprocess
+import casadi
+
+class Function_Cache( ): # CasADi functions keyed by content hash: built once per process and shared between solvers and classes, optionally kept on disk with Function.save/load
+    def __init__(self):
+        self.Table   = dict( )
+        self.N_Hit   = 0    # taken from the table
+        self.N_Load  = 0    # loaded from disk
+        self.N_Miss  = 0    # built
+        self.t_load  = 0.0  # total load time [s]
+        self.t_build = 0.0  # total build time [s]
+
+    def Get(self, key, Build, cache_dir = None): # function of key from the table, else loaded from cache_dir, else returned by Build( ) and saved to cache_dir
+        if key in self.Table:
+            self.N_Hit = self.N_Hit + 1
+            return self.Table[key]
+        File = None if cache_dir is None else os.path.join(cache_dir, key + '.casadi')
+        t_start = time.perf_counter( )
+        if (File is not None) and os.path.isfile(File):
+            F = casadi.Function.load(File)
+            self.N_Load = self.N_Load + 1
+            self.t_load = self.t_load + time.perf_counter( ) - t_start
+        else:
+            F = Build( )
+            self.N_Miss = self.N_Miss + 1
+            self.t_build = self.t_build + time.perf_counter( ) - t_start
+            if File is not None:
+                os.makedirs(cache_dir, exist_ok = True)
+                Tmp = File + '.%d' % os.getpid( ) # saved aside and renamed, so that a concurrent worker never loads a partial file
+                F.save(Tmp)
+                os.replace(Tmp, File)
+        self.Table[key] = F
+
+        return F
+
+    def Summary(self): # counts, and mean build and load time [s] of the functions not taken from the table
+        return {'hit': self.N_Hit, 'load': self.N_Load, 'miss': self.N_Miss,
+                't_load_mean': self.t_load/max(self.N_Load, 1), 't_build_mean': self.t_build/max(self.N_Miss, 1)}
+
+    def Clear(self): # drop all entries and reset the counters
+        self.Table.clear( )
+        self.N_Hit = 0
+        self.N_Load = 0
+        self.N_Miss = 0
+        self.t_load = 0.0
+        self.t_build = 0.0
+
+Functions = Function_Cache( ) # shared by every MPC_Solver of the process
+
+class MPC_Solver( ): # NLP solver of an Opti problem, called like opti.to_function but with primal/dual initial guesses, receding-horizon warm starts and per-call solver statistics
+    def __init__(self, Params, opti, Inputs, Outputs, opts, opts_warm, name):
+        t_start = time.perf_counter( )
+        self.method   = Params.get('mpc_solver', 'ipopt')                        # 'ipopt': NLP solved to convergence every cycle, 'rti': real-time iteration, one SQP step around the shifted previous solution, 'ltv': one QP of the MPC linearized around the shifted previous solution (IPOPT on a cold start)
+        self.qpsol    = Params.get('rti_qpsol', 'qrqp')                          # QP solver of the SQP steps, a CasADi conic plugin ('qrqp', 'osqp', ...)
+        self.rti_tol  = Params.get('rti_tol', 1e-3)                              # KKT residual above which the cycle takes a further SQP step
+        self.rti_iter = Params.get('rti_iter', 2)                                # max. SQP steps per cycle
+        self.ltv_qpsol = Params.get('ltv_qpsol', 'qrqp')                         # sparse QP solver of the LTV-MPC, a CasADi conic plugin ('qrqp', 'osqp', ...)
+        self.warm     = Params.get('mpc_warm', False) or (self.method in ['rti', 'ltv']) # initialize each solve with the previous solution shifted by one step instead of zeros
+        self.codegen  = Params.get('mpc_codegen', False)                         # evaluate the NLP callbacks from C code compiled ahead of time instead of on the CasADi virtual machine
+        self.cg_dir   = os.path.abspath(Params.get('codegen_dir', 'codegen'))    # on-disk cache of the generated C code and the compiled shared libraries
+        self.cg_cc    = Params.get('codegen_cc', 'gcc')                          # C compiler
+        self.cg_flags = Params.get('codegen_flags', ['-O1'])                     # compiler flags, -O0 compiles several times faster at slower callbacks
+        self.fn_cache = Params.get('fn_cache', False)                            # share solvers of identical NLPs and options through the process-wide Functions cache
+        self.fn_dir   = Params.get('fn_cache_dir', None)                         # directory the cached solvers are saved to and loaded from, None: this process only
+        self.expand   = Params.get('mpc_expand', False)                          # evaluate the NLP and its derivatives as SX graphs expanded from the MX problem of Opti
+        self.k        = None                                                     # current planning cycle
+        self.Memory   = dict( )                                                  # key -> cycle and outputs of the latest solve
+        self.Lam      = None                                                     # multipliers (lam_x, lam_g) of the latest solve
+        self.Stats    = list( )                                                  # iterations, wall time, return status, warm-start flag, KKT residual (RTI steps only) and fallback reason of every call
+        self.Pack_P   = casadi.Function(name + '_p', Inputs, [opti.p])           # parameters of the call -> NLP parameter vector
+        self.Pack_X   = casadi.Function(name + '_x', Outputs, [opti.x])          # initial guess of the outputs -> NLP decision vector
+        self.Unpack_X = casadi.Function(name + '_o', [opti.x], Outputs)          # NLP decision vector -> outputs
+        self.Bounds   = casadi.Function(name + '_b', [opti.p], [opti.lbg, opti.ubg])
+        NLP = {'x': opti.x, 'p': opti.p, 'f': opti.f, 'g': opti.g}
+        self.Code     = self.NLPCode(NLP) if (self.codegen or self.fn_cache) else None # C code of the objective and constraints, the content the caches are keyed by
+        if self.expand:
+            opts = dict(opts, expand = True)
+        self.Solver      = self.NLPSol(name, 'ipopt', NLP, opts)
+        if self.method == 'rti':
+            self.Solver_Warm = self.NLPSol(name + '_rti', 'sqpmethod', NLP, self.RTI_Options( ))
+            Lam_g = casadi.MX.sym('lam_g', opti.ng)
+            Lam_x = casadi.MX.sym('lam_x', opti.nx)
+            self.KKT = casadi.Function(name + '_kkt', [opti.x, opti.p, Lam_x, Lam_g], [casadi.gradient(opti.f + casadi.dot(Lam_g, opti.g), opti.x) + Lam_x, opti.g])
+            self.KKT = self.KKT.expand( ) if self.expand else self.KKT
+        elif self.method == 'ltv':
+            self.Data_LTV, self.Solver_Warm = self.LTV_QP(name + '_ltv', opti)
+        elif self.warm:
+            self.Solver_Warm = self.NLPSol(name + '_warm', 'ipopt', NLP, dict(opts, **opts_warm)) # same NLP, barrier started close to the initial guess
+        else:
+            self.Solver_Warm = None
+        self.t_init   = time.perf_counter( ) - t_start                           # construction time [s]
+        self.Pattern  = None                                                     # sizes and nonzeros of the derivatives IPOPT factorizes, filled by the first Summary so that construction does only what solving needs
+
+    def NLPSol(self, name, plugin, NLP, opts): # nlpsol of NLP, taken from the Functions cache when fn_cache is set
+        if not self.fn_cache:
+            return self.Build(name, plugin, NLP, opts)
+        key = 'nlpsol_' + plugin + '_' + self.Hash(plugin, repr(sorted(opts.items( ))), repr((self.codegen, self.cg_cc, list(self.cg_flags))))
+
+        return Functions.Get(key, lambda: self.Build(name, plugin, NLP, opts), None if self.codegen else self.fn_dir) # a compiled solver loads from its library already
+
+    def Build(self, name, plugin, NLP, opts): # nlpsol of NLP, its callbacks loaded from the codegen cache when mpc_codegen is set (generated and compiled on a cache miss)
+        if not self.codegen:
+            return casadi.nlpsol(name, plugin, NLP, opts)
+        Lib = os.path.join(self.cg_dir, 'nlp_' + plugin + '_' + self.Hash(plugin, repr(sorted(opts.items( ))), self.cg_cc, *self.cg_flags) + '.so')
+        if not os.path.isfile(Lib):
+            self.Compile(casadi.nlpsol(name, plugin, NLP, opts), Lib)
+
+        return casadi.nlpsol(name, plugin, Lib, {key: value for key, value in opts.items( ) if key != 'expand'}) # the library holds the expanded callbacks already
+
+    def NLPCode(self, NLP): # C code of the objective and constraints; N, Ts, the weights and the vehicle geometry enter it as constants
+        cg = casadi.CodeGenerator('nlp')
+        cg.add(casadi.Function('nlp', [NLP['x'], NLP['p']], [NLP['f'], NLP['g']]))
+
+        return cg.dump( )
+
+    def Hash(self, *Extra): # content hash of the NLP code, Extra (solver plugin, options, compiler, ...) and the CasADi version
+        Key = '\n'.join([self.Code] + list(Extra) + [casadi.__version__])
+
+        return hashlib.sha1(Key.encode( )).hexdigest( )[:16]
+
+    def Compile(self, Solver, Lib): # C code of the callbacks Solver needs (objective, constraints, their derivatives and the Lagrangian Hessian) compiled into the shared library Lib
+        os.makedirs(self.cg_dir, exist_ok = True)
+        Tmp = tempfile.mkdtemp(dir = self.cg_dir) # private to this build, so that concurrent runs never share a source file or load a partial library
+        try:
+            Gen = casadi.CodeGenerator(os.path.basename(Lib)[:-3] + '.c') # what Solver.generate_dependencies writes, but into Tmp rather than the working directory
+            Gen.add(Solver.oracle( ))
+            for fname in Solver.get_function( ):
+                Gen.add(Solver.get_function(fname))
+            Src = Gen.generate(Tmp + os.sep)
+            Out = os.path.join(Tmp, os.path.basename(Lib))
+            subprocess.run([self.cg_cc, '-fPIC', '-shared'] + list(self.cg_flags) + [Src, '-o', Out], check = True)
+            os.replace(Src, os.path.join(self.cg_dir, os.path.basename(Src)))
+            os.replace(Out, Lib)
+        finally:
+            shutil.rmtree(Tmp, ignore_errors = True)
+
+    def Sparsity(self, Solver): # sizes and nonzeros of the constraint Jacobian and of the upper triangle of the Lagrangian Hessian of Solver
+        Jac = Solver.get_function('nlp_jac_g').sparsity_out('jac_g_x')
+        Hess = Solver.get_function('nlp_hess_l').sparsity_out(0)
+        nx = Jac.size2( )
+        ng = Jac.size1( )
+
+        return {'nx': nx, 'ng': ng, 'nnz_jac_g': Jac.nnz( ), 'nnz_hess_l': Hess.nnz( ),
+                'density_jac_g': Jac.nnz( )/max(nx*ng, 1), 'density_hess_l': Hess.nnz( )/max(nx*(nx + 1)/2, 1)}
+
+    def QP_Options(self, qpsol): # silent conic options, a failed QP returned rather than raised
+        qpsol_options = {"error_on_fail": False}
+        if qpsol == 'qrqp':
+            qpsol_options.update({"print_iter": False, "print_header": False})
+        elif qpsol == 'osqp':
+            qpsol_options["osqp"] = {"verbose": False}
+
+        return qpsol_options
+
+    def RTI_Options(self): # one exact-Hessian SQP step per call, the Hessian regularized so that the QP stays convex
+
+        return {"qpsol": self.qpsol,
+                "qpsol_options": self.QP_Options(self.qpsol),
+                "max_iter": 1,
+                "convexify_strategy": "regularize",
+                "expand": self.expand,
+                "print_header": False,
+                "print_iteration": False,
+                "print_status": False,
+                "print_time": False,
+                "error_on_fail": False}
+
+    def LTV_QP(self, name, opti): # the MPC around a reference trajectory x0 as one sparse QP in the step dx: cost exact (it is quadratic), RK4 dynamics and constraints linearized at x0; the function of its data at x0 and the conic
+        x = opti.x
+        H, grad = casadi.hessian(opti.f, x)
+        A = casadi.jacobian(opti.g, x)
+        Data = casadi.Function(name + '_data', [x, opti.p], [H, grad, A, opti.g])
+        Data = Data.expand( ) if self.expand else Data
+        QP = casadi.conic(name + '_qp', self.ltv_qpsol, {'h': H.sparsity( ), 'a': A.sparsity( )}, self.QP_Options(self.ltv_qpsol))
+
+        return Data, QP
+
+    def __call__(self, *Inputs, Guess = None, Lam = None): # solve for the given parameters, Guess: initial values of the outputs, Lam: initial multipliers (lam_x, lam_g)
+        p = self.Pack_P(*Inputs)
+        lbg, ubg = self.Bounds(p)
+        x0 = 0 if Guess is None else self.Pack_X(*Guess)
+        lam_x0, lam_g0 = (0, 0) if Lam is None else Lam
+        Solver = self.Solver if (Guess is None) or (self.Solver_Warm is None) else self.Solver_Warm
+        t_start = time.perf_counter( )
+        if Solver is self.Solver_Warm and self.method == 'rti':
+            Sol, n_iter, kkt, fallback = self.RTI(x0, p, lbg, ubg, lam_x0, lam_g0)
+            status = 'RTI'
+        elif Solver is self.Solver_Warm and self.method == 'ltv':
+            Sol, fallback = self.LTV(x0, p, lbg, ubg)
+            n_iter, status, kkt = 1, 'LTV', None
+        else:
+            Sol = Solver(x0 = x0, p = p, lbg = lbg, ubg = ubg, lam_x0 = lam_x0, lam_g0 = lam_g0)
+            n_iter = Solver.stats( )['iter_count']
+            status = Solver.stats( )['return_status']
+            kkt, fallback = None, None
+        if fallback is not None: # the warm step gave no usable plan: solve the full NLP from a cold start instead
+            Sol = self.Solver(x0 = 0, p = p, lbg = lbg, ubg = ubg)
+            n_iter = n_iter + self.Solver.stats( )['iter_count']
+            status = self.Solver.stats( )['return_status']
+        t_wall = time.perf_counter( ) - t_start
+        self.Stats.append({'iter_count': n_iter, 't_wall': t_wall, 'status': status, 'warm': Guess is not None, 'kkt': kkt, 'fallback': fallback})
+        self.Lam = (Sol['lam_x'], Sol['lam_g'])
+
+        return self.Unpack_X(Sol['x'])
+
+    def RTI(self, x0, p, lbg, ubg, lam_x0, lam_g0): # SQP steps from the initial guess until the KKT residual is below rti_tol; the reason for a fallback when a step fails or rti_iter steps do not get there, else None
+        for i in range(self.rti_iter):
+            Sol = self.Solver_Warm(x0 = x0, p = p, lbg = lbg, ubg = ubg, lam_x0 = lam_x0, lam_g0 = lam_g0)
+            status = self.Solver_Warm.stats( )['return_status']
+            kkt = self.Residual(Sol['x'], p, Sol['lam_x'], Sol['lam_g'], lbg, ubg)
+            if status not in ['Solve_Succeeded', 'Maximum_Iterations_Exceeded']: # max_iter is 1, so a completed step reports the iteration limit; a failed QP surfaces as a large residual below
+                return Sol, i + 1, kkt, 'SQP step: ' + status
+            if kkt <= self.rti_tol:
+                return Sol, i + 1, kkt, None
+            x0, lam_x0, lam_g0 = Sol['x'], Sol['lam_x'], Sol['lam_g']
+
+        return Sol, i + 1, kkt, 'KKT residual %.2e above rti_tol' % kkt
+
+    def LTV(self, x0, p, lbg, ubg): # one QP in the step from the initial guess; the reason for a fallback when the linearization or the QP solution is not finite or the QP solver fails, else None
+        H, grad, A, g = self.Data_LTV(x0, p)
+        if not all(Value.is_regular( ) for Value in [H, grad, A, g]): # the conic rejects non-finite data with an exception
+            return None, 'QP: non-finite linearization'
+        Sol = self.Solver_Warm(h = H, g = grad, a = A, lba = lbg - g, uba = ubg - g)
+        Sol = {'x': x0 + Sol['x'], 'lam_x': Sol['lam_x'], 'lam_g': Sol['lam_a']}
+        if not self.Solver_Warm.stats( )['success']:
+            return Sol, 'QP: ' + self.Solver_Warm.stats( )['return_status']
+        if not Sol['x'].is_regular( ):
+            return Sol, 'QP: non-finite step'
+
+        return Sol, None
+
+    def Residual(self, x, p, lam_x, lam_g, lbg, ubg): # KKT residual: max. of the stationarity error and the constraint violation
+        Grad, g = self.KKT(x, p, lam_x, lam_g)
+        g = g.full( ).ravel( )
+        Violation = np.maximum(np.maximum(lbg.full( ).ravel( ) - g, g - ubg.full( ).ravel( )), 0)
+
+        return max(np.max(np.abs(Grad.full( ))), np.max(Violation, initial = 0))
+
+    def Cycle(self, k): # set the current planning cycle
+        self.k = k
+
+    def Shift(self, key, Initial): # previous solution of key shifted by one step, the first state (first output) replaced by Initial; None on a cold start
+        Prev = self.Memory.get(key)
+        if (not self.warm) or (Prev is None) or (self.k is None) or (self.k - Prev[0] != 1):
+            return None
+        Guess = [np.concatenate((Out[:, 1:], Out[:, -1:]), axis = 1) for Out in Prev[1]]
+        Guess[0][:, 0] = casadi.DM(Initial).full( ).ravel( )
+
+        return Guess
+
+    def Store(self, key, Outputs): # keep this cycle's solution of key
+        self.Memory[key] = (self.k, [np.array(Out, dtype = float) for Out in Outputs])
+
+    def Summary(self): # sparsity pattern, and mean and max iterations and wall time [s], cold-start fallbacks and return status counts of the cold and the warm-started calls so far
+        if self.Pattern is None:
+            self.Pattern = self.Sparsity(self.Solver)
+        Summary = {'pattern': self.Pattern}
+        for warm in [False, True]:
+            Calls = [s for s in self.Stats if s['warm'] == warm]
+            if len(Calls) == 0:
+                continue
+            Iter = np.array([s['iter_count'] for s in Calls], dtype = float)
+            Wall = np.array([s['t_wall'] for s in Calls], dtype = float)
+            Status = dict( )
+            for s in Calls:
+                Status[s['status']] = Status.get(s['status'], 0) + 1
+            Summary['warm' if warm else 'cold'] = {'calls': len(Calls), 'iter_mean': np.mean(Iter), 'iter_max': np.max(Iter), 't_wall_mean': np.mean(Wall), 't_wall_max': np.max(Wall),
+                                                   'fallback': sum(s['fallback'] is not None for s in Calls), 'status': Status}
+
+        return Summary
@@ -0,0 +1,105 @@
+import os
+import atexit
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from GMM_Occupancy import GMM_Occupancy
+
+Worker = dict( ) # state of a pool worker: engine and views of the shared arrays
+Pools = dict( )  # pools of the process, shared by every Occupancy_Pool with the same worker count, block shape and engine parameters
+
+def Views(buf, C, M, N_1): # input and output arrays laid out in one shared block
+    size_in = C*M*N_1
+    X_Nom = np.ndarray((C, M, N_1), dtype=float, buffer=buf, offset=0)
+    Y_Nom = np.ndarray((C, M, N_1), dtype=float, buffer=buf, offset=8*size_in)
+    X_Var = np.ndarray((C, M, N_1), dtype=float, buffer=buf, offset=16*size_in)
+    Y_Var = np.ndarray((C, M, N_1), dtype=float, buffer=buf, offset=24*size_in)
+    Pro = np.ndarray((C, M), dtype=float, buffer=buf, offset=32*size_in)
+    OCC = np.ndarray((C, 4, N_1), dtype=float, buffer=buf, offset=32*size_in + 8*C*M)
+
+    return X_Nom, Y_Nom, X_Var, Y_Var, Pro, OCC
+
+def Worker_Init(name, C, M, N_1, Params, Ready): # attach a pool worker to the shared block once, at start-up
+    Worker['shm'] = shared_memory.SharedMemory(name=name)
+    Worker['Arrays'] = Views(Worker['shm'].buf, C, M, N_1)
+    Worker['Engine'] = GMM_Occupancy(Params)
+    Worker['Ready'] = Ready
+
+def Worker_Ready( ): # no-op round-trip of an initialized worker, held at the barrier until every worker has taken one
+    Worker['Ready'].wait( )
+
+    return os.getpid( )
+
+def Worker_Run(Row, Step, epsilon, method): # occupancy of the (SV, step) pairs (Row, Step) of the shared block, returns the adaptive-grid cells and calls it took
+    X_Nom, Y_Nom, X_Var, Y_Var, Pro, OCC = Worker['Arrays']
+    Engine = Worker['Engine']
+    N_Cell_Sum = Engine.N_Cell_Sum
+    N_Call = Engine.N_Call
+    OCC[Row, :, Step] = Engine.Pair_Bound(X_Nom, Y_Nom, X_Var, Y_Var, Pro, Row, Step, epsilon, method)
+
+    return Engine.N_Cell_Sum - N_Cell_Sum, Engine.N_Call - N_Call
+
+def Close_All( ): # stop the workers and release the shared blocks of every pool of the process
+    for key in list(Pools):
+        Shared = Pools.pop(key)
+        Shared['Executor'].shutdown( )
+        Shared['Arrays'] = None
+        Shared['shm'].close( )
+        Shared['shm'].unlink( )
+
+atexit.register(Close_All)
+
+class Occupancy_Pool( ): # Persistent process pool constructing the SV occupancies through shared memory
+    def __init__(self, Params, Engine = None):
+        self.enable   = Params.get('occ_pool', False)                     # on/off switch, off by default: on one core the pool is slower than the in-process engine
+        self.N_Worker = Params.get('occ_workers', 2)                      # number of worker processes of the pool shared by the planners of the process
+        self.N_Chunk  = Params.get('occ_chunks', 2*self.N_Worker)          # tasks per cycle, each a contiguous chunk of the (SV, step) pairs to compute
+        self.C        = Params['N_Car']
+        self.M        = Params['N_M']
+        self.N_1      = Params['N'] + 1
+        self.Engine   = GMM_Occupancy(Params) if Engine is None else Engine # in-process engine the adaptive-grid counters of the workers are added to
+        self.Shared   = None
+        if self.enable:
+            self.Shared = self.Start(Params)
+
+    def Start(self, Params): # the pool of the process for this worker count, block shape and engine parameters, started and warmed up on first use
+        C = self.C
+        M = self.M
+        N_1 = self.N_1
+        Engine_Params = {key: Params[key] for key in Params if (key in ['w_veh', 'l_veh', 'zeta_l', 'zeta_w']) or (key.startswith('occ_') and key not in ['occ_pool', 'occ_workers', 'occ_chunks'])}
+        key = (self.N_Worker, C, M, N_1, repr(sorted(Engine_Params.items( ))))
+        if key not in Pools:
+            shm = shared_memory.SharedMemory(create=True, size=8*(4*C*M*N_1 + C*M + 4*C*N_1))
+            Ready = multiprocessing.Barrier(self.N_Worker)
+            Executor = ProcessPoolExecutor(max_workers=self.N_Worker, initializer=Worker_Init, initargs=(shm.name, C, M, N_1, Engine_Params, Ready))
+            Task = [Executor.submit(Worker_Ready) for n in range(self.N_Worker)]
+            for task in Task:
+                task.result( )
+            Pools[key] = {'Executor': Executor, 'shm': shm, 'Arrays': Views(shm.buf, C, M, N_1)}
+
+        return Pools[key]
+
+    def Horizon_Bound(self, X_Nom, Y_Nom, X_Var, Y_Var, Pro, epsilon, method, Need=None): # same as GMM_Occupancy.Horizon_Bound, the pairs of Need fanned out over the workers
+        C = X_Nom.shape[0]
+        N_1 = self.N_1
+        X_Nom_S, Y_Nom_S, X_Var_S, Y_Var_S, Pro_S, OCC_S = self.Shared['Arrays']
+        X_Nom_S[0:C] = X_Nom
+        Y_Nom_S[0:C] = Y_Nom
+        X_Var_S[0:C] = X_Var
+        Y_Var_S[0:C] = Y_Var
+        Pro_S[0:C] = Pro
+        OCC_S[0:C] = 1
+        if Need is None:
+            Need = np.ones((C, N_1), dtype=bool)
+        Row, Step = np.nonzero(Need)
+        Edge = np.unique(np.linspace(0, len(Row), min(self.N_Chunk, len(Row)) + 1).astype(int))
+        Task = list( )
+        for start, stop in zip(Edge[0:-1], Edge[1:]):
+            Task.append(self.Shared['Executor'].submit(Worker_Run, Row[start:stop], Step[start:stop], epsilon, method))
+        for task in Task:
+            N_Cell_Sum, N_Call = task.result( )
+            self.Engine.N_Cell_Sum = self.Engine.N_Cell_Sum + N_Cell_Sum
+            self.Engine.N_Call = self.Engine.N_Call + N_Call
+
+        return OCC_S[0:C].copy( )
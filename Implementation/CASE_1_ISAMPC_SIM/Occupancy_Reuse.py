@@ -0,0 +1,59 @@
+import warnings
+import numpy as np
+
+class Occupancy_Reuse( ): # Receding-horizon reuse of the SV occupancies of the previous planning cycle
+    def __init__(self, Params, method):
+        self.Engines   = ['analytic', 'adaptive']                      # engines whose occupancy follows the mixture continuously, reused steps stayed within 0.05 m of recomputed ones
+        self.enable    = Params.get('occ_reuse', False)                # on/off switch
+        if self.enable and (method not in self.Engines): # 'mask' and 'contour' snap the edges to the 0.55 x 0.15 m grid cells, a reused step differed by up to 0.44 m
+            warnings.warn("occ_reuse ignored with occ_method '%s', it needs one of %s" % (method, self.Engines))
+            self.enable = False
+        self.tol       = Params.get('occ_reuse_tol', 0.05)             # max. change [m] of the mode offsets and standard deviations of a reused step
+        self.tol_pro   = Params.get('occ_reuse_tol_pro', 0.01)         # max. change of any mode probability for reusing an SV
+        self.k         = None                                          # current planning cycle
+        self.Memory    = dict( )                                       # SV (and epsilon) -> cycle, mode probabilities, anchors, descriptions and occupancy
+        self.N_Reuse   = 0                                             # steps taken from the previous cycle
+        self.N_Compute = 0                                             # steps recomputed
+
+    def Cycle(self, k): # set the current planning cycle
+        self.k = k
+
+    def Describe(self, MU_i, x_nominal, y_nominal, x_variance, y_variance): # mode probabilities, anchor (first mode mean) and translation-invariant mixture of every step
+        X_Nom = np.array(x_nominal, dtype=float)
+        Y_Nom = np.array(y_nominal, dtype=float)
+        Pro = np.array(MU_i, dtype=float)
+        Anchor = np.vstack((X_Nom[0], Y_Nom[0]))
+        Desc = np.vstack((X_Nom - X_Nom[0], Y_Nom - Y_Nom[0], np.sqrt(np.array(x_variance, dtype=float)), np.sqrt(np.array(y_variance, dtype=float))))
+
+        return Pro, Anchor, Desc
+
+    def Lookup(self, key, Pro, Anchor, Desc): # previous occupancy re-indexed to this cycle, mask of the reusable steps and the reference descriptions
+        N_1 = Desc.shape[1]
+        OCC = np.ones((4, N_1))
+        Reused = np.zeros(N_1, dtype=bool)
+        Desc_Ref = Desc.copy( )
+        Prev = self.Memory.get(key)
+        if (Prev is not None) and (self.k is not None):
+            k_prev, Pro_prev, Anchor_prev, Desc_prev, OCC_prev = Prev
+            shift = self.k - k_prev
+            if (shift in [0, 1]) and np.array_equal(Pro > 0, Pro_prev > 0) and (np.max(np.abs(Pro - Pro_prev)) <= self.tol_pro):
+                # candidate source steps: the same time instant (shifted by the elapsed cycles) and the same horizon index
+                Dist = np.full(N_1, np.inf)
+                Source = np.arange(N_1)
+                for lag in sorted(set([shift, 0])):
+                    n = N_1 - lag
+                    d = np.max(np.abs(Desc[:, 0:n] - Desc_prev[:, lag:N_1]), axis=0)
+                    better = d < Dist[0:n]
+                    Dist[0:n] = np.where(better, d, Dist[0:n])
+                    Source[0:n] = np.where(better, np.arange(lag, N_1), Source[0:n])
+                Reused = Dist <= self.tol
+                OCC = OCC_prev[:, Source]
+                OCC[0:2, :] = OCC[0:2, :] + Anchor - Anchor_prev[:, Source] # translate by the displacement of the mixture
+                Desc_Ref = np.where(Reused, Desc_prev[:, Source], Desc) # compare against the step as it was last computed, so drift does not accumulate
+        self.N_Reuse = self.N_Reuse + np.sum(Reused)
+        self.N_Compute = self.N_Compute + N_1 - np.sum(Reused)
+
+        return OCC, Reused, Desc_Ref
+
+    def Store(self, key, Pro, Anchor, Desc_Ref, OCC): # keep this cycle's occupancy of the SV
+        self.Memory[key] = (self.k, Pro, Anchor, Desc_Ref, OCC.copy( ))
@@ -1,7 +1,8 @@
 import numpy as np
 import math
 import casadi
-from numpy.linalg import matrix_power
+from Model_Table import Model_Table
+from IMM_Store import Dense, Legacy
 import scipy.linalg as sl
 import pdb
 
@@ -25,66 +26,32 @@ class IAIMM_KF( ): # The IMM-KF for motion prediction
         self.w_veh       = Params['w_veh']
         self.l_veh       = Params['l_veh']
         self.H           = Params['H']
-        self.LongVelProj = self.construct_QCQP( )
+        self.Table       = Model_Table(Params)
+        self.imm_batch   = Params.get('imm_batch', False) # mixing and Kalman filter of the SVs filtered at a step in one batched Step on the first Final_Return call of the step
+        self.Lane_Mode   = np.array([0, 1, 0, 1, 2, 1, 2]) # lane of the reference of each mode
+        self.Batch       = None # batched Step results of step k and the SVs not served from them yet
+        self.qcqp_method = Params.get('qcqp_method', 'analytic') # 'analytic': closed-form projection of the primary speed, 'ipopt': the QCQP solved by IPOPT
+        self.LongVelProj = dict( ) # IPOPT problems keyed on the row count: the selected rows compacted into the smallest power of two holding them, the padding switched off by a zero row weight, built on first use
+        self.kf_steady   = Params.get('kf_steady', False) # fixed per-mode gain and covariance from the DARE, only the spread of the mixed means is propagated
+        self.Steady      = self.SteadyState( ) if self.kf_steady else None
         
-    def Fusion_Prim_Speed(self, mu_k_1, x_hat_k_1, y_pos_k_1, y_pos_k, p_k_1): # state fusion steps of IMM-KF & define the primary reference speed of each mode of each SV
-        DSV = self.DSV
+    def Fusion_Prim_Speed(self, mu_k_1, x_hat_k_1, y_pos_k_1, y_pos_k, p_k_1): # state fusion steps of IMM-KF & define the primary reference speed of each mode of n SVs, (n, N_M, ...) arrays; p_k_1 = None mixes the spread of the means only
         N_M = self.N_M
         SpeedLim = self.SpeedLim
-
-        L_pos_k_1 = self.LookLane(y_pos_k_1)   
-        L_pos_k = self.LookLane(y_pos_k)       
-        Pr = self.ProTrans(L_pos_k_1, L_pos_k) 
-        c = list( )
-        x_bar = list( )
-        p_bar = list( )
-        
-        for i in range(N_M):
-            c.append(mu_k_1@Pr[:, i])
-        c = np.array(c)
-        
-        for i in range(N_M):
-            if c[i] != 0:
-                temp_x = np.array([0]*DSV)
-                for j in range(N_M):
-                    if mu_k_1[j] != 0:
-                        temp_x = temp_x + Pr[j, i]*mu_k_1[j]/c[i]*x_hat_k_1[j]
-                    else:
-                        temp_x = temp_x + 0
-                x_bar.append(temp_x) 
-            else:
-                x_bar.append(None)
-                
-        for i in range(N_M):
-            if c[i] != 0:
-                temp_p = np.zeros((DSV, DSV))
-                for j in range(N_M):
-                    if mu_k_1[j] != 0:
-                        X_k_k = x_bar[i] - x_hat_k_1[j] 
-                        temp_p = temp_p + Pr[j, i]*mu_k_1[j]/c[i]*(p_k_1[j] +  (np.array([X_k_k]).T)@(np.array([X_k_k])))
-                    else:
-                        temp_p = temp_p + 0
-                    p_bar.append(temp_p)
-            else:
-                p_bar.append(None)
-                              
-        RefPrim = list( )
-        for i in range(N_M):
-            if (np.sum(x_bar[i])== None): 
-                RefPrim.append(None)
-            else:
-                RefPrim.append(x_bar[i][1])
-        RefPrim = np.array(RefPrim)
+        Lane_Mode = self.Lane_Mode
+        n = mu_k_1.shape[0]
         
-        for i in range(N_M):
-            if (i == 0) or (i == 2): 
-                SpeedLim_Lane = SpeedLim[0]
-            elif (i == 1) or (i == 3) or (i == 5): 
-                SpeedLim_Lane = SpeedLim[1]
-            elif (i == 4) or (i == 6): 
-                SpeedLim_Lane = SpeedLim[2]
-            if (SpeedLim_Lane != None) and (RefPrim[i] != None): 
-                RefPrim[i] = SpeedLim_Lane
+        Pr = np.array([self.ProTrans(self.LookLane(y_pos_k_1[i]), self.LookLane(y_pos_k[i])) for i in range(n)]).reshape(n, N_M, N_M)
+        c = np.einsum('nj,nji->ni', mu_k_1, Pr)
+        active = c != 0
+        W = np.divide(Pr*mu_k_1[:, :, None], c[:, None, :], out = np.zeros((n, N_M, N_M)), where = active[:, None, :]) # mixing weights W[j, i] = Pr[j, i]*mu_k_1[j]/c[i] of the active modes i
+        x_bar = np.einsum('nji,njd->nid', W, x_hat_k_1)
+        X_k_k = x_bar[:, :, None, :] - x_hat_k_1[:, None, :, :] # X_k_k[i, j] = x_bar[i] - x_hat_k_1[j]
+        p_bar = np.einsum('nji,nija,nijb->niab', W, X_k_k, X_k_k) # mixed covariance of each mode i
+        if p_k_1 is not None:
+            p_bar = p_bar + np.einsum('nji,njab->niab', W, p_k_1)
+        Lim = np.array([np.nan if SpeedLim[Lane] == None else SpeedLim[Lane] for Lane in Lane_Mode], dtype = float)
+        RefPrim = np.where(np.isnan(Lim), x_bar[:, :, 1], Lim)*active
              
         return c, x_bar, p_bar, RefPrim 
     
@@ -99,46 +66,113 @@ class IAIMM_KF( ): # The IMM-KF for motion prediction
         
         return LanePos
     
-    def KalmanFilter(self, mu_k_1, x_hat_k_1, y_k, y_pos_k_1, y_pos_k, p_k_1): # Run regular Kalman Filter at current step
+    def Filtered(self, k, MU, X_Hat, P, Y, car_index, Car = None): # mixing and Kalman filter results of one SV at step k, taken from the batched Step of the SVs in Car when imm_batch is on
         N_M = self.N_M
-        Models = self.Models                                                           
-        Q = self.Q
-        R = self.R
-        H= self.H
         DSV = self.DSV
+        if self.imm_batch:
+            Batch = self.Batch
+            if (Batch is None) or (Batch['k'] != k) or (car_index not in Batch['Left']): # first SV of a new step, or step k run again
+                Batch = self.Step_All(k, MU, X_Hat, P, Y, Car)
+            Batch['Left'].discard(car_index)
+            n = Batch['Row'][car_index]
+            
+            return [Result[n] for Result in Batch['Result']]
+        mu_k_1 = np.asarray(MU[k - 1][car_index], dtype = float)       
+        x_hat_k_1, _ = Dense(X_Hat[k - 1][car_index], N_M, (DSV, )) 
+        p_k_1, _ = Dense(P[k - 1][car_index], N_M, (DSV, DSV))       
+        y_pos_k_1 = Y[k-1][car_index][-1] 
+        y_k = np.asarray(Y[k][car_index], dtype = float)
+        Batch = self.Step(mu_k_1[None], x_hat_k_1[None], p_k_1[None], y_k[None], np.array([y_pos_k_1], dtype = float)) # Step of this SV alone
         
-        c, x_bar, p_bar, RefPrim = self.Fusion_Prim_Speed(mu_k_1, x_hat_k_1, y_pos_k_1, y_pos_k, p_k_1)
-        x_hat_k = list( ) 
-        p_k = list( )    
-        y_tilde_k = list( ) 
-        s_k = list( )       
+        return [Result[0] for Result in Batch]
+    
+    def Step_All(self, k, MU, X_Hat, P, Y, Car = None): # run Step for the SVs in Car, those the caller filters at step k (every SV with a previous covariance when None), and keep the results for the rest of the step
+        N_M = self.N_M
+        DSV = self.DSV
+        N_Car = self.N_Car
+        if Car is None:
+            Car = [i for i in range(N_Car) if (MU[k - 1][i] is not None) and (P[k - 1][i] is not None)]
+        mu_k_1 = np.array([np.asarray(MU[k - 1][i], dtype = float) for i in Car]).reshape(len(Car), N_M)
+        x_hat_k_1 = np.array([Dense(X_Hat[k - 1][i], N_M, (DSV, ))[0] for i in Car]).reshape(len(Car), N_M, DSV)
+        p_k_1 = np.array([Dense(P[k - 1][i], N_M, (DSV, DSV))[0] for i in Car]).reshape(len(Car), N_M, DSV, DSV)
+        y_k = np.array([Y[k][i] for i in Car], dtype = float).reshape(len(Car), -1)
+        y_pos_k_1 = np.array([Y[k - 1][i][-1] for i in Car], dtype = float)
+        self.Batch = {'k': k, 'Row': {i: n for n, i in enumerate(Car)}, 'Left': set(Car), 'Result': self.Step(mu_k_1, x_hat_k_1, p_k_1, y_k, y_pos_k_1)}
         
-        for i in range(N_M):
-            if (np.sum(x_bar[i]) == None):
-                x_hat_k.append(None)
-                p_k.append(None)
-                y_tilde_k.append(None)
-                s_k.append(None)
-            else:
-                K_Lon = Models[i][0]
-                K_Lat = Models[i][1]
-                F, X_KF = self.VelocityTracking(x_bar[i], RefPrim[i], i, 1, K_Lon, K_Lat)
-                x_hat_k_k_1 = X_KF[:, 1] 
-                p_k_k_1 = F@p_bar[i]@(F.T) + Q   
-                y_tilde = y_k - H@x_hat_k_k_1    
-                s = H@p_k_k_1@(H .T)+ R  
-                k_k = p_k_k_1@H.T@np.linalg.pinv(s) 
-                x_hat_k.append((x_hat_k_k_1 + k_k@y_tilde)) 
-                p_k.append((np.eye(DSV) - k_k@H)@p_k_k_1)   
-                y_tilde_k.append(y_tilde)
-                s_k.append(s)
-            
-        return x_hat_k, p_k, y_tilde_k, s_k, c, RefPrim
-            
-    def VelocityTracking(self, x_ini, vx_ref, m, n_step, K_Lon, K_Lat): # velocity tracking model
-        Ts = self.Ts
+        return self.Batch
+    
+    def Step(self, mu_k_1, x_hat_k_1, p_k_1, y_k, y_pos_k_1): # mixing, prediction, update and innovation log-likelihood of n SVs at once, (n, N_M, ...) arrays with zeros for the inactive modes
+        N_M = self.N_M
+        DSV = self.DSV
+        Q = self.Q
+        H = self.H
         L_Center = self.L_Center
+        Lane_Mode = self.Lane_Mode
+        n = y_k.shape[0]
+        
+        c, x_bar, p_bar, RefPrim = self.Fusion_Prim_Speed(mu_k_1, x_hat_k_1, y_pos_k_1, y_k[:, -1], None if self.kf_steady else p_k_1)
+        active = c != 0
+        
+        F = self.Table.Phi[:, 1] 
+        Ref = np.stack((RefPrim, np.broadcast_to(np.array(L_Center, dtype = float)[Lane_Mode], (n, N_M))), axis = 2)
+        x_hat_k_k_1 = np.einsum('mab,nmb->nma', F, x_bar) + np.einsum('mab,nmb->nma', self.Table.Gamma[:, 1], Ref)
+        y_tilde_k = y_k[:, None, :] - x_hat_k_k_1@H.T
+        if self.kf_steady:
+            Steady = self.Steady
+            k_k = Steady['K']
+            log_L_y = self.LogLikelihood(Steady['S_chol'], y_tilde_k)
+            p_k = Steady['P'] + Steady['A']@p_bar@Steady['A'].transpose(0, 2, 1)
+        else:
+            p_k_k_1 = F@p_bar@F.transpose(0, 2, 1) + Q
+            k_k, log_L_y = self.Innovation(p_k_k_1, y_tilde_k)
+            p_k = (np.eye(DSV) - k_k@H)@p_k_k_1
+        x_hat_k = x_hat_k_k_1 + (k_k@y_tilde_k[:, :, :, None])[:, :, :, 0]
+        
+        return x_hat_k*active[:, :, None], p_k*active[:, :, None, None], np.where(active, log_L_y, -np.inf), c, RefPrim
+    
+    def Innovation(self, p_k_k_1, y_tilde): # Cholesky factor of the innovation covariance, reused for the gain and the Gaussian log-likelihood; stacked over any leading axes
+        H = self.H
+        R = self.R
+        s = H@p_k_k_1@np.swapaxes(H, -1, -2) + R
+        s_chol = np.linalg.cholesky(s)
+        Z = np.linalg.solve(s_chol, H@p_k_k_1) 
+        k_k = np.swapaxes(np.linalg.solve(np.swapaxes(s_chol, -1, -2), Z), -1, -2) # p_k_k_1 H^T s^-1
+        
+        return k_k, self.LogLikelihood(s_chol, y_tilde)
+    
+    def LogLikelihood(self, s_chol, y_tilde): # Gaussian log-likelihood of the innovation y_tilde given the Cholesky factor of its covariance
+        e = np.linalg.solve(s_chol, y_tilde[..., None])[..., 0] # whitened innovation
+        
+        return -1/2*np.sum(e**2, axis = -1) - np.sum(np.log(np.diagonal(s_chol, axis1 = -2, axis2 = -1)), axis = -1) - y_tilde.shape[-1]/2*np.log(2*math.pi)
+    
+    def SteadyState(self): # steady-state Kalman filter of each sub-model from the discrete algebraic Riccati equation: gain, innovation factor, updated covariance and closed loop (I - K H) F
+        Q = self.Q
+        R = self.R
+        H = self.H
         DSV = self.DSV
+        F = self.Table.Phi[:, 1]
+        Steady = {'K': list( ), 'S_chol': list( ), 'P': list( ), 'A': list( )}
+        for m in range(F.shape[0]):
+            try:
+                p_k_k_1 = sl.solve_discrete_are(F[m].T, H.T, Q, R)
+            except (np.linalg.LinAlgError, ValueError): # no stabilizing solution found, iterate the Riccati recursion instead
+                p_k_k_1 = Q
+                for _ in range(1000):
+                    k_k, _ = self.Innovation(p_k_k_1, np.zeros(H.shape[0]))
+                    p_next = F[m]@(np.eye(DSV) - k_k@H)@p_k_k_1@F[m].T + Q
+                    if np.allclose(p_next, p_k_k_1, rtol = 1e-10, atol = 1e-12):
+                        break
+                    p_k_k_1 = p_next
+            k_k, _ = self.Innovation(p_k_k_1, np.zeros(H.shape[0]))
+            Steady['K'].append(k_k)
+            Steady['S_chol'].append(np.linalg.cholesky(H@p_k_k_1@H.T + R))
+            Steady['P'].append((np.eye(DSV) - k_k@H)@p_k_k_1)
+            Steady['A'].append((np.eye(DSV) - k_k@H)@F[m])
+        
+        return {key: np.array(Value) for key, Value in Steady.items( )}
+    
+    def VelocityTracking(self, x_ini, vx_ref, m, n_step, K_Lon, K_Lat): # velocity tracking model, K_Lon and K_Lat are the gains Models[m] served by the model table
+        L_Center = self.L_Center
         if (m == 0) or (m == 2):
             y_ref = L_Center[0]
         elif (m == 1) or (m == 3) or (m == 5):
@@ -146,25 +180,10 @@ class IAIMM_KF( ): # The IMM-KF for motion prediction
         elif (m == 4) or (m == 6):
             y_ref = L_Center[2]
             
-        F = np.array([[1, Ts, Ts**2/2, 0, 0, 0],
-                      [0, 1-K_Lon[0]*Ts**2/2, Ts-K_Lon[1]*(Ts**2)/2, 0, 0, 0],
-                      [0, -K_Lon[0]*Ts, 1-K_Lon[1]*Ts, 0, 0, 0],
-                      [0, 0, 0, 1-K_Lat[0]*(Ts**3)/6, Ts-K_Lat[1]*(Ts**3)/6, Ts**2/2-K_Lat[2]*(Ts**3)/6],
-                      [0, 0, 0, -K_Lat[0]*(Ts**2)/2, 1-K_Lat[1]*(Ts**2)/2, Ts-K_Lat[2]*(Ts**2)/2],
-                      [0, 0, 0, -K_Lat[0]*Ts, -K_Lat[1]*Ts, 1-K_Lat[2]*Ts]]) # shape = 6 x 6
-        E = np.array([0, K_Lon[0]*(Ts**2)/2*vx_ref, K_Lon[0]*Ts*vx_ref, \
-                      (Ts**3)/6*K_Lat[0]*y_ref, (Ts**2)/2*K_Lat[0]*y_ref, Ts*K_Lat[0]*y_ref]) # array no shape
-        X_KF = np.zeros((DSV, n_step+1))
-        X_KF[:, 0] = x_ini   
-        for i in range(1, n_step+1):
-            X_KF[:, i] = (F@X_KF[:, i-1]) + E
-            
-        return F, X_KF
+        return self.Table.Rollout(m, x_ini, vx_ref, y_ref, n_step)
         
-    def LaneTracking(self, initial_y, m, K_Lat): # lane tracking model
+    def LaneTracking(self, initial_y, m, K_Lat): # lane tracking model, K_Lat is the lateral gain of Models[m] served by the model table
         L_Center = self.L_Center
-        Ts = self.Ts
-        N = self.N
         if (m == 0) or (m == 2):
             y_ref = L_Center[0]
         elif (m == 1) or (m == 3) or (m == 5):
@@ -172,18 +191,9 @@ class IAIMM_KF( ): # The IMM-KF for motion prediction
         elif (m == 4) or (m == 6):
             y_ref = L_Center[2]
             
-        A = np.array([[1-K_Lat[0]*(Ts**3)/6, Ts-K_Lat[1]*(Ts**3)/6, (Ts**2)/2-K_Lat[2]*(Ts**3)/6],
-                     [-K_Lat[0]*(Ts**2)/2, 1-K_Lat[1]*(Ts**2)/2, Ts-K_Lat[2]*(Ts**2)/2],
-                     [-K_Lat[0]*Ts, -K_Lat[1]*Ts, 1-K_Lat[2]*Ts]])
-        B = np.array([(Ts**3)/6*K_Lat[0], (Ts**2)/2*K_Lat[0], Ts*K_Lat[0]])*y_ref
-        Y = np.zeros((3, N + 1))
-        Y[:, 0] = initial_y
-        for i in range(1, N+1):
-            Y[:, i] =  (A@Y[:, i-1]) + B
-            
-        return Y[0, :] 
+        return self.Table.Lateral(m, initial_y, y_ref)
              
-    def ProjectSpeed(self, Obst_k, x_hat_k, RefPrim, car_index): # Update the reference speed of each mode of each SV using optimization
+    def ProjectSpeed(self, Obst_k, x_hat_k, active, RefPrim, car_index): # Update the reference speed of each active mode of each SV using optimization
         N_M = self.N_M
         N = self.N
         Ts = self.Ts
@@ -191,52 +201,37 @@ class IAIMM_KF( ): # The IMM-KF for motion prediction
         Models = self.Models
         N_Car = self.N_Car
         
-        ProjVal = list( ) 
-        for i in range(N_M): 
-            if np.sum(x_hat_k[i]) == None: 
-                ProjVal.append(None)
-            else:                          
-                K_Lon = Models[i][0]
-                K_Lat = Models[i][1]
-                a = np.array([[1, Ts, (Ts**2)/2], [0, 1-K_Lon[0]*(Ts**2)/2, Ts-K_Lon[1]*(Ts**2)/2], [0, -K_Lon[0]*Ts, 1-K_Lon[1]*Ts]])
-                b = np.array([0, K_Lon[0]*(Ts**2)/2, K_Lon[0]*Ts])
-                initial_x = x_hat_k[i][0:3] 
-                initial_y = x_hat_k[i][3::] 
-                A = list( )
-                B = list( )
-                sel_x = np.array([[1, 0, 0]])
-                A.append(sel_x@b)
-                B.append(sel_x@matrix_power(a, 1)@initial_x)
-                for j in range(1, N):
-                    A.append(sel_x@matrix_power(a, j)@b + A[j - 1])
-                    B.append(sel_x@matrix_power(a, j+1)@initial_x)    
-                SEL = list( )
-                X_SV = list( )
-                for j in range(N_Car):
-                    if j != car_index:
-                        if np.sum(Obst_k[j]) == None:
-                            SEL = SEL + [0]*N 
-                            X_SV = X_SV + [infinity]*N
-                        else:
-                            SEL = SEL + self.Sel_Matrix_Diag(K_Lat, initial_y, Obst_k[j][3], i)
-                            X_SV = X_SV + Obst_k[j][0, 1::].tolist()
-                SEL = np.diag(SEL)
-                X_SV = np.array(X_SV)
-                A = np.array(A).reshape(N, 1)
-                B = np.array(B).reshape(N, 1)
-                A = np.tile(A, (N_Car - 1, 1))
-                B = np.tile(B, (N_Car - 1, 1))
-                X_SV = X_SV.reshape(N*(N_Car - 1), 1)
-                vx_up = self.LongVelProj(A, B, X_SV, RefPrim[i], SEL)
-                vx_up = vx_up.__float__()
-                if vx_up < 0:
-                    vx_up = 0
-                ProjVal.append(vx_up)      
-        ProjVal = np.array(ProjVal)
+        ProjVal = np.zeros(N_M) 
+        for i in np.flatnonzero(active): 
+            K_Lat = Models[i][1]
+            initial_x = x_hat_k[i][0:3] 
+            initial_y = x_hat_k[i][3::] 
+            A, B = self.Table.Longitudinal(i, initial_x)
+            SEL = list( )
+            X_SV = list( )
+            for j in range(N_Car):
+                if j != car_index:
+                    if np.sum(Obst_k[j]) == None:
+                        SEL = SEL + [0]*N 
+                        X_SV = X_SV + [infinity]*N
+                    else:
+                        SEL = SEL + self.Sel_Matrix_Diag(K_Lat, initial_y, Obst_k[j][3], i)
+                        X_SV = X_SV + Obst_k[j][0, 1::].tolist()
+            SEL = np.array(SEL, dtype = bool)
+            X_SV = np.array(X_SV) 
+            A = np.array(A).reshape(N, 1)
+            B = np.array(B).reshape(N, 1)
+            A = np.tile(A, (N_Car - 1, 1))
+            B = np.tile(B, (N_Car - 1, 1))
+            X_SV = X_SV.reshape(N*(N_Car - 1), 1)
+            vx_up = self.Solve_QCQP(A, B, X_SV, RefPrim[i], SEL)
+            if vx_up < 0:
+                vx_up = 0
+            ProjVal[i] = vx_up      
 
         return ProjVal
         
-    def Final_Return(self, k, MU, X_Hat, P, Y, Obst_k, car_index): # Return computation results
+    def Final_Return(self, k, MU, X_Hat, P, Y, Obst_k, car_index, Car = None): # Return computation results, handed back in the legacy per-mode list format
         Ts = self.Ts
         N = self.N
         N_M = self.N_M
@@ -246,56 +241,38 @@ class IAIMM_KF( ): # The IMM-KF for motion prediction
         H = self.H
         Models = self.Models
         DSV = self.DSV
-        mu_k_1 = MU[k - 1][car_index]       
-        x_hat_k_1 = X_Hat[k - 1][car_index] 
-        p_k_1 = P[k - 1][car_index]      
-        y_pos_k = Y[k][car_index][-1]     
-        y_pos_k_1 = Y[k-1][car_index][-1]
         y_k = Y[k][car_index]
-        ActPse = np.array([None]*N_M)
-        x_hat_k, p_k, y_tilde_k, s_k, c, RefPrim = self.KalmanFilter(mu_k_1, x_hat_k_1, y_k, y_pos_k_1, y_pos_k, p_k_1)
-        REF = self.ProjectSpeed(Obst_k, x_hat_k, RefPrim, car_index) 
+        x_hat_k, p_k, log_L_y, c, RefPrim = self.Filtered(k, MU, X_Hat, P, Y, car_index, Car)
+        active = c != 0
+        REF = self.ProjectSpeed(Obst_k, x_hat_k, active, RefPrim, car_index) 
         t = np.arange(0, Ts*(N + 1), Ts, dtype = float)
-        for i in range(N_M):
-            if np.sum(x_hat_k[i]) == None: 
-                ActPse[i] = None
-            else:
-                K_Lon = Models[i][0]
-                K_Lat = Models[i][1] 
-                _, X = self.VelocityTracking(x_hat_k[i], REF[i], i, N, K_Lon, K_Lat)
-                ax = X[2, :]*X[2, :]
-                ay = X[5, :]*X[5, :]
-                
-                if (i == 0) or (i == 2):
-                    y_ref = L_Center[0]
-                elif (i == 1) or (i == 3) or (i == 5):
-                    y_ref = L_Center[1]
-                elif (i == 4) or (i == 6):
-                    y_ref = L_Center[2]
-                    
-                ActPse[i] = Weight[0]*np.trapz(ax, t) + Weight[1]*np.trapz(ay, t) + \
-                Weight[2]*((REF[i] - x_hat_k[i][1])**2) + Weight[3]*((y_ref - x_hat_k[i][3])**2)
-                ActPse[i] = ActPse[i] + 0.0001
+        log_L = np.full(N_M, -np.inf)
+        x_po_all_k = np.zeros((N_M, DSV, N + 1))
+        for i in np.flatnonzero(active):
+            K_Lon = Models[i][0]
+            K_Lat = Models[i][1] 
+            _, x_po_all_k[i] = self.VelocityTracking(x_hat_k[i], REF[i], i, N, K_Lon, K_Lat)
+            ax = x_po_all_k[i][2, :]*x_po_all_k[i][2, :]
+            ay = x_po_all_k[i][5, :]*x_po_all_k[i][5, :]
             
-        L = np.array([None]*N_M)
-        y_tilde_aug = list( )
-        s_aug = list( )
-        for i in range(N_M):
-            if c[i] == 0:
-                y_tilde_aug.append(None)
-                s_aug.append(None)
-                L[i] = 0
-            else:
-                y_tilde_aug.append(np.append(y_tilde_k[i], np.sqrt(ActPse[i])))
-                s_aug.append(sl.block_diag(s_k[i], ActPse[i]*0.1))
-                L[i] = np.exp(-1/2*y_tilde_aug[i]@np.linalg.pinv(s_aug[i])@y_tilde_aug[i])/np.sqrt(np.linalg.det(2*math.pi*s_aug[i]))
-        temp = c@L
-        mu_k = c*L/temp
+            if (i == 0) or (i == 2):
+                y_ref = L_Center[0]
+            elif (i == 1) or (i == 3) or (i == 5):
+                y_ref = L_Center[1]
+            elif (i == 4) or (i == 6):
+                y_ref = L_Center[2]
+                
+            ActPse = Weight[0]*np.trapz(ax, t) + Weight[1]*np.trapz(ay, t) + \
+            Weight[2]*((REF[i] - x_hat_k[i][1])**2) + Weight[3]*((y_ref - x_hat_k[i][3])**2)
+            ActPse = ActPse + 0.0001
+            log_L[i] = log_L_y[i] - 1/2/0.1 - 1/2*np.log(2*math.pi*0.1*ActPse) # the pseudo-measurement sqrt(ActPse) with variance 0.1*ActPse factors out of the augmented Gaussian
+        log_mu = np.full(N_M, -np.inf)
+        log_mu[active] = np.log(c[active]) + log_L[active]
+        mu_k = np.exp(log_mu - np.max(log_mu)) # log-sum-exp normalization, no underflow for unlikely modes
+        mu_k = mu_k/np.sum(mu_k)
         m_k = np.argmax(mu_k)
-        x_state_k = np.array([0]*DSV)
-        for i in range(N_M):
-            if (np.sum(x_hat_k[i]) != None):
-                x_state_k = x_state_k + x_hat_k[i]*mu_k[i]
+        x_state_k = mu_k@x_hat_k
+                
         _, x_pre_k = self.VelocityTracking(x_state_k, REF[m_k], m_k, N, Models[m_k][0], Models[m_k][1]) 
         
         if (m_k == 0) or (m_k == 2):
@@ -305,19 +282,8 @@ class IAIMM_KF( ): # The IMM-KF for motion prediction
         elif (m_k == 4) or (m_k == 6):
             ref_lane = L_Center[2]
         y_k_plus_1 = H@x_pre_k[:, 1] 
-        
-        x_po_all_k = list( )
-        for i in range(N_M):
-            if np.sum(x_hat_k[i]) == None:
-                temp_tra = None
-            else:
-                K_Lon = Models[i][0]
-                K_Lat = Models[i][1]
-                _, temp_tra = self.VelocityTracking(x_hat_k[i], REF[i], i, N, K_Lon, K_Lat)
-                
-            x_po_all_k.append(temp_tra)
 
-        return REF[m_k], ref_lane, mu_k, m_k, x_hat_k, p_k, x_state_k, x_pre_k, y_k_plus_1, REF, x_po_all_k
+        return REF[m_k], ref_lane, mu_k, m_k, Legacy(x_hat_k, active), Legacy(p_k, active), x_state_k, x_pre_k, y_k_plus_1, np.array(Legacy(REF, active)), Legacy(x_po_all_k, active)
         
     def ProTrans(self, Pos_k_1, Pos_k): # define the probability transformation matrix in IAIMM-KF, you can manually design it
         N_M = self.N_M
@@ -378,28 +344,60 @@ class IAIMM_KF( ): # The IMM-KF for motion prediction
             
         return SEL
     
-    def construct_QCQP(self): # The QCQP problem for computing the collision-free reference speed of each mode of each SV (Note in the original method it was an mixted-interger programming)
-        N = self.N
-        N_Car = self.N_Car
+    def Solve_QCQP(self, A, B, X_SV, v_pri, SEL): # the collision-free reference speed closest to v_pri, in closed form unless qcqp_method is 'ipopt' or the selected rows cannot be satisfied
+        if self.qcqp_method != 'ipopt':
+            v_up = self.AnalyticProj(A, B, X_SV, v_pri, SEL)
+            if v_up is not None:
+                return v_up
+        Row = np.flatnonzero(SEL)
+        n_row = 0 if len(Row) == 0 else 1 << (len(Row) - 1).bit_length( ) # padded row count, so at most log2(N*(N_Car - 1)) + 2 problems
+        if n_row not in self.LongVelProj:
+            self.LongVelProj[n_row] = self.construct_QCQP(n_row)
+        Data = np.zeros((4, n_row, 1)) # A, B, X_SV and the row weight S of the selected rows, zero padded
+        Data[0:3, 0:len(Row), 0] = [np.ravel(A)[Row], np.ravel(B)[Row], np.ravel(X_SV)[Row]]
+        Data[3, 0:len(Row), 0] = 1
+
+        return self.LongVelProj[n_row](Data[0], Data[1], Data[2], v_pri, Data[3]).__float__()
+
+    def AnalyticProj(self, A, B, X_SV, v_pri, SEL): # each selected row (X_SV - A*v_up - B)^2 >= l_veh^2 keeps the SV on its side of the other car: v_up <= (X_SV-B-l_veh)/A for a car ahead, v_up >= (X_SV-B+l_veh)/A for a car behind, v_pri is clipped to the intersection
+        l_veh = self.l_veh
+        a = np.ravel(A)[SEL]
+        d = np.ravel(X_SV)[SEL] - np.ravel(B)[SEL]
+        if np.any(np.abs(d) < l_veh): # rows already violated with a zero reference speed have no side to keep
+            return None
+        Ahead = d > 0
+        Moving = a != 0
+        Bound = np.full(a.shape, np.inf)
+        Bound[Moving] = (d[Moving] - np.where(Ahead[Moving], l_veh, -l_veh))/a[Moving]
+        Up = (Ahead & (a > 0)) | (~Ahead & (a < 0))
+        v_max = np.min(Bound[Moving & Up], initial = np.inf)
+        v_min = np.max(Bound[Moving & ~Up], initial = -np.inf)
+        if v_min > v_max:
+            return None
+
+        return min(max(float(v_pri), v_min), v_max)
+
+    def construct_QCQP(self, n_row): # The QCQP problem for computing the collision-free reference speed of each mode of each SV over n_row rows: the selected steps weighted by S = 1, the zero padding switched off by S = 0 (Note in the original method it was an mixted-interger programming)
         l_veh = self.l_veh
         opti = casadi.Opti( )
-        H = opti.parameter(N*(N_Car - 1), N*(N_Car - 1))
-        X_SV = opti.parameter(N*(N_Car - 1), 1)
-        A = opti.parameter(N*(N_Car - 1), 1)
-        B = opti.parameter(N*(N_Car - 1), 1)
+        X_SV = opti.parameter(n_row, 1)
+        A = opti.parameter(n_row, 1)
+        B = opti.parameter(n_row, 1)
         v_pri = opti.parameter( )
+        S = opti.parameter(n_row, 1)
         v_up = opti.variable( )
         X_EV = A*v_up + B
         D_Error = X_SV - X_EV
         D_Error = np.multiply(D_Error, D_Error)
-        Safe_D = np.ones((N*(N_Car-1), 1))*(l_veh**2)
+        Safe_D = np.ones((n_row, 1))*(l_veh**2)
         J = (v_pri - v_up)**2
         opti.minimize(J)
-        opti.subject_to(H@Safe_D <= H@D_Error)
+        if n_row > 0:
+            opti.subject_to(S*Safe_D <= S*D_Error)
         opts = {"ipopt.warm_start_init_point": "yes",
                 "ipopt.print_level": 0,
                 "ipopt.linear_solver": "ma57", # You can comment this line of you do not have ma57
                 "print_time": False}
         opti.solver('ipopt', opts)
         
-        return opti.to_function('f', [A, B, X_SV, v_pri, H], [v_up])
\ No newline at end of file
+        return opti.to_function('f', [A, B, X_SV, v_pri, S], [v_up])
\ No newline at end of file
@@ -0,0 +1,102 @@
+import numpy as np
+
+class Model_Table( ): # Stacked horizon responses of the velocity/lane-tracking sub-models, so that a rollout is one matrix multiply
+    def __init__(self, Params, Models = None):
+        self.Ts             = Params['Ts']
+        self.N              = Params['N']
+        self.Models         = Params['Models'] if Models is None else Models
+        self.std_parameters = Params.get('std_parameters', None) if Models is None else None
+        self.Phi, self.Gamma = self.Nominal( )
+        self.Set_Lon, self.Set_Lat = self.Sampled( )
+
+    def LongMatrices(self, K_Lon): # longitudinal velocity-tracking model for a stack of gain sets, K_Lon: (n, 2)
+        Ts = self.Ts
+        n = K_Lon.shape[0]
+        A = np.zeros((n, 3, 3))
+        A[:, 0, 0] = 1
+        A[:, 0, 1] = Ts
+        A[:, 0, 2] = (Ts**2)/2
+        A[:, 1, 1] = 1-K_Lon[:, 0]*Ts**2/2
+        A[:, 1, 2] = Ts-K_Lon[:, 1]*(Ts**2)/2
+        A[:, 2, 1] = -K_Lon[:, 0]*Ts
+        A[:, 2, 2] = 1-K_Lon[:, 1]*Ts
+        B = np.stack([np.zeros(n), K_Lon[:, 0]*(Ts**2)/2, K_Lon[:, 0]*Ts], axis = 1)
+
+        return A, B
+
+    def LatMatrices(self, K_Lat): # lateral lane-tracking model for a stack of gain sets, K_Lat: (n, 3)
+        Ts = self.Ts
+        n = K_Lat.shape[0]
+        A = np.zeros((n, 3, 3))
+        A[:, 0, 0] = 1-K_Lat[:, 0]*(Ts**3)/6
+        A[:, 0, 1] = Ts-K_Lat[:, 1]*(Ts**3)/6
+        A[:, 0, 2] = (Ts**2)/2-K_Lat[:, 2]*(Ts**3)/6
+        A[:, 1, 0] = -K_Lat[:, 0]*(Ts**2)/2
+        A[:, 1, 1] = 1-K_Lat[:, 1]*(Ts**2)/2
+        A[:, 1, 2] = Ts-K_Lat[:, 2]*(Ts**2)/2
+        A[:, 2, 0] = -K_Lat[:, 0]*Ts
+        A[:, 2, 1] = -K_Lat[:, 1]*Ts
+        A[:, 2, 2] = 1-K_Lat[:, 2]*Ts
+        B = np.stack([(Ts**3)/6*K_Lat[:, 0], (Ts**2)/2*K_Lat[:, 0], Ts*K_Lat[:, 0]], axis = 1)
+
+        return A, B
+
+    def Power(self, A, B): # Phi = [I, A, ..., A^N] and the forced response Gamma to a unit reference, shapes (n, N+1, 3, 3) and (n, N+1, 3)
+        N = self.N
+        n = A.shape[0]
+        Phi = np.zeros((n, N + 1, 3, 3))
+        Gamma = np.zeros((n, N + 1, 3))
+        Phi[:, 0] = np.eye(3)
+        for i in range(1, N + 1):
+            Phi[:, i] = A@Phi[:, i-1]
+            Gamma[:, i] = np.einsum('nab,nb->na', A, Gamma[:, i-1]) + B
+
+        return Phi, Gamma
+
+    def Nominal(self): # 6-state responses of each sub-model: X[:, i] = Phi[m][i]@x_ini + Gamma[m][i]@[vx_ref, y_ref]
+        N = self.N
+        Models = self.Models
+        K_Lon = np.array([np.ravel(Model[0]) for Model in Models], dtype = float)
+        K_Lat = np.array([np.ravel(Model[1]) for Model in Models], dtype = float)
+        Phi_Lon, Gamma_Lon = self.Power(*self.LongMatrices(K_Lon))
+        Phi_Lat, Gamma_Lat = self.Power(*self.LatMatrices(K_Lat))
+        Phi = np.zeros((len(Models), N + 1, 6, 6))
+        Gamma = np.zeros((len(Models), N + 1, 6, 2))
+        Phi[:, :, 0:3, 0:3] = Phi_Lon
+        Phi[:, :, 3:6, 3:6] = Phi_Lat
+        Gamma[:, :, 0:3, 0] = Gamma_Lon
+        Gamma[:, :, 3:6, 1] = Gamma_Lat
+
+        return Phi, Gamma
+
+    def Sampled(self): # position responses to [initial state, reference] of every gain set in std_parameters, (n, N+1, 4) per mode
+        std_parameters = self.std_parameters
+        if std_parameters is None:
+            return None, None
+        Set_Lon = list( )
+        Set_Lat = list( )
+        for m in range(len(std_parameters)):
+            K_set_lon = np.array([K[0] for K in std_parameters[m][0]])
+            Phi, Gamma = self.Power(*self.LongMatrices(K_set_lon))
+            Set_Lon.append(np.concatenate((Phi[:, :, 0, :], Gamma[:, :, 0:1]), axis = 2))
+            if (m != 0) and (m != 3) and (m != 6): # lane-changing modes also carry lateral gain sets
+                K_set_lat = np.array([K[0] for K in std_parameters[m][1]])
+                Phi, Gamma = self.Power(*self.LatMatrices(K_set_lat))
+                Set_Lat.append(np.concatenate((Phi[:, :, 0, :], Gamma[:, :, 0:1]), axis = 2))
+            else:
+                Set_Lat.append(None)
+
+        return Set_Lon, Set_Lat
+
+    def Rollout(self, m, x_ini, vx_ref, y_ref, n_step): # n_step rollout of sub-model m, same output as the tracking models: F and X (6, n_step+1)
+        X = self.Phi[m, 0:n_step+1]@x_ini + self.Gamma[m, 0:n_step+1]@np.array([vx_ref, y_ref], dtype = float)
+
+        return self.Phi[m, 1], X.T
+
+    def Lateral(self, m, initial_y, y_ref): # lateral positions over the horizon, (N+1, )
+
+        return self.Phi[m, :, 3, 3:6]@initial_y + self.Gamma[m, :, 3, 1]*y_ref
+
+    def Longitudinal(self, m, initial_x): # longitudinal positions at steps 1..N as A*vx_ref + B
+
+        return self.Gamma[m, 1:, 0, 0], self.Phi[m, 1:, 0, 0:3]@initial_x
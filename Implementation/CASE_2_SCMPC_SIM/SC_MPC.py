@@ -1,7 +1,8 @@
 import numpy as np
 import time
 import casadi
-from numpy.linalg import matrix_power
+from Model_Table import Model_Table
+from MPC_Solver import MPC_Solver
 from scipy.stats import multivariate_normal
 
 class SC_MPC( ): # The Scenario MPC (SC MPC) for EV planning
@@ -44,65 +45,27 @@ class SC_MPC( ): # The Scenario MPC (SC MPC) for EV planning
         self.Q5             = Params['Q5']
         self.Q6             = Params['Q6']
         self.Q7             = Params['Q7']
-        self.LongVelProj = self.construct_QP( )
-        self.EVplanning  = self.contruct_MT_MPC( )
+        self.Table       = Model_Table(Params, [[self.K_Lon_EV, self.K_Lat_EV]]) # EV tracking model as a single sub-model, lane reference passed per call
+        self.qp_method   = Params.get('qp_method', 'analytic') # 'analytic': closed-form projection of the primary speed, 'ipopt': the QP solved by IPOPT
+        self.LongVelProj = dict( ) # IPOPT problems keyed on the row count: the selected rows compacted into the smallest power of two holding them, the padding switched off by a zero row weight, built on first use
+        self.EVplanning  = self.contruct_MT_MPC(Params)
     
     def VelocityTracking(self, x_ini, vx_ref, m, n_step): # velocity tracking model
-        Ts = self.Ts
         L_Center = self.L_Center
-        DSV = self.DSV
-        K_Lon = self.K_Lon_EV
-        K_Lat = self.K_Lat_EV
-        k_lo_1 = K_Lon[0]
-        k_lo_2 = K_Lon[1]
-        k_la_1 = K_Lat[0]
-        k_la_2 = K_Lat[1]
-        k_la_3 = K_Lat[2] 
         y_ref = L_Center[m]
-        F = np.array([[1, Ts, Ts**2/2, 0, 0, 0],
-                      [0, 1-k_lo_1*Ts**2/2, Ts-k_lo_2*(Ts**2)/2, 0, 0, 0],
-                      [0, -k_lo_1*Ts, 1-k_lo_2*Ts, 0, 0, 0],
-                      [0, 0, 0, 1-k_la_1*(Ts**3)/6, Ts-k_la_2*(Ts**3)/6, Ts**2/2-k_la_3*(Ts**3)/6],
-                      [0, 0, 0, -k_la_1*(Ts**2)/2, 1-k_la_2*(Ts**2)/2, Ts-k_la_3*(Ts**2)/2],
-                      [0, 0, 0, -k_la_1*Ts, -k_la_2*Ts, 1-k_la_3*Ts]]) 
-        E = np.array([0, k_lo_1*(Ts**2)/2*vx_ref, k_lo_1*Ts*vx_ref, (Ts**3)/6*k_la_1*y_ref, (Ts**2)/2*k_la_1*y_ref, Ts*k_la_1*y_ref]) 
-        X_KF = np.zeros((DSV, n_step+1))
-        X_KF[:, 0] = x_ini
-            
-        for i in range(1, n_step+1):
-            X_KF[:, i] = (F@X_KF[:, i-1]) + E
             
-        return F, X_KF
+        return self.Table.Rollout(0, x_ini, vx_ref, y_ref, n_step)
         
     def LaneTracking(self, initial_y, m): # lane tracking model
         L_Center = self.L_Center
-        Ts = self.Ts
-        N = self.N
-        K_Lat = self.K_Lat_EV
-        k_la_1 = K_Lat[0]
-        k_la_2 = K_Lat[1]
-        k_la_3 = K_Lat[2]
         y_ref = L_Center[m]
-        A = np.array([[1-k_la_1*(Ts**3)/6, Ts-k_la_2*(Ts**3)/6, (Ts**2)/2-k_la_3*(Ts**3)/6],
-                      [-k_la_1*(Ts**2)/2, 1-k_la_2*(Ts**2)/2, Ts-k_la_3*(Ts**2)/2],
-                      [-k_la_1*Ts, -k_la_2*Ts, 1-k_la_3*Ts]])
-        B = np.array([(Ts**3)/6*k_la_1, (Ts**2)/2*k_la_1, Ts*k_la_1])*y_ref
-        Y = np.zeros((3, N + 1))
-        Y[:, 0] = initial_y
         
-        for i in range(1, N+1):
-            Y[:, i] =  (A@Y[:, i-1]) + B    
-        
-        return Y[0, :] 
+        return self.Table.Lateral(0, initial_y, y_ref)
     
-    def LookLane(self, y_k): # check lane index according to the current lateral position
+    def LookLane(self, y_k): # check lane index according to the current lateral position, y_k may be a scalar or an array
         L_Bound = self.L_Bound
-        if (y_k <= L_Bound[1]): 
-            LanePos = 1
-        elif (L_Bound[1] < y_k) and (y_k <= L_Bound[2]):
-            LanePos = 2
-        elif (L_Bound[2] < y_k):
-            LanePos = 3
+        N_Lane = self.N_Lane
+        LanePos = np.digitize(y_k, L_Bound[1:N_Lane], right=True) + 1
         
         return LanePos
     
@@ -134,9 +97,6 @@ class SC_MPC( ): # The Scenario MPC (SC MPC) for EV planning
                             Pr.append(MU_k[i][j])
                             model_index.append(j)
                     OCC_sv = np.ones((4, N+1)) 
-                    max_y_mark = np.array([None]*(N + 1)) 
-                    mid_y_mark = np.array([None]*(N + 1)) 
-                    min_y_mark = np.array([None]*(N + 1)) 
                     Index = np.array(np.argsort(Pr)) 
                     model_index = np.array(model_index)
                     model_index = model_index[Index]
@@ -167,33 +127,20 @@ class SC_MPC( ): # The Scenario MPC (SC MPC) for EV planning
                         Dy = (np.max(temp_y_po[:, j]) - np.min(temp_y_po[:, j]))/2 + zeta_w*w_veh
                         occ = np.array([x_bar, y_bar, Dx, Dy]) 
                         OCC_sv[:, j] = occ
-                        max_y = occ[1] + occ[3]
-                        min_y = occ[1] - occ[3]
-                        max_y_mark[j] = self.LookLane(max_y)
-                        mid_y_mark[j] = self.LookLane(occ[1])
-                        min_y_mark[j] = self.LookLane(min_y)
 
                 elif (K_SCMPC == 0) or (i == 3):
                     OCC_sv = np.ones((4, N+1)) 
-                    max_y_mark = np.array([None]*(N + 1)) 
-                    mid_y_mark = np.array([None]*(N + 1)) 
-                    min_y_mark = np.array([None]*(N + 1)) 
                     temp_x_po = Obst_k[i][0, :]
                     temp_y_po = Obst_k[i][3, :]
                     for j in range(N + 1):
                         occ = np.array([temp_x_po[j], temp_y_po[j], zeta_l*l_veh, zeta_w*w_veh]) 
                         OCC_sv[:, j] = occ
-                        max_y = occ[1] + occ[3] 
-                        min_y = occ[1] - occ[3]
-                        max_y_mark[j] = self.LookLane(max_y)
-                        mid_y_mark[j] = self.LookLane(occ[1])
-                        min_y_mark[j] = self.LookLane(min_y)
                 
                 OCC_SV.insert(i, OCC_sv)
                 x_position[i, :] = OCC_sv[0, :] - OCC_sv[2, :]
-                y_mark_up[i, :] = max_y_mark
-                y_mark_middle[i, :] = mid_y_mark
-                y_mark_low[i, :] = min_y_mark
+                y_mark_up[i, :] = self.LookLane(OCC_sv[1, :] + OCC_sv[3, :])
+                y_mark_middle[i, :] = self.LookLane(OCC_sv[1, :])
+                y_mark_low[i, :] = self.LookLane(OCC_sv[1, :] - OCC_sv[3, :])
             
             else: 
                 OCC_SV.append(None)
@@ -202,31 +149,20 @@ class SC_MPC( ): # The Scenario MPC (SC MPC) for EV planning
                 y_mark_middle[i, :] = np.array([0]*(N + 1))
                 y_mark_low[i, :] = np.array([0]*(N + 1))
         
-        Temp_up = np.array([infinity]*(N + 1))
-        Temp_middle = np.array([infinity]*(N + 1))
-        Temp_low = np.array([infinity]*(N + 1))
-        X_DV_Lane = [Temp_up, Temp_middle, Temp_low]
-        for i in range(N_Lane):
-            for k in range(N + 1):
-                index_up =     np.where(y_mark_up[:, k] == i+1)
-                index_middle = np.where(y_mark_middle[:, k] == i+1)
-                index_low =    np.where(y_mark_low[:, k] == i+1)
-                if len(index_up[0]) == 0:
-                    temp_lane_up = infinity
-                else:
-                    temp_lane_up = np.min(x_position[:, k][index_up[0]])
-                if len(index_middle[0]) == 0:
-                    temp_lane_middle = infinity
-                else:
-                    temp_lane_middle = np.min(x_position[:, k][index_middle[0]])
-                if len(index_low[0]) == 0:
-                    temp_lane_low = infinity
-                else:
-                    temp_lane_low = np.min(x_position[:, k][index_low[0]])
-                X_DV_Lane[i][k] = np.min([temp_lane_up, temp_lane_middle, temp_lane_low])
+        X_DV_Lane = self.LaneLeader(x_position, y_mark_up, y_mark_middle, y_mark_low)
         
         return OCC_SV, X_DV_Lane
                 
+    def LaneLeader(self, x_position, y_mark_up, y_mark_middle, y_mark_low): # the closest occupancy rear end in each lane over the horizon
+        N_Lane = self.N_Lane
+        infinity = self.infinity
+        Lane = np.arange(1, N_Lane + 1)[:, None, None]
+        In_Lane = (y_mark_up[None, :, :] == Lane) | (y_mark_middle[None, :, :] == Lane) | (y_mark_low[None, :, :] == Lane) # (N_Lane, N_Car, N+1)
+        X_DV_Lane = np.min(np.where(In_Lane, x_position[None, :, :], infinity), axis=1, initial=infinity)
+        X_DV_Lane = X_DV_Lane.astype(np.asarray(infinity).dtype) # same dtype as the per-lane buffers filled with infinity before
+
+        return list(X_DV_Lane)
+
     def SamplingGeneration(self, m, vx_ref, x_ini): # Sampling based approach for generating scenarios for constructing the obstacle occupancy
         Ts = self.Ts
         L_Center = self.L_Center
@@ -325,10 +261,6 @@ class SC_MPC( ): # The Scenario MPC (SC MPC) for EV planning
         Ts = self.Ts
         DSV = self.DSV
         H = self.H
-        K_Lon = self.K_Lon_EV
-        
-        a = np.array([[1, Ts, (Ts**2)/2], [0, 1-K_Lon[0]*(Ts**2)/2, Ts-K_Lon[1]*(Ts**2)/2], [0, -K_Lon[0]*Ts, 1-K_Lon[1]*Ts]])
-        b = np.array([0, K_Lon[0]*(Ts**2)/2, K_Lon[0]*Ts])
     
         OCC_SV, X_DV_Lane = self.ScenarioObstacleRealization(Obst_k, MU_k, Ref_Speed_All_k, y_k[0])
         ProjVal = list( ) 
@@ -339,14 +271,7 @@ class SC_MPC( ): # The Scenario MPC (SC MPC) for EV planning
             else: 
                 initial_x = x_hat_k[i][0:3] 
                 initial_y = x_hat_k[i][3::] 
-                A = list( )
-                B = list( )
-                sel_x = np.array([[1, 0, 0]])
-                A.append(sel_x@b)
-                B.append(sel_x@matrix_power(a, 1)@initial_x)
-                for j in range(1, N):
-                    A.append(sel_x@matrix_power(a, j)@b + A[j - 1])
-                    B.append(sel_x@matrix_power(a, j+1)@initial_x)
+                A, B = self.Table.Longitudinal(0, initial_x)
                 SEL = list( )
                 X_SV = list( )
                 for j in range(N_Car):
@@ -360,15 +285,14 @@ class SC_MPC( ): # The Scenario MPC (SC MPC) for EV planning
                             SEL = SEL + self.Sel_Matrix(initial_y, o_SV, W_SV, i)
                             temp_x = OCC_SV[j][0, 1::] - OCC_SV[j][2, 1::]
                             X_SV = X_SV + temp_x.tolist()     
-                SEL = np.diag(SEL)
+                SEL = np.array(SEL, dtype = bool)
                 X_SV = np.array(X_SV)
                 A = np.array(A).reshape(N, 1)
                 B = np.array(B).reshape(N, 1)
                 A = np.tile(A, (N_Car - 1, 1))
                 B = np.tile(B, (N_Car - 1, 1))
                 X_SV = X_SV.reshape(N*(N_Car - 1), 1)
-                vx_up = self.LongVelProj(A, B, X_SV, RefPrim[i], SEL)
-                vx_up = vx_up.__float__()
+                vx_up = self.Solve_QP(A, B, X_SV, RefPrim[i], SEL)
                 if vx_up < 0:
                     vx_up = 0
                 ProjVal.append(vx_up)
@@ -431,9 +355,12 @@ class SC_MPC( ): # The Scenario MPC (SC MPC) for EV planning
         Initial = casadi.vertcat(Initial)
         Terminal = casadi.vertcat(Terminal)
         X_DV_Casadi = casadi.vertcat(X_DV)
-        Traj_k, U_k = self.EVplanning(Initial, Terminal, X_DV_Casadi)
+        self.EVplanning.Cycle(k)
+        Guess = self.EVplanning.Shift(None, Initial)
+        Traj_k, U_k = self.EVplanning(Initial, Terminal, X_DV_Casadi, Guess = Guess)
         Traj_k = Traj_k.full( )
         U_k = U_k.full( )
+        self.EVplanning.Store(None, [Traj_k, U_k])
         x_pre_k = self.V2G(Traj_k)
         state_k_plus_1_loc = Traj_k[:, 1]
         state_k_plus_1_glo = x_pre_k[:, 1]
@@ -477,33 +404,63 @@ class SC_MPC( ): # The Scenario MPC (SC MPC) for EV planning
             
         return SEL # Transfer the steps into a matrix
     
-    def construct_QP(self):  # QP problem for computing the reference speed of each nominal maneuver of EV
-        N = self.N
+    def Solve_QP(self, A, B, X_SV, v_pri, SEL): # the safe reference speed closest to v_pri, in closed form unless qp_method is 'ipopt' or the selected rows cannot be satisfied
+        if self.qp_method != 'ipopt':
+            v_up = self.AnalyticProj(A, B, X_SV, v_pri, SEL)
+            if v_up is not None:
+                return v_up
+        Row = np.flatnonzero(SEL)
+        n_row = 0 if len(Row) == 0 else 1 << (len(Row) - 1).bit_length( ) # padded row count, so at most log2(N*(N_Car - 1)) + 2 problems
+        if n_row not in self.LongVelProj:
+            self.LongVelProj[n_row] = self.construct_QP(n_row)
+        Data = np.zeros((4, n_row, 1)) # A, B, X_SV and the row weight S of the selected rows, zero padded
+        Data[0:3, 0:len(Row), 0] = [np.ravel(A)[Row], np.ravel(B)[Row], np.ravel(X_SV)[Row]]
+        Data[3, 0:len(Row), 0] = 1
+
+        return self.LongVelProj[n_row](Data[0], Data[1], Data[2], v_pri, Data[3]).__float__()
+
+    def AnalyticProj(self, A, B, X_SV, v_pri, SEL): # each selected row Th_QP*v_up + l_veh/2 <= X_SV - A*v_up - B is linear in v_up, so the rows reduce to the upper bound v_up <= min((X_SV-B-l_veh/2)/(A+Th_QP)) that v_pri is clipped to
+        Th_QP = self.Th_QP
+        l_veh = self.l_veh
+        a = np.ravel(A)[SEL] + Th_QP
+        d = np.ravel(X_SV)[SEL] - np.ravel(B)[SEL] - l_veh/2
+        Up = a > 0
+        Down = a < 0
+        if np.any(~Up & ~Down & (d < 0)): # rows that do not depend on v_up and are violated
+            return None
+        v_max = np.min(d[Up]/a[Up], initial = np.inf)
+        v_min = np.max(d[Down]/a[Down], initial = -np.inf)
+        if v_min > v_max:
+            return None
+
+        return min(max(float(v_pri), v_min), v_max)
+
+    def construct_QP(self, n_row):  # QP problem for computing the reference speed of each nominal maneuver of EV over n_row rows: the selected steps weighted by S = 1, the zero padding switched off by S = 0
         Th_QP = self.Th_QP
-        N_Car = self.N_Car
         l_veh = self.l_veh
         opti = casadi.Opti( )
-        H = opti.parameter(N*(N_Car - 1), N*(N_Car - 1))
-        X_SV = opti.parameter(N*(N_Car - 1), 1)
-        A = opti.parameter(N*(N_Car - 1), 1)
-        B = opti.parameter(N*(N_Car - 1), 1)
+        X_SV = opti.parameter(n_row, 1)
+        A = opti.parameter(n_row, 1)
+        B = opti.parameter(n_row, 1)
         v_pri = opti.parameter( )
+        S = opti.parameter(n_row, 1)
         v_up = opti.variable( )
         X_EV = A*v_up + B
         D_Error = X_SV - X_EV
-        Safe_D = Th_QP*v_up*np.ones((N*(N_Car-1), 1)) + l_veh/2
+        Safe_D = Th_QP*v_up*np.ones((n_row, 1)) + l_veh/2
         J = (v_pri - v_up)**2
         opti.minimize(J)
-        opti.subject_to(H@Safe_D <= H@D_Error)
+        if n_row > 0:
+            opti.subject_to(S*Safe_D <= S*D_Error)
         opts = {"ipopt.warm_start_init_point": "yes",
                 "ipopt.print_level": 0,
                 "ipopt.linear_solver": "ma57", # You can comment this line if you do not have ma57 solver
                 "print_time": False}
         opti.solver('ipopt', opts)
         
-        return opti.to_function('f', [A, B, X_SV, v_pri, H], [v_up])
+        return opti.to_function('f', [A, B, X_SV, v_pri, S], [v_up])
     
-    def contruct_MT_MPC(self): # Moving Target MPC for EV planning
+    def contruct_MT_MPC(self, Params): # Moving Target MPC for EV planning, warm-started from the previous plan when mpc_warm is set
         N = self.N
         Nx = self.DEV
         Ts = self.Ts
@@ -559,9 +516,10 @@ class SC_MPC( ): # The Scenario MPC (SC MPC) for EV planning
                 "ipopt.print_level": 0,
                 "ipopt.linear_solver": "ma57", # You can comment this line if you do not have ma57 solver
                 "print_time": False}
-        opti.solver('ipopt', opts)
+        opts_warm = {"ipopt.mu_init": 1e-6,
+                     "ipopt.warm_start_bound_push": 1e-9}
 
-        return opti.to_function('g', [Initial, Terminal, X_DV], [X, Opt_variable])
+        return MPC_Solver(Params, opti, [Initial, Terminal, X_DV], [X, Opt_variable], opts, opts_warm, 'g')
         
     def vehicle_model(self, w, snap, alpha): # EV model, linear time varying kinematic model
         l_f = self.l_f
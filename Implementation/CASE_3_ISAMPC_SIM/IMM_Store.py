@@ -0,0 +1,59 @@
+import numpy as np
+
+def Dense(Modes, N_M, shape): # legacy adapter: None-padded list over the modes -> (N_M, *shape) array and active-mode mask
+    Array = np.zeros((N_M, ) + shape)
+    Active = np.zeros(N_M, dtype = bool)
+    if Modes is None:
+        return Array, Active
+    if isinstance(Modes, np.ndarray) and (Modes.dtype != object) and (Modes.shape == (N_M, ) + shape): # already dense
+        return Modes, np.ones(N_M, dtype = bool)
+    for j in range(N_M):
+        if Modes[j] is not None:
+            Array[j] = Modes[j]
+            Active[j] = True
+
+    return Array, Active
+
+def Legacy(Array, Active): # legacy adapter: dense (N_M, ...) array and mask -> list with None for the inactive modes
+
+    return [Array[j] if Active[j] else None for j in range(len(Active))]
+
+class IMM_Store( ): # Dense IMM results of all cars at one step as the planner reads them: mode probabilities, predictions and variances with an active-mode mask
+    def __init__(self, Params):
+        self.N_Car = Params['N_Car']
+        self.N_M   = Params['N_M']
+        self.DSV   = Params['DSV']
+        self.N     = Params['N']
+        self.Clear( )
+
+    def Clear(self): # every car absent, every mode inactive
+        N_Car = self.N_Car
+        N_M = self.N_M
+        DSV = self.DSV
+        N = self.N
+        self.Car      = np.zeros(N_Car, dtype = bool)             # cars holding IMM results
+        self.Active   = np.zeros((N_Car, N_M), dtype = bool)      # active modes of each car
+        self.MU       = np.zeros((N_Car, N_M))                    # mode probabilities
+        self.X_Po_All = np.zeros((N_Car, N_M, DSV, N + 1))        # mode-conditioned predictions over the horizon
+        self.X_Var    = np.zeros((N_Car, N_M, N + 1))             # longitudinal prediction variances
+        self.Y_Var    = np.zeros((N_Car, N_M, N + 1))             # lateral prediction variances
+
+    def Write(self, car_index, Active, MU = None, X_Po_All = None, X_Var = None, Y_Var = None): # store the dense results of one car
+        self.Car[car_index] = True
+        self.Active[car_index] = Active
+        for Field, Value in [(self.MU, MU), (self.X_Po_All, X_Po_All), (self.X_Var, X_Var), (self.Y_Var, Y_Var)]:
+            if Value is not None:
+                Field[car_index] = Value
+                Field[car_index][~Active] = 0
+
+    def Load(self, MU_k, X_Po_All_k, X_Var_k, Y_Var_k, Car): # fill the store from the legacy per-car lists of the cars in Car; active modes are those with a nonzero probability
+        N_M = self.N_M
+        DSV = self.DSV
+        N = self.N
+        self.Clear( )
+        for i in Car:
+            Active = np.asarray(MU_k[i], dtype = float) != 0
+            X_Po_All, _ = Dense(X_Po_All_k[i], N_M, (DSV, N + 1))
+            X_Var, _ = Dense(X_Var_k[i], N_M, (N + 1, ))
+            Y_Var, _ = Dense(Y_Var_k[i], N_M, (N + 1, ))
+            self.Write(i, Active, MU_k[i], X_Po_All, X_Var, Y_Var)
@@ -0,0 +1,344 @@
+import numpy as np
+import math
+
+class GMM_Occupancy( ): # Engines for the axis-aligned occupancy of the GMM obstacle model
+    def __init__(self, Params):
+        self.w_veh      = Params['w_veh']
+        self.l_veh      = Params['l_veh']
+        self.zeta_l     = Params['zeta_l']
+        self.zeta_w     = Params['zeta_w']
+        self.N_scan     = Params.get('occ_scan', 16)   # scan points for locating the outermost level crossing, and grid points of the envelope maximization
+        self.N_shift    = Params.get('occ_shift', 4)   # fixed-point iterations for the peak of mixtures with three or more modes
+        self.N_ridge    = Params.get('occ_ridge', 32)  # points on the ridgeline searched for the peak of two-mode mixtures
+        self.N_zoom     = Params.get('occ_zoom', 2)    # finer scans of the bracket of each level crossing, each one 8 times finer
+        self.Scan       = np.linspace(0, 1, self.N_scan)
+        self.Ridge      = np.linspace(0, 1, self.N_ridge)[None, :]
+        self.Zoom       = np.linspace(0, 1, 9)
+        self.N_coarse   = Params.get('occ_coarse', 16) # max. cells per axis of the coarse pass of the adaptive grid
+        self.tol        = Params.get('occ_tol', 0.1)   # accuracy tolerance [m] of the adaptive grid boundaries
+        self.N_Cell     = 0                            # grid cells evaluated by the last adaptive call
+        self.N_Cell_Sum = 0                            # grid cells evaluated by all adaptive calls
+        self.N_Call     = 0                            # number of adaptive calls
+
+    def Grid_Density(self, x_nom_vec, y_nom_vec, x_var_vec, y_var_vec, model_pro, leng_vec): # mixture of peak-normalized modes on the occupancy grid
+        x_sig_vec = np.sqrt(x_var_vec) 
+        y_sig_vec = np.sqrt(y_var_vec) 
+        hx = 0.55 
+        hy = 0.15 
+        min_x = np.min(x_nom_vec) - 3*np.max(x_sig_vec) - hx
+        min_y = np.min(y_nom_vec) - 3*np.max(y_sig_vec) - hy
+        max_x = np.max(x_nom_vec) + 3*np.max(x_sig_vec) + hx
+        max_y = np.max(y_nom_vec) + 3*np.max(y_sig_vec) + hy
+        dx = np.arange(min_x, max_x, hx)
+        dy = np.arange(min_y, max_y, hy)
+        Pro_den = self.Kernel(dx, dy, x_nom_vec[0:leng_vec], y_nom_vec[0:leng_vec], x_var_vec[0:leng_vec], y_var_vec[0:leng_vec], model_pro[0:leng_vec], True)
+
+        return dx, dy, Pro_den
+
+    def Kernel(self, xs, ys, x_nom_vec, y_nom_vec, x_var_vec, y_var_vec, model_pro, grid_max=False): # peak-normalized mixture on the tensor grid xs x ys, the diagonal covariances make every mode separable
+        x_nom_vec = np.asarray(x_nom_vec, dtype=float)
+        y_nom_vec = np.asarray(y_nom_vec, dtype=float)
+        Gx = np.exp(-(xs[:, None] - x_nom_vec[None, :])**2/(2*np.asarray(x_var_vec, dtype=float)[None, :])) # (len(xs), modes)
+        Gy = np.exp(-(ys[:, None] - y_nom_vec[None, :])**2/(2*np.asarray(y_var_vec, dtype=float)[None, :])) # (len(ys), modes)
+        pro = np.asarray(model_pro, dtype=float)
+        if grid_max: # normalize every mode by its maximum on the grid, the product of the maxima of its 1-D factors
+            pro = pro/(np.max(Gx, axis=0)*np.max(Gy, axis=0))
+
+        return (Gx*pro[None, :])@Gy.T
+
+    def GMM_Contour(self, x_nom_vec, y_nom_vec, x_var_vec, y_var_vec, model_pro, leng_vec, epsilon): # occupancy from the contours of the gridded mixture
+        from skimage import measure # only needed by this engine, slow to import
+        w_veh = self.w_veh
+        l_veh = self.l_veh
+        zeta_w = self.zeta_w
+        zeta_l = self.zeta_l
+        dx, dy, Pro_den = self.Grid_Density(x_nom_vec, y_nom_vec, x_var_vec, y_var_vec, model_pro, leng_vec)
+        con = measure.find_contours(Pro_den, epsilon*np.max(Pro_den))
+        num_con = len(con)
+        Min_x = list( )
+        Max_x = list( )
+        Min_y = list( )
+        Max_y = list( )
+        for i in range(num_con):
+            x = con[i][:, 0]*(np.max(dx) - np.min(dx))/len(dx) + np.min(dx)
+            y = con[i][:, 1]*(np.max(dy) - np.min(dy))/len(dy) + np.min(dy)
+            Min_x.insert(i, np.min(x))
+            Max_x.insert(i, np.max(x))
+            Min_y.insert(i, np.min(y))
+            Max_y.insert(i, np.max(y))
+
+        Min_x = np.min(Min_x)
+        Max_x = np.max(Max_x)
+        Min_y = np.min(Min_y)
+        Max_y = np.max(Max_y)
+        x_bar = (Min_x + Max_x)/2
+        y_bar = (Min_y + Max_y)/2
+        Dx = (Max_x - Min_x)/2 + zeta_l*l_veh 
+        Dy = (Max_y - Min_y)/2 + zeta_w*w_veh 
+        
+        return np.array([x_bar, y_bar, Dx, Dy])
+
+    def Edge(self, profile, level, first, last): # sub-cell positions (grid index units) where a 1-D profile leaves the level at both ends
+        lo = first
+        hi = last
+        if first > 0:
+            lo = first - (profile[first] - level)/(profile[first] - profile[first - 1])
+        if last < len(profile) - 1:
+            hi = last + (profile[last] - level)/(profile[last] - profile[last + 1])
+
+        return lo, hi
+
+    def GMM_Mask(self, x_nom_vec, y_nom_vec, x_var_vec, y_var_vec, model_pro, leng_vec, epsilon): # occupancy from the thresholded gridded mixture, no contour tracing; edges within about a grid cell of the level set (x up to 0.36 m on the CASE_1 mixtures, 0.73 m on CASE_4)
+        w_veh = self.w_veh
+        l_veh = self.l_veh
+        zeta_w = self.zeta_w
+        zeta_l = self.zeta_l
+        dx, dy, Pro_den = self.Grid_Density(x_nom_vec, y_nom_vec, x_var_vec, y_var_vec, model_pro, leng_vec)
+        level = epsilon*np.max(Pro_den)
+        mask = Pro_den >= level
+        row = np.where(np.any(mask, axis=1))[0]
+        col = np.where(np.any(mask, axis=0))[0]
+        Min_i, Max_i = self.Edge(np.max(Pro_den, axis=1), level, row[0], row[-1])
+        Min_j, Max_j = self.Edge(np.max(Pro_den, axis=0), level, col[0], col[-1])
+        Min_x, Max_x = np.interp([Min_i, Max_i], np.arange(len(dx)), dx)
+        Min_y, Max_y = np.interp([Min_j, Max_j], np.arange(len(dy)), dy)
+        x_bar = (Min_x + Max_x)/2
+        y_bar = (Min_y + Max_y)/2
+        Dx = (Max_x - Min_x)/2 + zeta_l*l_veh
+        Dy = (Max_y - Min_y)/2 + zeta_w*w_veh
+
+        return np.array([x_bar, y_bar, Dx, Dy])
+
+    def Tile(self, xs, ys, x_nom_vec, y_nom_vec, x_var_vec, y_var_vec, model_pro): # peak-normalized mixture on the tensor grid xs x ys, counts the evaluated cells
+        self.N_Cell = self.N_Cell + len(xs)*len(ys)
+
+        return self.Kernel(xs, ys, x_nom_vec, y_nom_vec, x_var_vec, y_var_vec, model_pro)
+
+    def Refine(self, T_out, T_in, band_x, band_y, level, Modes): # shrink the brackets [T_out, T_in] of the four level crossings (x low, x high, y low, y high) at once, level by level; a level scans the brackets on the frontier (wider than tol) at up to 32 points, fine enough to reach tol in one level from a coarse cell
+        tol = self.tol
+        x_edge = np.array([True, True, False, False])
+        row = np.arange(4)
+        frontier = np.abs(T_in - T_out) > tol
+        while np.any(frontier):
+            N_sub = int(np.clip(np.ceil(np.max(np.abs(T_in - T_out)[frontier])/tol), 2, 32))
+            t = T_out[:, None] + (T_in - T_out)[:, None]*np.linspace(0, 1, N_sub + 1)[1:N_sub] # (4, N_sub - 1) sub-points of every bracket
+            inside = np.zeros(t.shape, dtype=bool)
+            fx = frontier & x_edge
+            fy = frontier & ~x_edge
+            if np.any(fx):
+                inside[fx] = (np.max(self.Tile(t[fx].ravel( ), band_y, *Modes), axis=1) >= level).reshape(-1, N_sub - 1)
+            if np.any(fy):
+                inside[fy] = (np.max(self.Tile(band_x, t[fy].ravel( ), *Modes), axis=0) >= level).reshape(-1, N_sub - 1)
+            first = np.argmax(inside, axis=1)
+            hit = np.any(inside, axis=1)
+            T_out = np.where(frontier & (~hit | (first > 0)), t[row, np.where(hit, np.maximum(first - 1, 0), N_sub - 2)], T_out)
+            T_in = np.where(frontier & hit, t[row, first], T_in)
+            frontier = np.abs(T_in - T_out) > tol
+
+        return (T_in + T_out)/2
+
+    def GMM_Adaptive(self, x_nom_vec, y_nom_vec, x_var_vec, y_var_vec, model_pro, leng_vec, epsilon): # occupancy from a coarse grid refined only along the level-set boundary
+        w_veh = self.w_veh
+        l_veh = self.l_veh
+        zeta_w = self.zeta_w
+        zeta_l = self.zeta_l
+        N_c = self.N_coarse
+        Modes = list(np.array([x_nom_vec[0:leng_vec], y_nom_vec[0:leng_vec], x_var_vec[0:leng_vec], y_var_vec[0:leng_vec], model_pro[0:leng_vec]], dtype=float))
+        hx = 0.55
+        hy = 0.15
+        sig = 3*np.sqrt(np.max(Modes[2:4], axis=1))
+        min_x, min_y = (np.min(Modes[0:2], axis=1) - sig - [hx, hy]).tolist( )
+        max_x, max_y = (np.max(Modes[0:2], axis=1) + sig + [hx, hy]).tolist( )
+        self.N_Cell = 0
+        # coarse pass, never finer than the fixed grid, with grid lines through the mode means so narrow modes are not missed
+        dx = np.unique(np.hstack((np.linspace(min_x, max_x, min(max(math.ceil((max_x - min_x)/hx), 3), N_c)), Modes[0])))
+        dy = np.unique(np.hstack((np.linspace(min_y, max_y, min(max(math.ceil((max_y - min_y)/hy), 3), N_c)), Modes[1])))
+        Pro_den = self.Tile(dx, dy, *Modes)
+        i, j = np.unravel_index(np.argmax(Pro_den), Pro_den.shape)
+        # refine the peak on the cells around the coarse maximum
+        dx_pk = np.linspace(dx[max(i - 1, 0)], dx[min(i + 1, len(dx) - 1)], 5)
+        dy_pk = np.linspace(dy[max(j - 1, 0)], dy[min(j + 1, len(dy) - 1)], 5)
+        level = epsilon*max(np.max(Pro_den), np.max(self.Tile(dx_pk, dy_pk, *Modes)))
+        mask = Pro_den >= level
+        mask[i, j] = True
+        row = np.where(np.any(mask, axis=1))[0]
+        col = np.where(np.any(mask, axis=0))[0]
+        # boundary bands: the inside span of the other axis plus one coarse cell, at a quarter of the coarse spacing
+        band_x = np.linspace(dx[max(row[0] - 1, 0)], dx[min(row[-1] + 1, len(dx) - 1)], 4*(row[-1] - row[0] + 2) + 1)
+        band_y = np.linspace(dy[max(col[0] - 1, 0)], dy[min(col[-1] + 1, len(dy) - 1)], 4*(col[-1] - col[0] + 2) + 1)
+        band_x = np.hstack((band_x, Modes[0][(band_x[0] < Modes[0]) & (Modes[0] < band_x[-1])])) # evaluation points only, order and repeats do not matter
+        band_y = np.hstack((band_y, Modes[1][(band_y[0] < Modes[1]) & (Modes[1] < band_y[-1])]))
+        T_out = np.array([dx[max(row[0] - 1, 0)], dx[min(row[-1] + 1, len(dx) - 1)], dy[max(col[0] - 1, 0)], dy[min(col[-1] + 1, len(dy) - 1)]])
+        T_in = np.array([dx[row[0]], dx[row[-1]], dy[col[0]], dy[col[-1]]])
+        Min_x, Max_x, Min_y, Max_y = self.Refine(T_out, T_in, band_x, band_y, level, Modes)
+        self.N_Cell_Sum = self.N_Cell_Sum + self.N_Cell
+        self.N_Call = self.N_Call + 1
+        x_bar = (Min_x + Max_x)/2
+        y_bar = (Min_y + Max_y)/2
+        Dx = (Max_x - Min_x)/2 + zeta_l*l_veh
+        Dy = (Max_y - Min_y)/2 + zeta_w*w_veh
+
+        return np.array([x_bar, y_bar, Dx, Dy])
+
+    def Mixture(self, x, y, x_nom, y_nom, x_var, y_var, model_pro): # mixture density, points (B, K), modes (B, M)
+        q = (x[:, :, None] - x_nom[:, None, :])**2/x_var[:, None, :] + (y[:, :, None] - y_nom[:, None, :])**2/y_var[:, None, :]
+
+        return np.sum(model_pro[:, None, :]*np.exp(-q/2), axis=-1)
+
+    def Ascend(self, x, y, x_nom, y_nom, x_var, y_var, model_pro): # one fixed-point step of the points (B, K) towards a local maximum of the mixture, the density never decreases
+        q = (x[:, :, None] - x_nom[:, None, :])**2/x_var[:, None, :] + (y[:, :, None] - y_nom[:, None, :])**2/y_var[:, None, :]
+        r = model_pro[:, None, :]*np.exp(-q/2)
+        den_x = np.sum(r/x_var[:, None, :], axis=-1)
+        den_y = np.sum(r/y_var[:, None, :], axis=-1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            x = np.where(den_x > 0, np.sum(r*(x_nom/x_var)[:, None, :], axis=-1)/den_x, x)
+            y = np.where(den_y > 0, np.sum(r*(y_nom/y_var)[:, None, :], axis=-1)/den_y, y)
+
+        return x, y
+
+    def Peak(self, x_nom, y_nom, x_var, y_var, model_pro): # global maximum of the mixture: for two modes on the ridgeline between the means, which holds every critical point, else by fixed-point iterations from every mode mean
+        if x_nom.shape[1] == 2:
+            a = self.Ridge
+            x = ((1 - a)*(x_nom[:, 0]/x_var[:, 0])[:, None] + a*(x_nom[:, 1]/x_var[:, 1])[:, None])/((1 - a)/x_var[:, 0:1] + a/x_var[:, 1:2])
+            y = ((1 - a)*(y_nom[:, 0]/y_var[:, 0])[:, None] + a*(y_nom[:, 1]/y_var[:, 1])[:, None])/((1 - a)/y_var[:, 0:1] + a/y_var[:, 1:2])
+            n_iter = 1 # polish the best ridgeline points
+        else:
+            x = x_nom.copy( )
+            y = y_nom.copy( )
+            n_iter = self.N_shift
+        for i in range(n_iter):
+            x, y = self.Ascend(x, y, x_nom, y_nom, x_var, y_var, model_pro)
+        dens = self.Mixture(x, y, x_nom, y_nom, x_var, y_var, model_pro)
+        index = np.argmax(dens, axis=1)
+        row = np.arange(len(index))
+
+        return dens[row, index], x[row, index], y[row, index]
+
+    def Envelope(self, t, t_nom, t_var, s, s_nom, s_var, model_pro): # max over s of the mixture along lines of fixed t, t: (B, K); the maximum lies between the outermost s_nom, taken on the grid s (B, S) and polished by one fixed-point step
+        a = model_pro[:, None, :]*np.exp(-(t[:, :, None] - t_nom[:, None, :])**2/(2*t_var[:, None, :])) # (B, K, M)
+        g = np.exp(-(s[:, :, None] - s_nom[:, None, :])**2/(2*s_var[:, None, :]))                        # (B, S, M)
+        dens = a@np.swapaxes(g, 1, 2)                                                                     # (B, K, S)
+        s_pk = s[np.arange(len(s))[:, None], np.argmax(dens, axis=2)]
+        r = a*np.exp(-(s_pk[:, :, None] - s_nom[:, None, :])**2/(2*s_var[:, None, :]))
+        s_pk = np.sum(r*(s_nom/s_var)[:, None, :], axis=-1)/np.maximum(np.sum(r/s_var[:, None, :], axis=-1), 1e-300)
+        E = np.sum(a*np.exp(-(s_pk[:, :, None] - s_nom[:, None, :])**2/(2*s_var[:, None, :])), axis=-1)
+
+        return np.maximum(np.max(dens, axis=2), E)
+
+    def Extent(self, t_nom, t_var, s_nom, s_var, model_pro, level, t_peak): # outermost crossings of the envelope with the level along t: a scan, N_zoom finer scans of both brackets, then linear interpolation
+        B, M = t_nom.shape
+        active = model_pro > 0
+        total = np.sum(model_pro, axis=1)
+        reach = np.sqrt(2*t_var*np.log(np.maximum(total/level, 1))[:, None]) # beyond this every mode is below level/total of its weight
+        t_lo = np.min(np.where(active, t_nom - reach, np.inf), axis=1)
+        t_hi = np.max(np.where(active, t_nom + reach, -np.inf), axis=1)
+        s_lo = np.min(np.where(active, s_nom, np.inf), axis=1)
+        s_hi = np.max(np.where(active, s_nom, -np.inf), axis=1)
+        s = np.hstack((s_lo[:, None] + (s_hi - s_lo)[:, None]*self.Scan, s_nom))
+        scan = t_lo[:, None] + (t_hi - t_lo)[:, None]*self.Scan
+        t = np.sort(np.hstack((scan, t_nom, t_peak[:, None])), axis=1)
+        E = self.Envelope(t, t_nom, t_var, s, s_nom, s_var, model_pro)
+        inside = (E >= level[:, None]) | (t == t_peak[:, None])
+        K = t.shape[1]
+        first = np.argmax(inside, axis=1)
+        last = K - 1 - np.argmax(inside[:, ::-1], axis=1)
+        row = np.arange(B)
+        t_in = np.stack((t[row, first], t[row, last]), axis=1)
+        t_out = np.stack((np.where(first > 0, t[row, np.maximum(first - 1, 0)], t_lo), np.where(last < K - 1, t[row, np.minimum(last + 1, K - 1)], t_hi)), axis=1)
+        E_in = np.stack((E[row, first], E[row, last]), axis=1)
+        E_out = np.zeros((B, 2))
+        row = row[:, None]
+        side = np.arange(2)[None, :]
+        for i in range(self.N_zoom): # each scan runs from the outside point to the inside point of the bracket and keeps the first pair that straddles the level
+            t = t_out[:, :, None] + (t_in - t_out)[:, :, None]*self.Zoom
+            E = self.Envelope(t.reshape(B, -1), t_nom, t_var, s, s_nom, s_var, model_pro).reshape(B, 2, -1)
+            E[:, :, -1] = np.maximum(E[:, :, -1], level[:, None])
+            j = np.maximum(np.argmax(E >= level[:, None, None], axis=2), 1)
+            t_in, E_in = t[row, side, j], E[row, side, j]
+            t_out, E_out = t[row, side, j - 1], E[row, side, j - 1]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            w = np.where(E_in > E_out, (level[:, None] - E_out)/(E_in - E_out), 0.5)
+        bound = t_out + (t_in - t_out)*np.clip(w, 0, 1)
+
+        return bound[:, 0], bound[:, 1]
+
+    def Analytic_Bound(self, x_nom, y_nom, x_var, y_var, model_pro, epsilon): # grid-free occupancy of a batch of mixtures, inputs (B, M), returns (B, 4)
+        zeta_l = self.zeta_l
+        zeta_w = self.zeta_w
+        l_veh = self.l_veh
+        w_veh = self.w_veh
+        active = model_pro > 0
+        n_act = np.sum(active, axis=1)
+        if not np.all(active):
+            order = np.argsort(~active, axis=1, kind='stable')[:, 0:np.max(n_act)] # active modes first, drop columns inactive in every row
+            x_nom = np.take_along_axis(x_nom, order, axis=1)
+            y_nom = np.take_along_axis(y_nom, order, axis=1)
+            x_var = np.take_along_axis(x_var, order, axis=1)
+            y_var = np.take_along_axis(y_var, order, axis=1)
+            model_pro = np.take_along_axis(model_pro, order, axis=1)
+        Bound = np.zeros((len(n_act), 4)) # Min_x, Max_x, Min_y, Max_y
+        one = n_act == 1
+        if np.any(one): # closed form: the level set of a single mode is the ellipse q <= -2*ln(epsilon)
+            r = np.sqrt(max(-2*np.log(epsilon), 0))
+            Dx = r*np.sqrt(x_var[one, 0])
+            Dy = r*np.sqrt(y_var[one, 0])
+            Bound[one] = np.stack((x_nom[one, 0] - Dx, x_nom[one, 0] + Dx, y_nom[one, 0] - Dy, y_nom[one, 0] + Dy), axis=1)
+        many = ~one
+        if np.any(many):
+            M = np.max(n_act[many])
+            if not np.all(many):
+                x_nom, y_nom, x_var, y_var, model_pro = [Z[many, 0:M] for Z in [x_nom, y_nom, x_var, y_var, model_pro]]
+            active = model_pro > 0
+            if not np.all(active): # inactive columns of a row copy its first mode at zero weight
+                x_nom = np.where(active, x_nom, x_nom[:, 0:1])
+                y_nom = np.where(active, y_nom, y_nom[:, 0:1])
+                x_var = np.where(active, x_var, 1)
+                y_var = np.where(active, y_var, 1)
+            P_max, x_pk, y_pk = self.Peak(x_nom, y_nom, x_var, y_var, model_pro)
+            level = epsilon*P_max
+            B = len(level)
+            Min, Max = self.Extent(np.vstack((x_nom, y_nom)), np.vstack((x_var, y_var)), np.vstack((y_nom, x_nom)), np.vstack((y_var, x_var)),
+                                   np.vstack((model_pro, model_pro)), np.hstack((level, level)), np.hstack((x_pk, y_pk))) # x and y extents in one batch
+            Bound[many] = np.stack((Min[:B], Max[:B], Min[B:], Max[B:]), axis=1)
+        x_bar = (Bound[:, 0] + Bound[:, 1])/2
+        y_bar = (Bound[:, 2] + Bound[:, 3])/2
+        Dx = (Bound[:, 1] - Bound[:, 0])/2 + zeta_l*l_veh
+        Dy = (Bound[:, 3] - Bound[:, 2])/2 + zeta_w*w_veh
+
+        return np.stack((x_bar, y_bar, Dx, Dy), axis=1)
+
+    def GMM_Analytic(self, x_nom_vec, y_nom_vec, x_var_vec, y_var_vec, model_pro, epsilon): # grid-free occupancy of one mixture, same output as ISA_MPC.GMM_Model; a batch of one, several times slower per mixture than Analytic_Bound on a horizon, which the planners call
+        x_nom = np.array(x_nom_vec, dtype=float)[None, :]
+        y_nom = np.array(y_nom_vec, dtype=float)[None, :]
+        x_var = np.array(x_var_vec, dtype=float)[None, :]
+        y_var = np.array(y_var_vec, dtype=float)[None, :]
+        model_pro = np.array(model_pro, dtype=float)[None, :]
+
+        return self.Analytic_Bound(x_nom, y_nom, x_var, y_var, model_pro, epsilon)[0]
+
+    def Pair_Bound(self, X_Nom, Y_Nom, X_Var, Y_Var, Pro, Row, Step, epsilon, method): # occupancy of the (SV, step) pairs (Row, Step) of a (C, M, N+1) block by the engine of method, returns (len(Row), 4)
+        if method == 'analytic':
+            return self.Analytic_Bound(X_Nom[Row, :, Step], Y_Nom[Row, :, Step], X_Var[Row, :, Step], Y_Var[Row, :, Step], Pro[Row, :], epsilon)
+        OCC = np.zeros((len(Row), 4))
+        for n, (c, h) in enumerate(zip(Row, Step)):
+            active = Pro[c, :] > 0
+            Modes = [X_Nom[c, active, h], Y_Nom[c, active, h], X_Var[c, active, h], Y_Var[c, active, h], Pro[c, active], np.sum(active), epsilon]
+            if method == 'contour':
+                OCC[n] = self.GMM_Contour(*Modes)
+            elif method == 'adaptive':
+                OCC[n] = self.GMM_Adaptive(*Modes)
+            else:
+                OCC[n] = self.GMM_Mask(*Modes)
+
+        return OCC
+
+    def Horizon_Bound(self, X_Nom, Y_Nom, X_Var, Y_Var, Pro, epsilon, method, Need=None): # occupancy of every SV over the horizon, modes (C, M, N+1), Pro (C, M), only the pairs of Need (C, N+1) if given, returns (C, 4, N+1)
+        C, M, N_1 = X_Nom.shape
+        OCC = np.ones((C, 4, N_1))
+        if Need is None:
+            Need = np.ones((C, N_1), dtype=bool)
+        Row, Step = np.nonzero(Need)
+        if len(Row) > 0:
+            OCC[Row, :, Step] = self.Pair_Bound(X_Nom, Y_Nom, X_Var, Y_Var, Pro, Row, Step, epsilon, method)
+
+        return OCC
@@ -1,5 +1,6 @@
 import numpy as np
 from numpy.linalg import matrix_power
+from IMM_Store import Dense, Legacy
 
 class Initialization_SV( ): # Initialize SV
     def __init__(self, Params):
@@ -20,6 +21,7 @@ class Initialization_SV( ): # Initialize SV
         N = self.N
         N_Car = self.N_Car
         H = self.H
+        DSV = self.DSV
         Models = self.Models
         L_Center = self.L_Center
         
@@ -46,11 +48,11 @@ class Initialization_SV( ): # Initialize SV
                 MU_0.append(mu_0)
                 M_0.append(m_0)
                 x_hat_m = X_State_0[i] 
-                x_hat_0 = [x_hat_m, x_hat_m, None, None, None, None, None] 
-                p_0 = [p_m, p_m, None, None, None, None, None] 
+                x_hat_0 = Legacy(np.tile(x_hat_m, (N_M, 1)), mu_0 != 0) 
+                p_0 = Legacy(np.tile(p_m, (N_M, 1, 1)), mu_0 != 0) 
                 X_Hat_0.append(x_hat_0) 
                 P_0.append(p_0) 
-                ref_all_0 = [x_hat_m[1], x_hat_m[1], None, None, None, None, None]
+                ref_all_0 = Legacy(np.full(N_M, x_hat_m[1]), mu_0 != 0)
                 REF_Speed_0.append(ref_all_0[m_0])
                 REF_Lane_0.append(L_Center[0])
                 REF_Speed_All_0.append(ref_all_0)
@@ -60,11 +62,11 @@ class Initialization_SV( ): # Initialize SV
                 MU_0.append(mu_0)
                 M_0.append(m_0)
                 x_hat_m = X_State_0[i] 
-                x_hat_0 = [ None, None, x_hat_m, x_hat_m, x_hat_m, None, None] 
-                p_0 = [None, None, p_m, p_m, p_m, None, None]
+                x_hat_0 = Legacy(np.tile(x_hat_m, (N_M, 1)), mu_0 != 0) 
+                p_0 = Legacy(np.tile(p_m, (N_M, 1, 1)), mu_0 != 0)
                 X_Hat_0.append(x_hat_0) 
                 P_0.append(p_0) 
-                ref_all_0 = [None, None, x_hat_m[1], x_hat_m[1], x_hat_m[1], None, None] 
+                ref_all_0 = Legacy(np.full(N_M, x_hat_m[1]), mu_0 != 0) 
                 REF_Speed_0.append(ref_all_0[m_0])
                 REF_Lane_0.append(L_Center[1])
                 REF_Speed_All_0.append(ref_all_0)
@@ -74,11 +76,11 @@ class Initialization_SV( ): # Initialize SV
                 MU_0.append(mu_0)
                 M_0.append(m_0)
                 x_hat_m = X_State_0[i] 
-                x_hat_0 = [None, None, None, None, None, x_hat_m, x_hat_m] 
-                p_0 = [None, None, None, None, None, p_m, p_m]
+                x_hat_0 = Legacy(np.tile(x_hat_m, (N_M, 1)), mu_0 != 0) 
+                p_0 = Legacy(np.tile(p_m, (N_M, 1, 1)), mu_0 != 0)
                 X_Hat_0.append(x_hat_0) 
                 P_0.append(p_0) 
-                ref_all_0 = [None, None, None, None, None, x_hat_m[1], x_hat_m[1]] 
+                ref_all_0 = Legacy(np.full(N_M, x_hat_m[1]), mu_0 != 0) 
                 REF_Speed_0.append(ref_all_0[m_0])
                 REF_Lane_0.append(L_Center[2])
                 REF_Speed_All_0.append(ref_all_0)
@@ -92,23 +94,18 @@ class Initialization_SV( ): # Initialize SV
             X_Pre_0.append(x_pre_0)  
         
         for i in range(N_Car):
-            temp_tra = list( )
-            temp_x_var = list( )
-            temp_y_var = list( )
-            for j in range(N_M):
-                if np.sum(X_Hat_0[i][j]) == None:
-                    temp_tra.append(None)
-                    temp_x_var.append(None)
-                    temp_y_var.append(None)
-                else:
-                    K_Lon = Models[j][0]
-                    K_Lat = Models[j][1]
-                    temp_tra.append(self.VelocityTracking(X_Hat_0[i][j], X_Hat_0[i][j][1], j, N, K_Lon, K_Lat))
-                    temp_x_var.append(np.array([0]*(N + 1)))
-                    temp_y_var.append(np.array([0]*(N + 1)))
-            X_Po_All_0.append(temp_tra)
-            X_Var_0.append(temp_x_var)
-            Y_Var_0.append(temp_y_var)
+            active = MU_0[i] != 0
+            x_hat_0, _ = Dense(X_Hat_0[i], N_M, (DSV, ))
+            x_po_all_0 = np.zeros((N_M, DSV, N + 1))
+            x_var_0 = np.zeros((N_M, N + 1))
+            y_var_0 = np.zeros((N_M, N + 1))
+            for j in np.flatnonzero(active):
+                K_Lon = Models[j][0]
+                K_Lat = Models[j][1]
+                x_po_all_0[j] = self.VelocityTracking(x_hat_0[j], x_hat_0[j][1], j, N, K_Lon, K_Lat)
+            X_Po_All_0.append(Legacy(x_po_all_0, active))
+            X_Var_0.append(Legacy(x_var_0, active))
+            Y_Var_0.append(Legacy(y_var_0, active))
         
         return MU_0, M_0, Y_0, X_Hat_0, P_0, X_Pre_0, X_Po_All_0, X_Var_0, Y_Var_0, REF_Speed_0, REF_Lane_0, REF_Speed_All_0
             
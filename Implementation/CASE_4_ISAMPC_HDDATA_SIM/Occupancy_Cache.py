@@ -0,0 +1,45 @@
+import numpy as np
+from collections import OrderedDict
+
+class Occupancy_Cache( ): # LRU memo of GMM occupancies keyed on the quantized, translation-invariant mixture
+    def __init__(self, Params):
+        self.enable  = Params.get('occ_cache', False)           # on/off switch
+        self.size    = Params.get('occ_cache_size', 4096)       # max. number of stored occupancies
+        self.tol     = Params.get('occ_cache_tol', 0.01)        # quantization [m] of the mode offsets and standard deviations
+        self.tol_pro = Params.get('occ_cache_tol_pro', 0.001)   # quantization of the mode probabilities
+        self.Table   = OrderedDict( )
+        self.N_Hit   = 0
+        self.N_Miss  = 0
+
+    def Key(self, x_nom_vec, y_nom_vec, x_var_vec, y_var_vec, model_pro, epsilon): # key of the mixture relative to its first mode, and that mode as the origin
+        tol = self.tol
+        tol_pro = self.tol_pro
+        x_nom_vec = np.asarray(x_nom_vec, dtype=float)
+        y_nom_vec = np.asarray(y_nom_vec, dtype=float)
+        origin = np.array([x_nom_vec[0], y_nom_vec[0], 0, 0])
+        Geo = np.hstack((x_nom_vec - origin[0], y_nom_vec - origin[1], np.sqrt(np.asarray(x_var_vec, dtype=float)), np.sqrt(np.asarray(y_var_vec, dtype=float))))
+        Pro = np.asarray(model_pro, dtype=float)
+        key = (len(x_nom_vec), float(epsilon)) + tuple(np.round(Geo/tol).astype(np.int64)) + tuple(np.round(Pro/tol_pro).astype(np.int64))
+
+        return key, origin
+
+    def Lookup(self, key, origin): # stored occupancy shifted to the current origin, None on a miss
+        occ = self.Table.get(key)
+        if occ is None:
+            self.N_Miss = self.N_Miss + 1
+            return None
+        self.Table.move_to_end(key)
+        self.N_Hit = self.N_Hit + 1
+
+        return occ + origin
+
+    def Store(self, key, origin, occ): # store the occupancy relative to the origin, evict the least recently used entry
+        self.Table[key] = np.asarray(occ, dtype=float) - origin
+        self.Table.move_to_end(key)
+        if len(self.Table) > self.size:
+            self.Table.popitem(last=False)
+
+    def Clear(self): # drop all entries and reset the counters
+        self.Table.clear( )
+        self.N_Hit = 0
+        self.N_Miss = 0
@@ -0,0 +1,54 @@
+import os
+import sys
+import importlib
+import numpy as np
+import casadi
+import pytest
+from scipy.io import loadmat
+
+Root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+def Load(case, name): # module name of the CASE directory case, imported with the sibling modules of that directory and not those already loaded from another case
+    Dir = os.path.join(Root, case)
+    Names = [f[:-3] for f in os.listdir(Dir) if f.endswith('.py')]
+    Saved = {key: sys.modules.pop(key) for key in Names if key in sys.modules}
+    sys.path.insert(0, Dir)
+    try:
+        Module = importlib.import_module(name)
+    finally:
+        sys.path.remove(Dir)
+        for key in Names:
+            sys.modules.pop(key, None)
+        sys.modules.update(Saved)
+
+    return Module
+
+def Without_HSL(opts): # IPOPT options with the HSL linear solver dropped, IPOPT falls back to its default one
+    return {key: value for key, value in opts.items( ) if key != 'ipopt.linear_solver'}
+
+@pytest.fixture
+def no_hsl(monkeypatch): # the solvers of the cases ask for ma57, which the IPOPT build here does not have
+    Solver = casadi.Opti.solver
+    nlpsol = casadi.nlpsol
+    monkeypatch.setattr(casadi.Opti, 'solver', lambda self, name, opts = dict( ), *args: Solver(self, name, Without_HSL(opts), *args))
+    monkeypatch.setattr(casadi, 'nlpsol', lambda name, plugin, NLP, opts = dict( ): nlpsol(name, plugin, NLP, Without_HSL(opts)))
+
+@pytest.fixture(scope = 'session')
+def load( ): # Load, for the tests of the per-case copies
+    return Load
+
+@pytest.fixture(scope = 'session')
+def sv_params( ): # opts_SV of the CASE_1 notebook, sub-models and gain sets from its Model_Parameters.mat
+    Model_Parameters = loadmat(os.path.join(Root, 'CASE_1_ISAMPC_SIM', 'Model_Parameters.mat'))['Model_Parameters'][0, 0]
+    Models = list( )
+    std_parameters = list( )
+    for m in range(7):
+        Model = Model_Parameters['m%d' % m]
+        Models.append([Model['Lon'][0][0][0], Model['Lat'][0][0][0]])
+        std_parameters.append([Model['K_set_lon'][0][0][0], Model['std_y' if m in [0, 3, 6] else 'K_set_lat'][0][0][0]])
+
+    return {'Ts': 0.32, 'N': 25, 'N_Lane': 3, 'N_M': 7, 'N_Car': 6, 'L_Width': [3.75, 3.75, 3.75], 'w_veh': 1.8, 'l_veh': 4.3,
+            'L_Bound': [0, 3.75, 3.75*2, 3.75*3], 'L_Center': [3.75/2, 3.75 + 3.75/2, 3.75*2 + 3.75/2], 'DSV': 6, 'infinity': 100000,
+            'SpeedLim': np.array([65/3.6, 90/3.6, 90/3.6]), 'Q': np.diag([1, 0.5, 0.25, 0.1, 0.1, 0]), 'R': np.diag([1, 1, 1])*1e-5,
+            'Weight': np.array([0.1, 0.3, 0.1, 0.5]), 'H': np.array([[1, 0, 0, 0, 0, 0], [0, 1, 0, 0, 0, 0], [0, 0, 0, 1, 0, 0]]),
+            'Models': Models, 'std_parameters': std_parameters, 'K_sampling': 30}
@@ -0,0 +1,55 @@
+import os
+import sys
+import json
+import pickle
+import subprocess
+import numpy as np
+import pytest
+
+Root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+Script = r'''
+import json, re, sys, pickle
+import numpy as np
+import matplotlib
+import casadi
+matplotlib.use('Agg')
+if not hasattr(np, 'trapz'): # removed in NumPy 2.4, the cases were written against NumPy 1.x
+    np.trapz = np.trapezoid
+def Without_HSL(opts): # the IPOPT build here has no ma57
+    return {key: value for key, value in opts.items( ) if key != 'ipopt.linear_solver'}
+Solver = casadi.Opti.solver
+nlpsol = casadi.nlpsol
+casadi.Opti.solver = lambda self, name, opts = dict( ), *args: Solver(self, name, Without_HSL(opts), *args)
+casadi.nlpsol = lambda name, plugin, NLP, opts = dict( ): nlpsol(name, plugin, NLP, Without_HSL(opts))
+K_N, Options, Out = int(sys.argv[1]), json.loads(sys.argv[2]), sys.argv[3]
+Source = list( )
+for Cell in json.load(open('main.ipynb'))['cells']:
+    Code = ''.join(Cell['source'])
+    if Cell['cell_type'] != 'code':
+        continue
+    if Code.startswith('t = '): # the plots and the saved results follow the simulation
+        break
+    Code = re.sub(r'K_N = \d+', 'K_N = %d' % K_N, '\n'.join(Line for Line in Code.split('\n') if not Line.startswith('%')))
+    for Name in ['opts_SV = { # parameters of SV', 'opts_EV = { # parameters of EV']:
+        Code = Code.replace(Name, Name + ''.join('\n    %r: %r,' % Item for Item in Options.items( )))
+    Source.append(Code)
+np.random.seed(0)
+Scope = {'__name__': '__main__'}
+exec(compile('\n'.join(Source), 'main.ipynb', 'exec'), Scope)
+pickle.dump({key: Scope.get(key) for key in ['X_State', 'MU', 'OCC_SV']}, open(Out, 'wb'))
+'''
+
+def Run(case, K_N, Options, Out): # the simulation cells of the notebook of case for K_N steps in a fresh interpreter, with Options added to opts_SV and opts_EV
+    Done = subprocess.run([sys.executable, '-c', Script, str(K_N), json.dumps(Options), str(Out)],
+                          cwd = os.path.join(Root, case), capture_output = True, text = True)
+    assert Done.returncode == 0, Done.stderr[-2000:]
+
+    return pickle.load(open(Out, 'rb'))
+
+@pytest.mark.parametrize('case', ['CASE_1_ISAMPC_SIM', 'CASE_2_SCMPC_SIM', 'CASE_3_ISAMPC_SIM', 'CASE_4_ISAMPC_HDDATA_SIM'])
+def test_case_runs_and_the_batched_imm_step_changes_nothing(case, tmp_path):
+    Result = [Run(case, 4, {'var_seed': 0, 'imm_batch': imm_batch}, tmp_path/('%s.pkl' % imm_batch)) for imm_batch in [False, True]]
+    X_State = [np.array([np.concatenate([np.ravel(x) for x in Step]) for Step in R['X_State'][0:4]], dtype = float) for R in Result]
+    assert X_State[0].shape[0] == 4 and np.all(np.isfinite(X_State[0]))
+    assert np.allclose(X_State[1], X_State[0], rtol = 1e-12, atol = 1e-12)
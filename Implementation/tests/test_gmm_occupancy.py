@@ -0,0 +1,170 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CASE_1_ISAMPC_SIM'))
+from GMM_Occupancy import GMM_Occupancy
+from Occupancy_Pool import Occupancy_Pool
+from Occupancy_Reuse import Occupancy_Reuse
+
+Params = {'w_veh': 2.0, 'l_veh': 5.0, 'zeta_l': 0.0, 'zeta_w': 0.0}
+
+def Reference(x_nom, y_nom, x_var, y_var, model_pro, epsilon): # level-set box on a fine grid
+    Occupancy = GMM_Occupancy(Params)
+    xs = np.linspace(np.min(x_nom) - 6*np.sqrt(np.max(x_var)), np.max(x_nom) + 6*np.sqrt(np.max(x_var)), 6001)
+    ys = np.linspace(np.min(y_nom) - 6*np.sqrt(np.max(y_var)), np.max(y_nom) + 6*np.sqrt(np.max(y_var)), 3001)
+    Pro_den = Occupancy.Kernel(xs, ys, x_nom, y_nom, x_var, y_var, model_pro)
+    mask = Pro_den >= epsilon*np.max(Pro_den)
+    row = np.where(np.any(mask, axis=1))[0]
+    col = np.where(np.any(mask, axis=0))[0]
+
+    return np.array([xs[row[0]], xs[row[-1]], ys[col[0]], ys[col[-1]]]), xs[1] - xs[0], ys[1] - ys[0]
+
+def Edges(occ):
+    return np.array([occ[0] - occ[2], occ[0] + occ[2], occ[1] - occ[3], occ[1] + occ[3]])
+
+def test_single_mode_is_the_exact_ellipse_box():
+    Occupancy = GMM_Occupancy(Params)
+    occ = Occupancy.GMM_Analytic([10.0], [2.0], [4.0], [0.25], [1.0], 0.1)
+    r = np.sqrt(-2*np.log(0.1))
+    assert np.allclose(occ, [10.0, 2.0, 2*r, 0.5*r], atol = 1e-12)
+
+@pytest.mark.parametrize('seed', range(6))
+@pytest.mark.parametrize('n_mode', [2, 3])
+def test_matches_a_fine_grid(seed, n_mode):
+    Generator = np.random.default_rng(seed)
+    x_nom = Generator.uniform(0, 8, n_mode)
+    y_nom = Generator.choice([1.875, 5.625, 9.375], n_mode) + Generator.normal(0, 0.3, n_mode)
+    x_var = Generator.uniform(0.5, 6, n_mode)
+    y_var = Generator.uniform(0.02, 0.3, n_mode)
+    model_pro = Generator.dirichlet(np.ones(n_mode))
+    Ref, hx, hy = Reference(x_nom, y_nom, x_var, y_var, model_pro, 0.1)
+    occ = GMM_Occupancy(Params).GMM_Analytic(x_nom, y_nom, x_var, y_var, model_pro, 0.1)
+    err = np.abs(Edges(occ) - Ref)
+    assert np.all(err[0:2] <= hx + 1e-2)
+    assert np.all(err[2:4] <= hy + 1e-2)
+
+@pytest.mark.parametrize('n_mode', [1, 3])
+def test_separable_grid_density_matches_the_bivariate_pdf(n_mode):
+    from scipy.stats import multivariate_normal
+    Generator = np.random.default_rng(n_mode)
+    x_nom = Generator.uniform(0, 30, n_mode)
+    y_nom = Generator.uniform(0, 11, n_mode)
+    x_var = Generator.uniform(0.5, 6, n_mode)
+    y_var = Generator.uniform(0.02, 0.3, n_mode)
+    model_pro = Generator.dirichlet(np.ones(n_mode))
+    dx, dy, Pro_den = GMM_Occupancy(Params).Grid_Density(x_nom, y_nom, x_var, y_var, model_pro, n_mode)
+    XY = np.vstack((np.tile(dx, len(dy)), dy.repeat(len(dx)))) # the dense evaluation of the mixture on the grid the engine replaced
+    Ref = np.zeros((len(dx), len(dy)))
+    for h in range(n_mode):
+        Pd = multivariate_normal.pdf(XY.T, [x_nom[h], y_nom[h]], np.diag([x_var[h], y_var[h]])).reshape(len(dy), len(dx)).T
+        Ref = Ref + model_pro[h]*Pd/np.max(Pd)
+    assert np.allclose(Pro_den, Ref, rtol = 1e-10, atol = 1e-14)
+
+def test_horizon_batch_matches_single_calls():
+    Generator = np.random.default_rng(0)
+    C, M, N_1 = 3, 7, 5
+    Pro = np.zeros((C, M))
+    Pro[0, 0] = 1
+    Pro[1, [2, 3]] = [0.3, 0.7]
+    Pro[2, [2, 3, 4]] = [0.2, 0.5, 0.3]
+    X_Nom = Generator.uniform(0, 30, (C, M, N_1))
+    Y_Nom = Generator.uniform(0, 11, (C, M, N_1))
+    X_Var = Generator.uniform(0.5, 6, (C, M, N_1))
+    Y_Var = Generator.uniform(0.02, 0.3, (C, M, N_1))
+    Occupancy = GMM_Occupancy(Params)
+    OCC = Occupancy.Horizon_Bound(X_Nom, Y_Nom, X_Var, Y_Var, Pro, 0.1, 'analytic')
+    for c in range(C):
+        active = Pro[c] > 0
+        for h in range(N_1):
+            occ = Occupancy.GMM_Analytic(X_Nom[c, active, h], Y_Nom[c, active, h], X_Var[c, active, h], Y_Var[c, active, h], Pro[c, active], 0.1)
+            assert np.allclose(OCC[c, :, h], occ, atol = 1e-6)
+
+@pytest.mark.parametrize('method', ['mask', 'contour', 'adaptive', 'analytic'])
+def test_horizon_batch_uses_the_engine_of_method(method):
+    Generator = np.random.default_rng(1)
+    C, M, N_1 = 2, 7, 4
+    Pro = np.zeros((C, M))
+    Pro[0, [2, 3]] = [0.4, 0.6]
+    Pro[1, [1, 2, 3]] = [0.2, 0.5, 0.3]
+    X_Nom = Generator.uniform(0, 30, (C, M, N_1))
+    Y_Nom = Generator.uniform(0, 11, (C, M, N_1))
+    X_Var = Generator.uniform(0.5, 6, (C, M, N_1))
+    Y_Var = Generator.uniform(0.02, 0.3, (C, M, N_1))
+    Need = Generator.uniform(size = (C, N_1)) < 0.6
+    Occupancy = GMM_Occupancy(Params)
+    Engine = {'mask': Occupancy.GMM_Mask, 'contour': Occupancy.GMM_Contour, 'adaptive': Occupancy.GMM_Adaptive}
+    OCC = Occupancy.Horizon_Bound(X_Nom, Y_Nom, X_Var, Y_Var, Pro, 0.1, method, Need)
+    for c in range(C):
+        active = Pro[c] > 0
+        for h in range(N_1):
+            Modes = [X_Nom[c, active, h], Y_Nom[c, active, h], X_Var[c, active, h], Y_Var[c, active, h], Pro[c, active]]
+            if not Need[c, h]:
+                assert np.all(OCC[c, :, h] == 1)
+            elif method == 'analytic':
+                assert np.allclose(OCC[c, :, h], Occupancy.GMM_Analytic(*Modes, 0.1), atol = 1e-6)
+            else:
+                assert np.array_equal(OCC[c, :, h], Engine[method](*Modes, np.sum(active), 0.1))
+
+def test_pool_is_shared_and_matches_the_engine():
+    Generator = np.random.default_rng(2)
+    C, M, N_1 = 2, 7, 4
+    Pro = np.zeros((C, M))
+    Pro[0, [2, 3]] = [0.4, 0.6]
+    Pro[1, [1, 2, 3]] = [0.2, 0.5, 0.3]
+    X_Nom = Generator.uniform(0, 30, (C, M, N_1))
+    Y_Nom = Generator.uniform(0, 11, (C, M, N_1))
+    X_Var = Generator.uniform(0.5, 6, (C, M, N_1))
+    Y_Var = Generator.uniform(0.02, 0.3, (C, M, N_1))
+    Need = Generator.uniform(size = (C, N_1)) < 0.6
+    Pool_Params = dict(Params, occ_pool = True, occ_workers = 2, N_Car = C, N_M = M, N = N_1 - 1)
+    Pool = Occupancy_Pool(Pool_Params)
+    assert Occupancy_Pool(Pool_Params).Shared is Pool.Shared
+    Occupancy = GMM_Occupancy(Params)
+    for method in ['mask', 'analytic', 'adaptive']:
+        OCC = Pool.Horizon_Bound(X_Nom, Y_Nom, X_Var, Y_Var, Pro, 0.1, method, Need)
+        assert np.array_equal(OCC, Occupancy.Horizon_Bound(X_Nom, Y_Nom, X_Var, Y_Var, Pro, 0.1, method, Need))
+    assert Occupancy.N_Call == np.sum(Need)
+    assert (Pool.Engine.N_Call, Pool.Engine.N_Cell_Sum) == (Occupancy.N_Call, Occupancy.N_Cell_Sum)
+
+@pytest.mark.parametrize('seed', range(6))
+def test_adaptive_edges_within_tol(seed):
+    Generator = np.random.default_rng(seed)
+    x_nom = Generator.uniform(0, 8, 3)
+    y_nom = Generator.choice([1.875, 5.625, 9.375], 3) + Generator.normal(0, 0.3, 3)
+    x_var = Generator.uniform(0.5, 6, 3)
+    y_var = Generator.uniform(0.02, 0.3, 3)
+    model_pro = Generator.dirichlet(np.ones(3))
+    Ref, hx, hy = Reference(x_nom, y_nom, x_var, y_var, model_pro, 0.1)
+    Occupancy = GMM_Occupancy(Params)
+    occ = Occupancy.GMM_Adaptive(x_nom, y_nom, x_var, y_var, model_pro, 3, 0.1)
+    err = np.abs(Edges(occ) - Ref)
+    assert np.all(err[0:2] <= Occupancy.tol + hx)
+    assert np.all(err[2:4] <= Occupancy.tol + hy)
+
+def test_reuse_translates_the_previous_occupancy():
+    Generator = np.random.default_rng(3)
+    x_nom = Generator.uniform(0, 30, (2, 5))
+    y_nom = Generator.uniform(0, 11, (2, 5))
+    x_var = Generator.uniform(0.5, 6, (2, 5))
+    y_var = Generator.uniform(0.02, 0.3, (2, 5))
+    MU = np.array([0, 0.4, 0.6])
+    Occupancy = GMM_Occupancy(Params)
+    Reuse = Occupancy_Reuse({'occ_reuse': True}, 'analytic')
+    for k, shift in enumerate([0.0, 3.0]):
+        Reuse.Cycle(k)
+        Pro, Anchor, Desc = Reuse.Describe(MU, x_nom + shift, y_nom, x_var, y_var)
+        OCC, Reused, Desc_Ref = Reuse.Lookup(0, Pro, Anchor, Desc)
+        for h in np.flatnonzero(~Reused):
+            OCC[:, h] = Occupancy.GMM_Analytic(x_nom[:, h] + shift, y_nom[:, h], x_var[:, h], y_var[:, h], MU[1:], 0.1)
+        Reuse.Store(0, Pro, Anchor, Desc_Ref, OCC)
+    assert np.all(Reused)
+    for h in range(5):
+        assert np.allclose(OCC[:, h], Occupancy.GMM_Analytic(x_nom[:, h] + 3.0, y_nom[:, h], x_var[:, h], y_var[:, h], MU[1:], 0.1), atol = 1e-9)
+
+@pytest.mark.parametrize('method', ['mask', 'contour'])
+def test_reuse_is_off_for_the_fixed_grid_engines(method):
+    with pytest.warns(UserWarning):
+        Reuse = Occupancy_Reuse({'occ_reuse': True}, method)
+    assert not Reuse.enable
@@ -0,0 +1,184 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CASE_1_ISAMPC_SIM'))
+from IAIMM_KF import IAIMM_KF
+
+def Build( ): # the attributes Fusion_Prim_Speed reads, lane geometry and speed limits of the cases
+    KF = IAIMM_KF.__new__(IAIMM_KF)
+    KF.DSV = 6
+    KF.N_M = 7
+    KF.L_Bound = [0, 3.75, 3.75*2, 3.75*3]
+    KF.SpeedLim = np.array([None, None, None])
+    KF.Lane_Mode = np.array([0, 1, 0, 1, 2, 1, 2])
+
+    return KF
+
+@pytest.mark.parametrize('y_pos', [(1.8, 1.9), (1.8, 5.6), (5.6, 5.7), (5.6, 9.4)])
+def test_mixed_covariance_is_per_mode(y_pos):
+    KF = Build( )
+    Generator = np.random.default_rng(0)
+    Pr = KF.ProTrans(KF.LookLane(y_pos[0]), KF.LookLane(y_pos[0]))
+    mu_k_1 = (Pr.sum(axis = 1) != 0)*Generator.uniform(0.1, 1, KF.N_M)
+    mu_k_1 = mu_k_1/mu_k_1.sum( )
+    x_hat_k_1 = Generator.normal(size = (KF.N_M, KF.DSV))*(mu_k_1 != 0)[:, None]
+    A = Generator.normal(size = (KF.N_M, KF.DSV, KF.DSV))
+    p_k_1 = (A@A.transpose(0, 2, 1) + np.eye(KF.DSV))*(mu_k_1 != 0)[:, None, None]
+    c, x_bar, p_bar, RefPrim = [Value[0] for Value in KF.Fusion_Prim_Speed(mu_k_1[None], x_hat_k_1[None], np.array([y_pos[0]]), np.array([y_pos[1]]), p_k_1[None])]
+    Pr = KF.ProTrans(KF.LookLane(y_pos[0]), KF.LookLane(y_pos[1]))
+    for i in np.flatnonzero(c != 0): # p_bar[i] = sum_j Pr[j, i] mu_j/c_i (P_j + (x_bar_i - x_j)(x_bar_i - x_j)^T)
+        p_ref = np.zeros((KF.DSV, KF.DSV))
+        for j in np.flatnonzero(mu_k_1 != 0):
+            X_k_k = x_bar[i] - x_hat_k_1[j]
+            p_ref = p_ref + Pr[j, i]*mu_k_1[j]/c[i]*(p_k_1[j] + np.outer(X_k_k, X_k_k))
+        assert np.allclose(p_bar[i], p_ref, rtol = 1e-12, atol = 1e-12)
+        assert RefPrim[i] == x_bar[i][1]
+
+def test_batch_is_rebuilt_per_step_and_on_a_rerun():
+    KF = Build( )
+    KF.imm_batch = True
+    KF.Batch = None
+    Calls = list( )
+    def Step_All(k, MU, X_Hat, P, Y, Car): # stands in for the batched Step of SVs 0 and 1
+        Calls.append(k)
+        KF.Batch = {'k': k, 'Row': {0: 0, 1: 1}, 'Left': {0, 1}, 'Result': [np.array([10*k, 10*k + 1])]}
+        return KF.Batch
+    KF.Step_All = Step_All
+    Served = [KF.Filtered(k, None, None, None, None, i)[0] for k, i in [(1, 0), (1, 1), (2, 1), (2, 0), (2, 0)]]
+    assert Served == [10, 11, 21, 20, 20]
+    assert Calls == [1, 2, 2]
+
+def test_batch_holds_only_the_caller_cars():
+    KF = Build( )
+    KF.N_Car = 4
+    KF.imm_batch = True
+    KF.Batch = None
+    MU = [[np.full(KF.N_M, 1/KF.N_M)]*KF.N_Car]
+    X_Hat = [[np.zeros((KF.N_M, KF.DSV))]*KF.N_Car]
+    P = [[np.zeros((KF.N_M, KF.DSV, KF.DSV))]*KF.N_Car]
+    Y = [[np.zeros(3)]*KF.N_Car]*2
+    def Step(mu_k_1, x_hat_k_1, p_k_1, y_k, y_pos_k_1): # stands in for the batched filter, one row per SV
+        return [np.arange(len(mu_k_1))]
+    KF.Step = Step
+    assert KF.Filtered(1, MU, X_Hat, P, Y, 2, Car = [0, 2])[0] == 1
+    assert KF.Batch['Row'] == {0: 0, 2: 1}
+    assert KF.Filtered(1, MU, X_Hat, P, Y, 0, Car = [0, 2])[0] == 0
+
+def test_innovation_matches_the_inverse_and_determinant(sv_params):
+    KF = Build( )
+    KF.H = sv_params['H']
+    KF.R = sv_params['R']
+    Generator = np.random.default_rng(2)
+    A = Generator.normal(size = (4, KF.N_M, KF.DSV, KF.DSV))
+    p_k_k_1 = A@A.transpose(0, 1, 3, 2) + 1e-3*np.eye(KF.DSV)
+    y_tilde = Generator.normal(scale = 1e-2, size = (4, KF.N_M, 3))
+    k_k, log_L_y = KF.Innovation(p_k_k_1, y_tilde)
+    for n, i in np.ndindex(4, KF.N_M):
+        s = KF.H@p_k_k_1[n, i]@KF.H.T + KF.R
+        assert np.allclose(k_k[n, i], p_k_k_1[n, i]@KF.H.T@np.linalg.pinv(s), rtol = 1e-8, atol = 1e-10)
+        L_y = np.exp(-1/2*y_tilde[n, i]@np.linalg.pinv(s)@y_tilde[n, i])/np.sqrt(np.linalg.det(2*np.pi*s))
+        assert log_L_y[n, i] == pytest.approx(np.log(L_y), rel = 1e-9)
+
+def test_log_likelihood_holds_where_the_density_underflows(sv_params):
+    KF = Build( )
+    s_chol = np.linalg.cholesky(sv_params['R'])
+    log_L_y = KF.LogLikelihood(s_chol, np.array([[1.0, 0, 0], [2.0, 0, 0]]))
+    assert np.all(np.isfinite(log_L_y))
+    assert log_L_y[0] - log_L_y[1] == pytest.approx(3/2/1e-5, rel = 1e-12)
+
+def test_steady_state_is_the_limit_of_the_riccati_recursion(sv_params):
+    KF = IAIMM_KF(dict(sv_params, kf_steady = True))
+    F = KF.Table.Phi[:, 1]
+    H = KF.H
+    for m in range(KF.N_M):
+        p_k_k_1 = KF.Q
+        for _ in range(3000): # the time-varying filter from P = Q
+            k_k = p_k_k_1@H.T@np.linalg.inv(H@p_k_k_1@H.T + KF.R)
+            p_k_k_1 = F[m]@(np.eye(KF.DSV) - k_k@H)@p_k_k_1@F[m].T + KF.Q
+        k_k = p_k_k_1@H.T@np.linalg.inv(H@p_k_k_1@H.T + KF.R)
+        assert np.allclose(KF.Steady['K'][m], k_k, rtol = 1e-6, atol = 1e-8)
+        assert np.allclose(KF.Steady['P'][m], (np.eye(KF.DSV) - k_k@H)@p_k_k_1, rtol = 1e-6, atol = 1e-10)
+        assert np.allclose(KF.Steady['S_chol'][m]@KF.Steady['S_chol'][m].T, H@p_k_k_1@H.T + KF.R, rtol = 1e-6, atol = 1e-12)
+        assert np.allclose(KF.Steady['A'][m], (np.eye(KF.DSV) - k_k@H)@F[m], rtol = 1e-6, atol = 1e-8)
+
+def test_steady_state_iterates_the_recursion_without_a_dare_solution(sv_params, monkeypatch):
+    Steady = IAIMM_KF(dict(sv_params, kf_steady = True)).Steady
+    def solve_discrete_are(*args): # no stabilizing solution
+        raise np.linalg.LinAlgError
+    monkeypatch.setattr(sys.modules['IAIMM_KF'].sl, 'solve_discrete_are', solve_discrete_are)
+    Iterated = IAIMM_KF(dict(sv_params, kf_steady = True)).Steady
+    for key in ['K', 'P', 'A']:
+        assert np.allclose(Iterated[key], Steady[key], rtol = 1e-6, atol = 1e-8)
+
+def Projection(KF, Generator): # longitudinal rows of a random mode against the other cars at random positions and speeds, about a third selected
+    N = KF.N
+    C = KF.N_Car - 1
+    t = KF.Ts*np.arange(1, N + 1)
+    A, B = KF.Table.Longitudinal(Generator.integers(0, KF.N_M), np.array([0, Generator.uniform(15, 30), Generator.uniform(-1, 1)]))
+    X_SV = Generator.uniform(-60, 80, (C, 1)) + Generator.uniform(15, 30, (C, 1))*t
+    SEL = Generator.random(N*C) < 0.3
+
+    return np.tile(A.reshape(N, 1), (C, 1)), np.tile(B.reshape(N, 1), (C, 1)), X_SV.reshape(N*C, 1), Generator.uniform(10, 35), SEL
+
+def test_analytic_projection_matches_the_ipopt_qcqp(sv_params, no_hsl):
+    KF = IAIMM_KF(dict(sv_params, qcqp_method = 'analytic'))
+    Reference = IAIMM_KF(dict(sv_params, qcqp_method = 'ipopt'))
+    Generator = np.random.default_rng(0)
+    n_closed = 0
+    n_active = 0
+    n_fallback = 0
+    for _ in range(100):
+        A, B, X_SV, v_pri, SEL = Projection(KF, Generator)
+        v_ref = Reference.Solve_QCQP(A, B, X_SV, v_pri, SEL)
+        v_up = KF.AnalyticProj(A, B, X_SV, v_pri, SEL)
+        if v_up is None:
+            n_fallback = n_fallback + 1
+        else:
+            n_closed = n_closed + 1
+            n_active = n_active + (v_up != v_pri)
+            assert v_up == pytest.approx(v_ref, abs = 1e-5)
+        assert KF.Solve_QCQP(A, B, X_SV, v_pri, SEL) == pytest.approx(v_ref, abs = 1e-5)
+    assert n_closed >= 10 and n_active >= 5 and n_fallback >= 10
+    assert Reference.Solve_QCQP(A, B, X_SV, v_pri, np.zeros_like(SEL)) == pytest.approx(v_pri, abs = 1e-6)
+    assert KF.AnalyticProj(A, B, X_SV, v_pri, np.zeros_like(SEL)) == v_pri
+
+def Mode_State(KF, Generator): # initial longitudinal and lateral states and references of a mode
+    x_ini = np.array([0, Generator.uniform(15, 30), Generator.normal( )])
+    y_ini = np.array([Generator.uniform(0, 11), Generator.normal(scale = 0.3), Generator.normal(scale = 0.1)])
+
+    return x_ini, Generator.uniform(15, 30), y_ini, KF.L_Center[Generator.integers(0, 3)]
+
+def test_exact_variance_is_the_variance_over_the_whole_gain_set(sv_params):
+    KF = IAIMM_KF(dict(sv_params, var_method = 'exact'))
+    Generator = np.random.default_rng(3)
+    for m in range(KF.N_M):
+        x_ini, x_ref, y_ini, y_ref = Mode_State(KF, Generator)
+        lateral = KF.Table.Set_Lat[m] is not None
+        var_x, var_y = KF.ExactVariance(m, lateral, x_ini, x_ref, y_ini, y_ref)
+        assert np.allclose(var_x, np.var(KF.Table.Set_Lon[m]@np.append(x_ini, x_ref), axis = 0), rtol = 1e-8, atol = 1e-10)
+        if lateral:
+            assert np.allclose(var_y, np.var(KF.Table.Set_Lat[m]@np.append(y_ini, y_ref), axis = 0), rtol = 1e-8, atol = 1e-10)
+        else:
+            assert var_y is None
+
+def test_sampled_variance_draws_k_sampling_gain_sets(sv_params):
+    KF = IAIMM_KF(dict(sv_params, var_seed = 7))
+    Generator = np.random.default_rng(4)
+    Draws = np.random.default_rng(7) # the same stream as the filter
+    for m in [1, 4]: # lane-changing modes, a longitudinal and a lateral gain set per draw
+        x_ini, x_ref, y_ini, y_ref = Mode_State(KF, Generator)
+        var_x, var_y = KF.SampledVariance(m, True, x_ini, x_ref, y_ini, y_ref)
+        r = Draws.integers(0, len(sv_params['std_parameters'][m][0]), KF.K_sampling)
+        assert np.allclose(var_x, np.var(KF.Table.Set_Lon[m][r]@np.append(x_ini, x_ref), axis = 0), rtol = 1e-12, atol = 1e-12)
+        assert np.allclose(var_y, np.var(KF.Table.Set_Lat[m][r]@np.append(y_ini, y_ref), axis = 0), rtol = 1e-12, atol = 1e-12)
+
+@pytest.mark.parametrize('var_method', ['sampling', 'exact'])
+def test_lane_keeping_modes_take_the_lateral_deviation_of_the_mode(sv_params, var_method):
+    KF = IAIMM_KF(dict(sv_params, var_method = var_method, var_seed = 0))
+    x_ini, x_ref, y_ini, y_ref = Mode_State(KF, np.random.default_rng(5))
+    for m, y_k, lat_index in [(0, 1.8, 0), (1, 5.6, 3), (4, 9.4, 6)]:
+        var_y, var_x = KF.EstimateUncertainty(y_k, m, x_ini, x_ref, y_ini, y_ref)
+        assert var_y[0] == 0 and np.all(var_y[1:] == sv_params['std_parameters'][lat_index][1][0]**2)
+        assert var_x.shape == (KF.N + 1, ) and var_x[0] == pytest.approx(0, abs = 1e-12) and np.all(var_x[1:] > 0)
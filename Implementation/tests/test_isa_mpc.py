@@ -0,0 +1,111 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CASE_1_ISAMPC_SIM'))
+from ISA_MPC import ISA_MPC
+from GMM_Occupancy import GMM_Occupancy
+from Occupancy_Cache import Occupancy_Cache
+
+def Build(Params = dict( )): # the attributes the occupancy methods read, without the MPC problem
+    Params = dict({'w_veh': 1.8, 'l_veh': 4.3, 'zeta_l': 0.5, 'zeta_w': 0.5, 'occ_method': 'analytic'}, **Params)
+    MPC = ISA_MPC.__new__(ISA_MPC)
+    MPC.epsilon = 0.1
+    MPC.occ_method = Params['occ_method']
+    MPC.Occupancy = GMM_Occupancy(Params)
+    MPC.Cache = Occupancy_Cache(Params)
+
+    return MPC
+
+def Horizon(seed, M = 3, H = 26): # modes (M, H) of one SV over the horizon
+    Generator = np.random.default_rng(seed)
+    x_nom = np.cumsum(Generator.uniform(0, 8, (M, H)), axis = 1)
+    y_nom = Generator.uniform(0, 11, (M, H))
+    x_var = Generator.uniform(0.5, 6, (M, H))
+    y_var = Generator.uniform(0.02, 0.3, (M, H))
+    model_pro = Generator.dirichlet(np.ones(M))
+
+    return x_nom, y_nom, x_var, y_var, model_pro
+
+@pytest.mark.parametrize('method', ['analytic', 'mask'])
+@pytest.mark.parametrize('cache', [False, True])
+def test_horizon_matches_the_step_by_step_model(method, cache):
+    x_nom, y_nom, x_var, y_var, model_pro = Horizon(0)
+    MPC = Build({'occ_method': method, 'occ_cache': cache})
+    OCC = MPC.GMM_Horizon(x_nom, y_nom, x_var, y_var, model_pro, len(model_pro))
+    Ref = Build({'occ_method': method})
+    for h in range(x_nom.shape[1]):
+        occ = Ref.GMM_Model(x_nom[:, h], y_nom[:, h], x_var[:, h], y_var[:, h], model_pro, len(model_pro))
+        assert np.allclose(OCC[:, h], occ, rtol = 1e-12, atol = 1e-12)
+    if cache:
+        assert MPC.Cache.N_Miss == x_nom.shape[1]
+        assert np.allclose(MPC.GMM_Horizon(x_nom, y_nom, x_var, y_var, model_pro, len(model_pro)), OCC, rtol = 1e-12, atol = 1e-12)
+        assert MPC.Cache.N_Hit == x_nom.shape[1]
+
+def test_horizon_of_no_steps_is_empty():
+    x_nom, y_nom, x_var, y_var, model_pro = Horizon(1, H = 0)
+    assert Build( ).GMM_Horizon(x_nom, y_nom, x_var, y_var, model_pro, len(model_pro)).shape == (4, 0)
+
+@pytest.mark.parametrize('case, name', [('CASE_1_ISAMPC_SIM', 'ISA_MPC'), ('CASE_2_SCMPC_SIM', 'SC_MPC'), ('CASE_3_ISAMPC_SIM', 'ISA_MPC'), ('CASE_4_ISAMPC_HDDATA_SIM', 'ISA_MPC')])
+def test_analytic_projection_matches_the_ipopt_qp(case, name, load, no_hsl):
+    Class = getattr(load(case, name), name)
+    Planner = dict( )
+    for method in ['analytic', 'ipopt']:
+        Planner[method] = Class.__new__(Class)
+        Planner[method].Th_QP = 2
+        Planner[method].l_veh = 4.3
+        Planner[method].qp_method = method
+        Planner[method].LongVelProj = dict( )
+    Generator = np.random.default_rng(0)
+    N, C = 25, 5
+    t = 0.32*np.arange(1, N + 1)
+    n_active = 0
+    for _ in range(60): # EV rows A*v_up + B against the other cars at random positions and speeds, about a third selected
+        A = np.tile((t - Generator.uniform(0, 0.3)*(1 - np.exp(-t))).reshape(N, 1), (C, 1))
+        B = np.full((N*C, 1), Generator.uniform(-1, 1))
+        X_SV = (Generator.uniform(-20, 120, (C, 1)) + Generator.uniform(15, 30, (C, 1))*t).reshape(N*C, 1)
+        SEL = Generator.random(N*C) < 0.3
+        v_pri = Generator.uniform(10, 35)
+        v_ref = Planner['ipopt'].Solve_QP(A, B, X_SV, v_pri, SEL)
+        v_up = Planner['analytic'].AnalyticProj(A, B, X_SV, v_pri, SEL)
+        n_active = n_active + (v_up != v_pri)
+        assert v_up == pytest.approx(v_ref, abs = 1e-5)
+        assert Planner['analytic'].Solve_QP(A, B, X_SV, v_pri, SEL) == pytest.approx(v_ref, abs = 1e-5)
+    assert 10 <= n_active < 60
+    assert Planner['ipopt'].Solve_QP(A, B, X_SV, v_pri, np.zeros_like(SEL)) == pytest.approx(v_pri, abs = 1e-6)
+
+def Lane_Reference(L_Bound, y_k): # scalar lane rule the vectorized LookLane replaced
+    if y_k <= L_Bound[1]:
+        return 1
+    elif y_k <= L_Bound[2]:
+        return 2
+
+    return 3
+
+@pytest.mark.parametrize('case', ['CASE_1_ISAMPC_SIM', 'CASE_3_ISAMPC_SIM', 'CASE_4_ISAMPC_HDDATA_SIM'])
+def test_lane_leader_matches_the_per_lane_loop(case, load):
+    Class = load(case, 'ISA_MPC').ISA_MPC
+    MPC = Class.__new__(Class)
+    MPC.N_Lane = 3
+    MPC.L_Bound = [0, 3.75, 3.75*2, 3.75*3]
+    MPC.infinity = 100000
+    Generator = np.random.default_rng(0)
+    N_Car, N_1 = 6, 26
+    y = np.concatenate((Generator.uniform(-1, 12, N_Car*N_1 - 4), [3.75, 7.5, 0, 11.25])).reshape(N_Car, N_1) # boundaries included
+    assert np.array_equal(MPC.LookLane(y), [[Lane_Reference(MPC.L_Bound, y_k) for y_k in Row] for Row in y])
+    assert MPC.LookLane(3.75) == 1 and MPC.LookLane(3.76) == 2
+    x_position = Generator.uniform(0, 200, (N_Car, N_1))
+    Y_Mark = [MPC.LookLane(y + Offset) for Offset in [1, 0, -1]]
+    x_position[4] = MPC.infinity # an SV that is not loaded
+    for Mark in Y_Mark:
+        Mark[4] = 0
+    Y_Mark[0][2, 3:] = 0 # no SV in lane 3 at some steps
+    X_DV_Lane = MPC.LaneLeader(x_position, *Y_Mark)
+    Ref = [np.array([MPC.infinity]*N_1) for i in range(MPC.N_Lane)] # per-lane buffers of the loop, of the dtype of infinity
+    for i in range(MPC.N_Lane):
+        for k in range(N_1):
+            Ref[i][k] = min([np.min(x_position[:, k][Mark[:, k] == i + 1], initial = MPC.infinity) for Mark in Y_Mark])
+    assert len(X_DV_Lane) == MPC.N_Lane
+    for i in range(MPC.N_Lane):
+        assert X_DV_Lane[i].dtype == Ref[i].dtype and np.array_equal(X_DV_Lane[i], Ref[i])
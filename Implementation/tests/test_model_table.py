@@ -0,0 +1,47 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CASE_1_ISAMPC_SIM'))
+from Model_Table import Model_Table
+
+def Simulate(Table, K_Lon, K_Lat, x_ini, vx_ref, y_ref, n_step): # step-by-step rollout of the velocity and lane tracking models, (6, n_step+1)
+    A_Lon, B_Lon = Table.LongMatrices(np.ravel(K_Lon)[None, :])
+    A_Lat, B_Lat = Table.LatMatrices(np.ravel(K_Lat)[None, :])
+    X = np.zeros((6, n_step + 1))
+    X[:, 0] = x_ini
+    for i in range(n_step):
+        X[0:3, i+1] = A_Lon[0]@X[0:3, i] + B_Lon[0]*vx_ref
+        X[3:6, i+1] = A_Lat[0]@X[3:6, i] + B_Lat[0]*y_ref
+
+    return X
+
+def test_rollout_matches_the_step_by_step_models(sv_params):
+    Table = Model_Table(sv_params)
+    Generator = np.random.default_rng(0)
+    for m, Model in enumerate(sv_params['Models']):
+        x_ini = np.array([Generator.uniform(0, 50), Generator.uniform(15, 30), Generator.normal( ), Generator.uniform(0, 11), Generator.normal( ), Generator.normal( )])
+        vx_ref = Generator.uniform(15, 30)
+        y_ref = sv_params['L_Center'][Generator.integers(0, 3)]
+        X = Simulate(Table, Model[0], Model[1], x_ini, vx_ref, y_ref, sv_params['N'])
+        F, X_Table = Table.Rollout(m, x_ini, vx_ref, y_ref, sv_params['N'])
+        assert np.allclose(X_Table, X, rtol = 1e-12, atol = 1e-9)
+        assert np.allclose(F[0:3, 0:3], Table.LongMatrices(np.ravel(Model[0])[None, :])[0][0]) and np.allclose(F[3:6, 3:6], Table.LatMatrices(np.ravel(Model[1])[None, :])[0][0])
+        assert np.allclose(Table.Lateral(m, x_ini[3:6], y_ref), X[3], rtol = 1e-12, atol = 1e-9)
+        A, B = Table.Longitudinal(m, x_ini[0:3])
+        assert np.allclose(A*vx_ref + B, X[0, 1:], rtol = 1e-12, atol = 1e-9)
+
+def test_gain_set_responses_match_the_step_by_step_models(sv_params):
+    Table = Model_Table(sv_params)
+    Generator = np.random.default_rng(1)
+    for m in range(len(sv_params['Models'])):
+        x_ini = np.array([0, Generator.uniform(15, 30), Generator.normal( ), Generator.uniform(0, 11), Generator.normal( ), Generator.normal( )])
+        vx_ref = Generator.uniform(15, 30)
+        y_ref = sv_params['L_Center'][Generator.integers(0, 3)]
+        for j in Generator.integers(0, len(sv_params['std_parameters'][m][0]), 5):
+            K_Lat = sv_params['Models'][m][1] if Table.Set_Lat[m] is None else sv_params['std_parameters'][m][1][j]
+            X = Simulate(Table, sv_params['std_parameters'][m][0][j], K_Lat, x_ini, vx_ref, y_ref, sv_params['N'])
+            assert np.allclose(Table.Set_Lon[m][j]@np.append(x_ini[0:3], vx_ref), X[0], rtol = 1e-12, atol = 1e-9)
+            if Table.Set_Lat[m] is not None:
+                assert np.allclose(Table.Set_Lat[m][j]@np.append(x_ini[3:6], y_ref), X[3], rtol = 1e-12, atol = 1e-9)
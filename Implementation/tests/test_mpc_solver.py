@@ -0,0 +1,154 @@
+import os
+import sys
+import numpy as np
+import casadi
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CASE_1_ISAMPC_SIM'))
+from MPC_Solver import MPC_Solver, Function_Cache, Functions
+
+def Build(method, Params = dict( ), Options = dict( )): # min (x - p)^2 s.t. x^2 >= 1: feasible, but its linearization at x = 0 (0*dx >= 1) is an infeasible QP
+    opti = casadi.Opti( )
+    x = opti.variable( )
+    p = opti.parameter( )
+    opti.minimize((x - p)**2)
+    opti.subject_to(x**2 >= 1)
+    opts = dict({"ipopt.print_level": 0, "print_time": False}, **Options)
+
+    return MPC_Solver(dict(Params, mpc_solver = method), opti, [p], [x], opts, dict( ), 'test_' + method)
+
+def Chain(method, Params = dict( ), n = 8): # min |x - p|^2 + |diff(x)|^2 s.t. x <= 1 over a horizon of n steps, a QP
+    opti = casadi.Opti( )
+    x = opti.variable(1, n)
+    p = opti.parameter(1, n)
+    opti.minimize(casadi.sumsqr(x - p) + casadi.sumsqr(x[:, 1:] - x[:, 0:-1]))
+    opti.subject_to(x <= 1)
+    opts = {"ipopt.print_level": 0, "print_time": False}
+    opts_warm = {"ipopt.warm_start_init_point": "yes", "ipopt.mu_init": 1e-6}
+
+    return MPC_Solver(dict(Params, mpc_solver = method), opti, [p], [x], opts, opts_warm, 'chain_' + method)
+
+@pytest.mark.parametrize('method', ['rti', 'ltv'])
+def test_infeasible_warm_step_falls_back_to_ipopt(method):
+    Solver = Build(method)
+    x = Solver(0.5, Guess = [np.zeros((1, 1))])
+    Stats = Solver.Stats[-1]
+    assert Stats['warm']
+    assert Stats['fallback'] is not None
+    assert Stats['status'] == Solver.Solver.stats( )['return_status'] == 'Solve_Succeeded'
+    assert float(x) == pytest.approx(1, abs = 1e-6)
+    assert Solver.Summary( )['warm']['fallback'] == 1
+
+@pytest.mark.parametrize('method', ['rti', 'ltv'])
+def test_feasible_warm_step_is_kept(method):
+    Solver = Build(method)
+    x = Solver(2.0, Guess = [np.full((1, 1), 2.0)])
+    Stats = Solver.Stats[-1]
+    assert Stats['fallback'] is None
+    assert Stats['status'] == method.upper( )
+    assert float(x) == pytest.approx(2, abs = 1e-6)
+
+def test_codegen_builds_in_a_private_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cwd = os.getcwd( )
+    Solver = Build('ipopt', {'mpc_codegen': True, 'codegen_dir': 'cg'})
+    assert os.getcwd( ) == cwd
+    Files = sorted(os.listdir(tmp_path/'cg'))
+    assert [os.path.splitext(f)[1] for f in Files] == ['.c', '.so']
+    os.chdir(tmp_path.parent)
+    assert float(Solver(2.0, Guess = [np.full((1, 1), 2.0)])) == pytest.approx(2, abs = 1e-6)
+
+def test_codegen_cache_is_keyed_on_the_solver_options(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for Options in [dict( ), {'ipopt.tol': 1e-10}, dict( )]:
+        Build('ipopt', {'mpc_codegen': True, 'codegen_dir': 'cg'}, Options)
+    assert len([f for f in os.listdir(tmp_path/'cg') if f.endswith('.so')]) == 2
+
+def test_sparsity_pattern_waits_for_summary():
+    Solver = Build('ipopt')
+    assert Solver.Pattern is None
+    assert Solver.Summary( )['pattern'] == {'nx': 1, 'ng': 1, 'nnz_jac_g': 1, 'nnz_hess_l': 1, 'density_jac_g': 1.0, 'density_hess_l': 1.0}
+
+def test_shift_is_a_cold_start_off_the_receding_horizon():
+    Solver = Chain('ipopt', {'mpc_warm': True})
+    Solver.Cycle(1)
+    assert Solver.Shift(None, 0.5) is None
+    Solver.Store(None, [np.arange(8.0)[None, :]])
+    Solver.Cycle(2)
+    Guess = Solver.Shift(None, 0.5)
+    assert np.array_equal(Guess[0], [[0.5, 2, 3, 4, 5, 6, 7, 7]])
+    Solver.Cycle(4)
+    assert Solver.Shift(None, 0.5) is None
+    assert Chain('ipopt').Shift(None, 0.5) is None
+
+def test_warm_start_reaches_the_cold_solution_in_fewer_iterations():
+    Cold = Chain('ipopt')
+    Warm = Chain('ipopt', {'mpc_warm': True})
+    Target = 2*np.sin(0.3*np.arange(12)) # moves along the horizon from cycle to cycle
+    x = np.zeros((1, 8))
+    for k in range(1, 5):
+        Warm.Cycle(k)
+        Guess = Warm.Shift(None, x[0, 1])
+        x = np.array(Warm(Target[None, k:k+8], Guess = Guess, Lam = None if Guess is None else Warm.Lam))
+        Warm.Store(None, [x])
+        assert np.allclose(x, np.array(Cold(Target[None, k:k+8])), atol = 1e-6)
+    assert [Stats['warm'] for Stats in Warm.Stats] == [False, True, True, True]
+    assert all(Warm.Stats[k]['iter_count'] < Cold.Stats[k]['iter_count'] for k in range(1, 4))
+    Summary = Warm.Summary( )
+    assert Summary['cold']['calls'] == 1 and Summary['warm']['calls'] == 3
+    assert Summary['warm']['fallback'] == 0
+
+@pytest.mark.parametrize('qpsol, tol', [('qrqp', 1e-6), ('osqp', 1e-4)])
+def test_ltv_step_of_a_qp_is_the_ipopt_solution(qpsol, tol):
+    Target = 2*np.sin(0.3*np.arange(1, 9))[None, :] # partly above the bound x <= 1
+    Reference = Chain('ipopt')
+    x_ref = np.array(Reference(Target))
+    Solver = Chain('ltv', {'ltv_qpsol': qpsol})
+    x = np.array(Solver(Target, Guess = [np.full((1, 8), 5.0)]))
+    assert Solver.Stats[-1]['status'] == 'LTV' and Solver.Stats[-1]['iter_count'] == 1 and Solver.Stats[-1]['fallback'] is None
+    assert np.allclose(x, x_ref, atol = tol)
+    assert np.allclose(np.array(Solver.Lam[1]), np.array(Reference.Lam[1]), atol = 10*tol)
+
+def test_ltv_falls_back_on_a_non_finite_linearization():
+    Target = 2*np.sin(0.3*np.arange(1, 9))[None, :]
+    Solver = Chain('ltv')
+    x = np.array(Solver(Target, Guess = [np.full((1, 8), np.nan)]))
+    assert Solver.Stats[-1]['fallback'] == 'QP: non-finite linearization'
+    assert Solver.Stats[-1]['status'] == 'Solve_Succeeded'
+    assert np.allclose(x, np.array(Chain('ipopt')(Target)), atol = 1e-8)
+
+def test_function_cache_saves_and_loads(tmp_path):
+    x = casadi.SX.sym('x')
+    Built = list( )
+    def Make( ): # counts the builds
+        Built.append(1)
+        return casadi.Function('f', [x], [x**2 + 1])
+    Cache = Function_Cache( )
+    F = Cache.Get('f', Make, str(tmp_path))
+    assert Cache.Get('f', Make, str(tmp_path)) is F
+    assert os.listdir(tmp_path) == ['f.casadi']
+    Fresh = Function_Cache( ) # another process
+    G = Fresh.Get('f', Make, str(tmp_path))
+    assert float(G(3)) == float(F(3)) == 10
+    assert len(Built) == 1
+    assert (Cache.N_Hit, Cache.N_Load, Cache.N_Miss) == (1, 0, 1)
+    assert (Fresh.N_Hit, Fresh.N_Load, Fresh.N_Miss) == (0, 1, 0)
+    Fresh.Clear( )
+    assert Fresh.Summary( ) == {'hit': 0, 'load': 0, 'miss': 0, 't_load_mean': 0.0, 't_build_mean': 0.0}
+    assert Fresh.Table == dict( )
+
+def test_solvers_of_one_nlp_share_the_cached_solver(tmp_path):
+    Functions.Clear( )
+    try:
+        Params = {'fn_cache': True, 'fn_cache_dir': str(tmp_path)}
+        First = Chain('ipopt', Params)
+        Second = Chain('ipopt', Params)
+        assert Second.Solver is First.Solver
+        Functions.Clear( ) # a new process: the solver is loaded from disk, not rebuilt
+        Loaded = Chain('ipopt', Params)
+        assert Functions.Summary( )['load'] == 1 and Functions.Summary( )['miss'] == 0
+        Target = 2*np.sin(0.3*np.arange(1, 9))[None, :]
+        assert np.allclose(np.array(Loaded(Target)), np.array(Chain('ipopt')(Target)), atol = 1e-10)
+        assert len([f for f in os.listdir(tmp_path) if f.endswith('.casadi')]) == 1
+    finally:
+        Functions.Clear( )
@@ -0,0 +1,52 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'CASE_1_ISAMPC_SIM'))
+from Occupancy_Cache import Occupancy_Cache
+from GMM_Occupancy import GMM_Occupancy
+
+Modes = [np.array([12.0, 20.0]), np.array([1.8, 5.6]), np.array([2.0, 3.5]), np.array([0.1, 0.2]), np.array([0.4, 0.6])] # x_nom, y_nom, x_var, y_var, model_pro
+
+def Shifted(x, y): # Modes translated by (x, y)
+    return [Modes[0] + x, Modes[1] + y] + Modes[2:]
+
+def test_translated_mixture_hits_and_is_shifted_back():
+    Cache = Occupancy_Cache({'occ_cache': True})
+    key, origin = Cache.Key(*Modes, 0.1)
+    Cache.Store(key, origin, np.array([16.0, 3.7, 6.0, 2.5]))
+    key, origin = Cache.Key(*Shifted(100.0, 3.75), 0.1)
+    assert np.allclose(Cache.Lookup(key, origin), [116.0, 7.45, 6.0, 2.5], rtol = 1e-12)
+    assert (Cache.N_Hit, Cache.N_Miss) == (1, 0)
+
+def test_key_holds_the_shape_of_the_mixture_and_epsilon():
+    Cache = Occupancy_Cache({'occ_cache': True, 'occ_cache_tol': 0.01})
+    key = Cache.Key(*Modes, 0.1)[0]
+    assert Cache.Key(*Shifted(0.003, 0), 0.1)[0] == key # within the quantization
+    assert Cache.Key(*Shifted(0.003, 0), 0.2)[0] != key
+    assert Cache.Key(Modes[0] + [0, 0.05], *Modes[1:], 0.1)[0] != key # mode spacing changed
+    assert Cache.Key(*Modes[0:4], Modes[4][::-1], 0.1)[0] != key
+    assert Cache.Key(*Modes[0:4], Modes[4] + 0.0004, 0.1)[0] == key
+
+def test_least_recently_used_entry_is_evicted():
+    Cache = Occupancy_Cache({'occ_cache': True, 'occ_cache_size': 2})
+    Keys = [Cache.Key(*Modes, epsilon) for epsilon in [0.1, 0.2, 0.3]]
+    for key, origin in Keys[0:2]:
+        Cache.Store(key, origin, np.ones(4))
+    assert Cache.Lookup(*Keys[0]) is not None # now the most recent
+    Cache.Store(*Keys[2], np.ones(4))
+    assert Cache.Lookup(*Keys[1]) is None
+    assert Cache.Lookup(*Keys[0]) is not None and Cache.Lookup(*Keys[2]) is not None
+    Cache.Clear( )
+    assert (len(Cache.Table), Cache.N_Hit, Cache.N_Miss) == (0, 0, 0)
+
+@pytest.mark.parametrize('method', ['mask', 'analytic'])
+def test_cached_occupancy_of_a_translated_mixture_is_the_computed_one(method):
+    Occupancy = GMM_Occupancy({'w_veh': 1.8, 'l_veh': 4.3, 'zeta_l': 0.5, 'zeta_w': 0.5})
+    Engine = Occupancy.GMM_Mask if method == 'mask' else (lambda *Mixture: Occupancy.GMM_Analytic(*Mixture[0:5], Mixture[6]))
+    Cache = Occupancy_Cache({'occ_cache': True})
+    key, origin = Cache.Key(*Modes, 0.1)
+    Cache.Store(key, origin, Engine(*Modes, 2, 0.1))
+    key, origin = Cache.Key(*Shifted(57.3, 3.75), 0.1)
+    assert np.allclose(Cache.Lookup(key, origin), Engine(*Shifted(57.3, 3.75), 2, 0.1), rtol = 0, atol = 1e-6)